@@ -0,0 +1,85 @@
+"""Per-object overhead of an event loop per batch versus one event loop for the whole run.
+
+Before, `get_objects`, `download` and `_perform_downloads` each called `asyncio.run` once per batch, so a
+large manifest created and tore down thousands of event loops (and every pooled connection with them).
+
+Usage:
+
+    python benchmarks/event_loop.py --objects 100000 --batch-size 10
+"""
+import argparse
+import asyncio
+import time
+
+from drs_downloader import event_loop
+from drs_downloader.manager import DrsAsyncManager
+from drs_downloader.models import Checksum, DrsClient, DrsObject
+
+
+class InstantDrsClient(DrsClient):
+    """Resolve objects without any I/O so that only the scheduling overhead is measured."""
+
+    async def get_object(self, object_id: str, verbose: bool = False) -> DrsObject:
+        await asyncio.sleep(0)
+        return DrsObject(
+            self_uri=object_id, id=object_id, checksums=[Checksum("0", "md5")], size=1, name=object_id
+        )
+
+    async def sign_url(self, drs_object: DrsObject, user_project: str = None, verbose: bool = False) -> DrsObject:
+        return drs_object
+
+    async def download_part(self, drs_object, start, size, destination_path, verbose=False):
+        return None
+
+
+def loop_per_batch(object_ids, batch_size):
+    """The previous behaviour: a new event loop for every batch."""
+    client = InstantDrsClient()
+    drs_objects = []
+    for chunk in DrsAsyncManager.chunker(object_ids, batch_size):
+
+        async def _batch():
+            return await asyncio.gather(*[client.get_object(object_id) for object_id in chunk])
+
+        drs_objects.extend(asyncio.run(_batch()))
+    return drs_objects
+
+
+def one_loop(object_ids, batch_size, loop_name):
+    """One event loop for the whole run."""
+    manager = DrsAsyncManager(
+        InstantDrsClient(),
+        show_progress=False,
+        max_simultaneous_object_retrievers=batch_size,
+        event_loop_name=loop_name,
+    )
+    return manager.get_objects(object_ids, verbose=False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--objects", type=int, default=100_000)
+    parser.add_argument("--batch-size", type=int, default=10)
+    args = parser.parse_args()
+
+    object_ids = [f"drs://benchmark/{i}" for i in range(args.objects)]
+
+    t0 = time.perf_counter()
+    assert len(loop_per_batch(object_ids, args.batch_size)) == args.objects
+    baseline = time.perf_counter() - t0
+    print(f"loop per batch   {baseline:8.3f}s  {baseline / args.objects * 1e6:8.2f} us/object")
+
+    loop_names = ["asyncio"] + (["uvloop"] if event_loop.uvloop_available() else [])
+    for loop_name in loop_names:
+        t0 = time.perf_counter()
+        assert len(one_loop(object_ids, args.batch_size, loop_name)) == args.objects
+        elapsed = time.perf_counter() - t0
+        saved = (baseline - elapsed) / args.objects * 1e6
+        print(
+            f"one {loop_name:12} {elapsed:8.3f}s  {elapsed / args.objects * 1e6:8.2f} us/object"
+            f"  ({saved:.2f} us/object saved)"
+        )
+
+
+if __name__ == "__main__":
+    main()
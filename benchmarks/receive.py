@@ -0,0 +1,117 @@
+"""CPU time to write received chunks to disk, one write per chunk versus pooled buffers written by one thread.
+
+Before, `download_part` wrote every network chunk as it came, through aiofiles for part files or `asyncio.to_thread`
+and `pwrite` in a preallocated file: one thread pool hop and one small write per chunk. Now the chunks are copied
+into pooled buffers and only full buffers are written, by the disk writer thread (see `buffers`). The chunks are
+made here rather than received, so the numbers are the cost of writing alone; the CPU time is that of the whole
+process, every thread included.
+
+Usage:
+
+    python benchmarks/receive.py --size-gb 2 --chunk-kb 16 --dir /mnt/scratch
+"""
+import argparse
+import asyncio
+import os
+import shutil
+import tempfile
+import time
+import zlib
+from pathlib import Path
+
+import aiofiles
+
+from drs_downloader import GB, KB, MB
+from drs_downloader.writers import PartFiles, PreallocatedFile
+
+PARTS = 4
+
+
+_block = {}
+
+
+def _received(size: int, chunk_size: int):
+    """A new bytes object per chunk, as aiohttp hands them over."""
+    block = _block.setdefault(chunk_size, os.urandom(chunk_size))
+    for _ in range(size // chunk_size):
+        yield bytes(block)
+
+
+async def aiofiles_per_chunk(directory: Path, size: int, chunk_size: int):
+    """The previous part files: an aiofiles write per chunk."""
+    async def part(i):
+        crc = 0
+        async with aiofiles.open(directory / f"object.{i}.part", "wb") as f:
+            for data in _received(size // PARTS, chunk_size):
+                await f.write(data)
+                crc = zlib.crc32(data, crc)
+            await f.flush()
+    await asyncio.gather(*(part(i) for i in range(PARTS)))
+
+
+async def pwrite_per_chunk(directory: Path, size: int, chunk_size: int):
+    """The previous preallocated file: a pwrite in the thread pool per chunk."""
+    fd = os.open(directory / "object.download", os.O_RDWR | os.O_CREAT, 0o644)
+    os.ftruncate(fd, size)
+
+    async def part(i):
+        crc = 0
+        offset = i * (size // PARTS)
+        for data in _received(size // PARTS, chunk_size):
+            await asyncio.to_thread(os.pwrite, fd, data, offset)
+            offset += len(data)
+            crc = zlib.crc32(data, crc)
+    try:
+        await asyncio.gather(*(part(i) for i in range(PARTS)))
+    finally:
+        os.close(fd)
+
+
+async def pooled(writer, directory: Path, size: int, chunk_size: int):
+    """Now: the part sinks, chunks collected in pooled buffers."""
+    part_size = size // PARTS
+    writer.prepare("object", size, directory, part_size)
+
+    async def part(i):
+        sink = await writer.open("object", i * part_size, (i + 1) * part_size - 1, directory)
+        for data in _received(part_size, chunk_size):
+            await sink.write(data)
+        await sink.close()
+    try:
+        await asyncio.gather(*(part(i) for i in range(PARTS)))
+    finally:
+        writer.close("object", directory)
+        writer.done("object", directory)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size-gb", type=float, default=1)
+    parser.add_argument("--chunk-kb", type=int, default=16)
+    parser.add_argument("--dir", default=None, help="Scratch directory on the filesystem to measure")
+    args = parser.parse_args()
+
+    chunk_size = args.chunk_kb * KB
+    size = int(args.size_gb * GB) // (PARTS * chunk_size) * PARTS * chunk_size
+    runs = [
+        ("aiofiles per chunk", aiofiles_per_chunk),
+        ("pwrite per chunk", pwrite_per_chunk),
+        ("pooled, parts", lambda *a: pooled(PartFiles(), *a)),
+        ("pooled, preallocate", lambda *a: pooled(PreallocatedFile(), *a)),
+    ]
+    for name, run in runs:
+        directory = Path(tempfile.mkdtemp(dir=args.dir))
+        try:
+            cpu, t0 = time.process_time(), time.perf_counter()
+            asyncio.run(run(directory, size, chunk_size))
+            os.sync()
+            cpu, elapsed = time.process_time() - cpu, time.perf_counter() - t0
+            written = sum(path.stat().st_size for path in directory.iterdir())
+            assert written == size, f"{name} wrote {written} bytes"
+        finally:
+            shutil.rmtree(directory)
+        print(f"{name:20} {cpu / (size / GB):8.3f} CPU s/GB  {size / elapsed / MB:10.1f} MB/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""Time to stitch the parts of a large object into its file, through a Python buffer versus in the kernel.
+
+Before, every byte was read into a 10 MB Python buffer with `shutil.copyfileobj` and hashed on the way. Now the
+checksum is computed as the parts arrive (see `hashing`) and the parts are copied with `copy_file_range`, or
+`sendfile` where that is not available. The parts are written once, then stitched with each way of copying; the
+page cache is not dropped between runs, so run it with an object larger than memory to include disk reads.
+
+Usage:
+
+    python benchmarks/stitching.py --size-gb 4 --part-mb 64 --dir /mnt/scratch
+"""
+import argparse
+import hashlib
+import os
+import shutil
+import tempfile
+import time
+from pathlib import Path
+
+from drs_downloader import GB, MB
+from drs_downloader.writers import COPIES, copy_into
+
+
+def write_parts(directory: Path, size: int, part_size: int):
+    block = os.urandom(MB)
+    parts = []
+    for start in range(0, size, part_size):
+        path = directory / f"object.{start}.part"
+        with open(path, "wb") as f:
+            for _ in range(min(part_size, size - start) // MB):
+                f.write(block)
+        parts.append(path)
+    return parts
+
+
+def copyfileobj_with_hash(parts, destination: Path):
+    """The previous behaviour: every byte through a Python buffer and the hash."""
+    checksum = hashlib.md5()
+    with open(destination, "wb") as wfd:
+        for part in parts:
+            with open(part, "rb") as fd:
+                while True:
+                    buffer = fd.read(10 * MB)
+                    if not buffer:
+                        break
+                    checksum.update(buffer)
+                    wfd.write(buffer)
+
+
+def kernel_copy(parts, destination: Path, copies):
+    offset = 0
+    with open(destination, "wb") as wfd:
+        for part in parts:
+            copied, _ = copy_into(part, wfd.fileno(), offset, copies=copies)
+            offset += copied
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size-gb", type=float, default=2)
+    parser.add_argument("--part-mb", type=int, default=64)
+    parser.add_argument("--dir", default=None, help="Scratch directory on the filesystem to measure")
+    args = parser.parse_args()
+
+    size = int(args.size_gb * GB) // MB * MB
+    directory = Path(tempfile.mkdtemp(dir=args.dir))
+    try:
+        parts = write_parts(directory, size, args.part_mb * MB)
+        os.sync()
+        runs = [("copyfileobj + md5", lambda destination: copyfileobj_with_hash(parts, destination))]
+        for name, copy in COPIES:
+            runs.append((name, lambda destination, copy=(name, copy): kernel_copy(parts, destination, [copy])))
+        for name, run in runs:
+            destination = directory / "object"
+            t0 = time.perf_counter()
+            run(destination)
+            with open(destination, "rb") as f:
+                os.fsync(f.fileno())
+            elapsed = time.perf_counter() - t0
+            assert destination.stat().st_size == size
+            destination.unlink()
+            print(f"{name:20} {elapsed:8.3f}s  {size / elapsed / MB:10.1f} MB/s")
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
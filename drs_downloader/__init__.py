@@ -4,9 +4,29 @@ Configuration options allow for optimizing the download process:
 
 - Object retrievers: The number of DRS objects are retrieved in a given batch.
 - Object signers: The number of DRS objects signed in a given batch.
-- Downloaders: The number of simultaneous downloads to start in a given batch.
-- Part handlers: The number of parts to download at a given time.
-- Part size: size in bytes for each downloadable part of a given DRS object.
+- Downloaders: The number of parts downloading at a given time, across every object (the connection budget).
+- Adaptive downloaders: The most parts the downloaders may grow to when tuned from the observed throughput.
+- Part handlers: The share of the downloaders a single object may hold while other objects are waiting.
+- Part size: size in bytes for each downloadable part of a given DRS object, the starting point before the
+  per-connection throughput is known. Each object's part size is then chosen from its size and that throughput,
+  within the min/max part size and min/max part count.
+- Ordering: which resolved object is signed and downloaded next (auto, lpt, spt, manifest or priority).
+- Reorder window: the most resolved objects waiting to be ordered before signing.
+- Disk headroom: bytes always left free on the destination, objects wait for space rather than fill the disk.
+- Re-sign margin: seconds before a signed url expires when the object is signed again, so its next parts never
+  start with an expired url.
+- Object retries: times an object with a recoverable failure, e.g. an expired url, is signed again and its missing
+  parts retried, while the other objects keep going.
+- Writer: how parts reach the destination, as part files stitched once the object is complete (parts) or written
+  at their offset in a preallocated file (preallocate).
+- Hash buffer: bytes of an object's later parts held in memory until its checksum reaches them, beyond that they
+  are read back from disk.
+- Catalog: SQLite database of completed downloads, a rerun skips a file whose size, mtime and inode have not
+  changed without resolving it again.
+- Cache size: bytes a shared cache directory of downloaded objects may hold, the least recently used go first.
+- Write buffers: received chunks are collected in buffers of this size and written once full, by a single thread;
+  this many idle buffers are kept for reuse.
+- Event loop: the event loop implementation the whole job runs on (auto, asyncio or uvloop).
 """
 
 KB = 1024
@@ -15,9 +35,29 @@ GB = MB * KB
 
 DEFAULT_MAX_SIMULTANEOUS_OBJECT_RETRIEVERS = 100
 DEFAULT_MAX_SIMULTANEOUS_OBJECT_SIGNERS = 10
-DEFAULT_MAX_SIMULTANEOUS_DOWNLOADERS = 10
+DEFAULT_MAX_SIMULTANEOUS_DOWNLOADERS = 30
+DEFAULT_MAX_ADAPTIVE_DOWNLOADERS = 200
 DEFAULT_MAX_SIMULTANEOUS_PART_HANDLERS = 3
 DEFAULT_PART_SIZE = 10 * MB
+DEFAULT_MIN_PART_SIZE = 1 * MB
+DEFAULT_MAX_PART_SIZE = 256 * MB
+DEFAULT_MIN_PARTS = 4
+DEFAULT_MAX_PARTS = 1000
+DEFAULT_TARGET_PART_SECONDS = 10
+DEFAULT_EVENT_LOOP = "auto"
+DEFAULT_ORDERING = "auto"
+DEFAULT_REORDER_WINDOW = 1000
+DEFAULT_DISK_HEADROOM = 100 * MB
+DEFAULT_RESIGN_MARGIN = 5 * 60
+DEFAULT_MAX_OBJECT_RETRIES = 3
+DEFAULT_WRITER = "parts"
+DEFAULT_HASH_BUFFER = 64 * MB
+DEFAULT_CATALOG = ".drs_downloader.sqlite"
+DEFAULT_CACHE_SIZE = 100 * GB
+DEFAULT_WRITE_BUFFER = 1 * MB
+DEFAULT_WRITE_BUFFERS = 64
+DEFAULT_SHARD_BY = "bytes"
+DEFAULT_DEDUP_SOURCES = 100_000
 
 
 def check_for_AnVIL_URIS(uris_list: list[str]) -> bool:
@@ -0,0 +1,104 @@
+"""Cap the bandwidth of every download stream together, sharing it fairly between objects."""
+import asyncio
+import re
+import time
+from collections import OrderedDict, deque
+from typing import Any, Deque, Dict, Optional, Tuple
+
+from drs_downloader import GB, KB, MB
+
+UNITS = {"": 1, "B": 1, "K": KB, "KB": KB, "M": MB, "MB": MB, "G": GB, "GB": GB}
+
+
+def parse_rate(text: str) -> int:
+    """Bytes per second from a value such as `50MB`, `512K` or `1000000`, units are powers of 1024.
+
+    Raises:
+        ValueError: the value is not a positive size
+    """
+    match = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([KMG]?B?)(?:/S)?\s*", text.upper())
+    if match is None or float(match.group(1)) <= 0:
+        raise ValueError(f"'{text}' is not a bandwidth, expected e.g. 50MB or 512KB (per second)")
+    return int(float(match.group(1)) * UNITS[match.group(2)])
+
+
+class BandwidthLimiter(object):
+    """A token bucket shared by every download stream, handed out by deficit round robin across objects.
+
+    Each stream asks for the bytes it has just received before reading more, which holds the socket back once the
+    bucket is empty. While several objects are waiting each gets the same number of bytes per round; an object with
+    nothing waiting takes no share, so its capacity goes to the others and the cap is met without idling.
+    """
+
+    def __init__(self, rate: float, burst: Optional[float] = None, quantum: int = 64 * KB):
+        """
+        Args:
+            rate: bytes per second across every stream
+            burst: the most bytes that may go through at once after an idle period, a tenth of a second by default
+            quantum: bytes added to a waiting object's allowance each round
+        """
+        self.rate = rate
+        self.burst = burst if burst is not None else max(rate / 10, quantum)
+        self.quantum = quantum
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._waiting: Dict[Any, Deque[Tuple[int, asyncio.Future]]] = OrderedDict()
+        self._deficit: Dict[Any, int] = {}
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self.granted: Dict[Any, int] = {}
+        """Bytes let through per object."""
+
+    async def acquire(self, key: Any, nbytes: int):
+        """Wait until `nbytes` may go through for the object `key`."""
+        if nbytes <= 0:
+            return
+        future = asyncio.get_running_loop().create_future()
+        self._waiting.setdefault(key, deque()).append((nbytes, future))
+        self._dispatch()
+        await future
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def _on_timer(self):
+        self._timer = None
+        self._dispatch()
+
+    def _dispatch(self):
+        self._refill()
+        # grant while there are tokens, a grant may overdraw the bucket and is paid back before the next one
+        while self._waiting and self._tokens > 0:
+            key, queue = next(iter(self._waiting.items()))
+            nbytes, future = queue[0]
+            if future.done():
+                queue.popleft()
+                if not queue:
+                    self._idle(key)
+                continue
+            if self._deficit.get(key, 0) < nbytes:
+                # this object has had its turn, top up its allowance and move on to the next one
+                self._deficit[key] = self._deficit.get(key, 0) + self.quantum
+                self._waiting.move_to_end(key)
+                continue
+            queue.popleft()
+            self._deficit[key] -= nbytes
+            self._tokens -= nbytes
+            self.granted[key] = self.granted.get(key, 0) + nbytes
+            future.set_result(None)
+            if not queue:
+                self._idle(key)
+
+        if self._waiting and self._timer is None:
+            delay = max((1 - self._tokens) / self.rate, 0.001)
+            self._timer = asyncio.get_running_loop().call_later(delay, self._on_timer)
+
+    def _idle(self, key: Any):
+        """An object with nothing waiting does not keep an allowance."""
+        del self._waiting[key]
+        self._deficit.pop(key, None)
+
+    def forget(self, key: Any):
+        """Drop the count of bytes let through for an object that has finished."""
+        self.granted.pop(key, None)
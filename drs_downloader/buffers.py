@@ -0,0 +1,90 @@
+"""Reusable receive buffers, and the thread that writes them to disk.
+
+A part being received copies every network chunk, often a few KB, into a buffer of `DEFAULT_WRITE_BUFFER` bytes
+taken from the pool. Only a full buffer goes to disk, as one write by the disk writer thread, and goes back to the
+pool once written; so the receive loop neither allocates per chunk nor hands every chunk to a thread pool. The
+buffers are anonymous maps, page aligned, and a part's writes after its first end on multiples of the buffer size
+in the file.
+"""
+import collections
+import mmap
+import os
+import queue
+import threading
+from concurrent.futures import Future
+from typing import Callable
+
+from drs_downloader import DEFAULT_WRITE_BUFFER, DEFAULT_WRITE_BUFFERS
+
+
+class BufferPool(object):
+    """Buffers of one size, a buffer released is handed out again rather than allocated.
+
+    Acquiring never waits, a new buffer is allocated when none is idle; at most max_idle are kept for reuse. Safe
+    to release from another thread.
+    """
+
+    def __init__(self, buffer_size: int = DEFAULT_WRITE_BUFFER, max_idle: int = DEFAULT_WRITE_BUFFERS):
+        """
+        Args:
+            buffer_size: bytes of every buffer, a multiple of the page size
+            max_idle: most buffers kept once released
+        """
+        self.buffer_size = buffer_size
+        self.max_idle = max_idle
+        self._idle = collections.deque()
+
+    def acquire(self) -> mmap.mmap:
+        try:
+            return self._idle.pop()
+        except IndexError:
+            return mmap.mmap(-1, self.buffer_size)
+
+    def release(self, buffer: mmap.mmap):
+        if len(self._idle) < self.max_idle:
+            self._idle.append(buffer)
+
+
+class DiskWriter(object):
+    """One thread doing the disk writes of every part, in the order they are submitted.
+
+    The thread is started on the first write, and again in a forked worker process, which does not inherit it.
+    """
+
+    def __init__(self):
+        self._jobs = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def submit(self, write: Callable, *args) -> Future:
+        """Call write(*args) on the writer thread, its result or exception ends up in the future returned."""
+        future = Future()
+        self._start()
+        self._jobs.put((future, write, args))
+        return future
+
+    def _start(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self._jobs = queue.SimpleQueue()
+                threading.Thread(target=_run, args=(self._jobs,), name="drs-disk-writer", daemon=True).start()
+                self._pid = os.getpid()
+
+
+def _run(jobs: queue.SimpleQueue):
+    while True:
+        future, write, args = jobs.get()
+        if not future.set_running_or_notify_cancel():
+            continue
+        try:
+            future.set_result(write(*args))
+        except BaseException as e:
+            future.set_exception(e)
+
+
+POOL = BufferPool()
+"""The receive buffers of the process."""
+DISK_WRITER = DiskWriter()
+"""The disk writer thread of the process."""
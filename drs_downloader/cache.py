@@ -0,0 +1,182 @@
+"""A cache of downloaded objects shared by every user and pipeline on a node, keyed by checksum.
+
+An object found in the cache is placed in the destination as a reflink or a copy without signing or downloading
+it; every object downloaded is added to the cache. Hardlinks are not used either way, a file edited in the
+destination would change the cached bytes for everyone.
+
+Entries are `{root}/{checksum type}/{checksum[:2]}/{checksum}`, written under a temporary name and renamed, so a
+reader never sees half an entry. The mtime of an entry is when it was last used: once the cache grows past its
+size limit the least recently used entries are removed down to `LOW_WATER` of it, by one process at a time under a
+lock file. A process still reading an entry that is removed keeps its bytes until it closes it.
+
+Each process keeps a running total of the cache's bytes, from one walk of the cache when it first adds an entry,
+and walks it again only once that total goes past the limit. Entries added by other processes meanwhile are
+counted at that walk.
+"""
+import logging
+import os
+import threading
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+from drs_downloader import DEFAULT_CACHE_SIZE
+from drs_downloader.dedup import LINKS, place
+from drs_downloader.models import DrsObject
+
+file_logger = logging.getLogger("file_logger")
+
+LOW_WATER = 0.9
+"""Share of the size limit eviction goes down to, so the next entries added do not each walk the cache again."""
+
+
+class ContentCache(object):
+    """Objects by checksum in a directory, at most max_size bytes of them."""
+
+    def __init__(self, root: Path, max_size: int = DEFAULT_CACHE_SIZE):
+        """
+        Args:
+            root: cache directory, created if missing, may be shared by several processes and users
+            max_size: bytes the cache may hold, the least recently used entries go beyond that
+        """
+        self.root = Path(root)
+        self.max_size = max_size
+        self.objects = 0
+        """Objects placed from the cache."""
+        self.bytes = 0
+        """Bytes not downloaded thanks to it."""
+        self._total: Optional[int] = None
+
+    def entry_path(self, drs_object: DrsObject) -> Optional[Path]:
+        """Where the object's bytes are cached, None for an object without a checksum."""
+        if not drs_object.checksums or not drs_object.checksums[0].checksum:
+            return None
+        checksum = drs_object.checksums[0]
+        value = checksum.checksum.lower()
+        if not value.isalnum():
+            return None
+        return self.root / checksum.type.lower() / value[:2] / value
+
+    def fetch(self, drs_object: DrsObject, destination: Path) -> Optional[str]:
+        """Place the object's cached bytes at destination.
+
+        Returns:
+            how the file was made, e.g. reflink; None if the object is not cached
+        """
+        path = self.entry_path(drs_object)
+        if path is None:
+            return None
+        try:
+            if os.stat(path).st_size != drs_object.size:
+                return None
+            _touch(path)
+            # never a hardlink, a file edited where it was placed must not change the cache
+            return place(path, destination, links=LINKS)
+        except FileNotFoundError:
+            # not cached, or evicted by another process in the meantime
+            return None
+
+    def add(self, drs_object: DrsObject, path: Path):
+        """Cache the bytes of a verified object from its file at path, then evict down to max_size."""
+        entry = self.entry_path(drs_object)
+        if entry is None or drs_object.size > self.max_size:
+            return
+        if entry.exists():
+            _touch(entry)
+            return
+        entry.parent.mkdir(parents=True, exist_ok=True)
+        place(path, entry, links=LINKS)
+        try:
+            # readable by every user of the node, written by none
+            os.chmod(entry, 0o444)
+        except OSError:
+            pass
+        file_logger.info(f"Cached {drs_object.name} as {entry}")
+        if self._total is None:
+            self._total = sum(size for _, size, _ in self._entries())
+        else:
+            self._total += drs_object.size
+        if self._total > self.max_size:
+            self.evict()
+
+    def saved(self, drs_object: DrsObject):
+        self.objects += 1
+        self.bytes += drs_object.size
+
+    def _entries(self) -> List[Tuple[int, int, Path]]:
+        """mtime, size and path of every entry."""
+        entries = []
+        for directory, _, names in os.walk(self.root):
+            for name in names:
+                if name.endswith(".tmp") or name == ".lock":
+                    continue
+                path = Path(directory, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime_ns, stat.st_size, path))
+        return entries
+
+    def evict(self):
+        """Once the cache holds more than max_size bytes, remove the least recently used entries down to LOW_WATER."""
+        with _Lock(self.root / ".lock") as locked:
+            if not locked:
+                # another process is evicting
+                return
+            entries = self._entries()
+            total = sum(size for _, size, _ in entries)
+            if total > self.max_size:
+                for _, size, path in sorted(entries):
+                    if total <= self.max_size * LOW_WATER:
+                        break
+                    try:
+                        path.unlink()
+                        file_logger.info(f"Evicted {path} from the cache")
+                    except FileNotFoundError:
+                        pass
+                    except PermissionError as e:
+                        file_logger.warning(f"Could not evict {path} from the cache: {e}")
+                        continue
+                    total -= size
+            self._total = total
+
+
+def _touch(path: Path):
+    """The entry was just used, it is the last to be evicted."""
+    try:
+        os.utime(path)
+    except PermissionError:
+        # another user's entry in a directory shared without write access, its place in the order stays
+        pass
+
+
+class _Lock(object):
+    """An exclusive lock on a file across processes, not waited for; always held where flock is missing."""
+
+    _threads = threading.Lock()
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._fd = None
+        self._held = False
+
+    def __enter__(self) -> bool:
+        if not self._threads.acquire(blocking=False):
+            return False
+        self._held = True
+        try:
+            import fcntl
+        except ImportError:
+            return True
+        self._fd = os.open(self.path, os.O_CREAT | os.O_RDWR, 0o666)
+        try:
+            fcntl.flock(self._fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return False
+        return True
+
+    def __exit__(self, *exc_info):
+        if self._fd is not None:
+            os.close(self._fd)
+        if self._held:
+            self._threads.release()
@@ -0,0 +1,158 @@
+"""Remember completed downloads, so a rerun confirms a file with one lookup and one stat instead of resolving it.
+
+The catalog is a SQLite database mapping every DRS URI downloaded to its file's path, size, checksum, mtime and
+inode. A file is taken as complete while its stat still matches; with revalidate it is hashed again instead.
+"""
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional
+
+from drs_downloader.hashing import hash_file
+from drs_downloader.models import Checksum, DrsObject, ObjectState
+
+file_logger = logging.getLogger("file_logger")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS downloads (
+    uri TEXT PRIMARY KEY,
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    checksum TEXT NOT NULL,
+    checksum_type TEXT NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    inode INTEGER NOT NULL
+)
+"""
+
+
+@dataclass
+class CatalogEntry(object):
+    """A completed download."""
+
+    uri: str
+    path: str
+    size: int
+    checksum: str
+    checksum_type: str
+    mtime_ns: int
+    inode: int
+
+    def drs_object(self) -> DrsObject:
+        """The object as it was downloaded, without resolving it again."""
+        drs_object = DrsObject(
+            self_uri=self.uri,
+            id=self.uri,
+            checksums=[Checksum(self.checksum, self.checksum_type)],
+            size=self.size,
+            name=Path(self.path).name,
+            state=ObjectState.SKIPPED,
+            path=Path(self.path),
+        )
+        return drs_object
+
+
+class Catalog(object):
+    """Completed downloads by DRS URI, in a SQLite database.
+
+    The connection is opened on first use and not pickled, so a catalog can be handed to worker processes, each
+    opens its own; SQLite serializes their writes. Within a process the connection is shared by threads, one at a
+    time.
+    """
+
+    def __init__(self, path: Path, revalidate: bool = False):
+        """
+        Args:
+            path: the database, created if missing
+            revalidate: hash a cataloged file again rather than trust its stat
+        """
+        self.path = Path(path)
+        self.revalidate = revalidate
+        self._connection: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        return dict(path=self.path, revalidate=self.revalidate)
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def _execute(self, sql: str, parameters: tuple = ()) -> list:
+        with self._lock:
+            if self._connection is None:
+                self._connection = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+                # readers do not wait on writers, and a commit does not wait for the disk
+                self._connection.execute("PRAGMA journal_mode=WAL")
+                self._connection.execute("PRAGMA synchronous=NORMAL")
+                self._connection.execute(_SCHEMA)
+            with self._connection:
+                return self._connection.execute(sql, parameters).fetchall()
+
+    def get(self, uri: str) -> Optional[CatalogEntry]:
+        rows = self._execute(
+            "SELECT uri, path, size, checksum, checksum_type, mtime_ns, inode FROM downloads WHERE uri = ?", (uri,)
+        )
+        return CatalogEntry(*rows[0]) if rows else None
+
+    def record(self, drs_object: DrsObject, path: Path):
+        """The object's file at path is complete and verified."""
+        if not drs_object.checksums:
+            return
+        path = Path(path).resolve()
+        stat = os.stat(path)
+        self._execute(
+            "INSERT OR REPLACE INTO downloads VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (
+                drs_object.self_uri, str(path), drs_object.size, drs_object.checksums[0].checksum,
+                drs_object.checksums[0].type, stat.st_mtime_ns, stat.st_ino,
+            ),
+        )
+
+    def forget(self, uri: str):
+        self._execute("DELETE FROM downloads WHERE uri = ?", (uri,))
+
+    def completed(self, uri: str, destination_path: Path) -> Optional[CatalogEntry]:
+        """The catalog entry of a URI whose file is still complete in destination_path, None otherwise.
+
+        A file that changed since it was cataloged is forgotten, so it is resolved and downloaded again.
+        """
+        entry = self.get(uri)
+        if entry is None:
+            return None
+        path = Path(entry.path)
+        if path.parent != Path(destination_path).resolve():
+            # downloaded elsewhere, it is wanted in this destination too
+            return None
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            stat = None
+        if stat is None or stat.st_size != entry.size or (
+            not self.revalidate and (stat.st_mtime_ns != entry.mtime_ns or stat.st_ino != entry.inode)
+        ):
+            file_logger.info(f"{path} changed since it was downloaded, downloading it again")
+            self.forget(uri)
+            return None
+        if self.revalidate:
+            checksum = hashlib.new(entry.checksum_type)
+            hash_file(checksum, path)
+            if checksum.hexdigest() != entry.checksum:
+                file_logger.warning(f"{path} does not match its {entry.checksum_type} checksum, downloading it again")
+                self.forget(uri)
+                return None
+            if stat.st_mtime_ns != entry.mtime_ns or stat.st_ino != entry.inode:
+                # e.g. copied back from a backup, the bytes are right so its new stat is trusted from now on
+                self._execute(
+                    "UPDATE downloads SET mtime_ns = ?, inode = ? WHERE uri = ?", (stat.st_mtime_ns, stat.st_ino, uri)
+                )
+        return entry
+
+    def close(self):
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
@@ -1,29 +1,225 @@
+import functools
 import logging
 import multiprocessing
 from pathlib import Path
-from typing import List
-import math
-import tqdm
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
 import click
 import os
 import csv
-import sys
 from sys import exit
 
 from drs_downloader.clients.gen3 import Gen3DrsClient
 from drs_downloader.clients.mock import MockDrsClient
 from drs_downloader.clients.terra import TerraDrsClient
 from drs_downloader.manager import DrsAsyncManager, DrsObject
-from drs_downloader import check_for_AnVIL_URIS
-
-from drs_downloader import DEFAULT_MAX_SIMULTANEOUS_OBJECT_SIGNERS
+from drs_downloader.models import DrsClient
+from drs_downloader import check_for_AnVIL_URIS, event_loop, ordering
+from drs_downloader.bandwidth import parse_rate
+from drs_downloader.cache import ContentCache
+from drs_downloader.catalog import Catalog
+from drs_downloader.dedup import Deduplicator
+from drs_downloader.journal import install_signal_handlers
+from drs_downloader.leases import LeaseBoard
+from drs_downloader.shards import SHARD_BY, parse_shard, select_shard, uri_hash
+from drs_downloader.workers import download_with_workers
+from drs_downloader.writers import WRITERS
+
+from drs_downloader import (
+    DEFAULT_CACHE_SIZE, DEFAULT_CATALOG, DEFAULT_EVENT_LOOP, DEFAULT_ORDERING, DEFAULT_SHARD_BY, DEFAULT_WRITER, GB,
+)
 
 logger = logging.getLogger()
 file_logger = logging.getLogger("file_logger")
 
+SIZE_COLUMNS = ["size", "file_size", "pfb:file_size"]
+"""Manifest headers taken as the size of each file in bytes when no --size-column is given, first found first."""
+
 # Clear the logger file from the previous run
 
 
+def _parse_bandwidth(ctx, param, value):
+    if value is None:
+        return None
+    try:
+        return parse_rate(value)
+    except ValueError as e:
+        raise click.BadParameter(str(e))
+
+
+def _parse_size(ctx, param, value):
+    if value is None:
+        return None
+    try:
+        return parse_rate(value)
+    except ValueError:
+        raise click.BadParameter(f"'{value}' is not a size, expected e.g. 100GB or 512MB")
+
+
+def _parse_shard(ctx, param, value):
+    if value is None:
+        return None
+    try:
+        return parse_shard(value)
+    except ValueError as e:
+        raise click.BadParameter(str(e))
+
+
+def _download_options(command):
+    """Options shared by every download command, passed through to `_perform_downloads`."""
+    options = [
+        click.option(
+            "--event-loop",
+            "event_loop_name",
+            type=click.Choice(["auto"] + list(event_loop.LOOP_FACTORIES)),
+            default=DEFAULT_EVENT_LOOP,
+            show_default=True,
+            help="Event loop implementation the whole run executes on. "
+                 "'auto' uses uvloop when it is installed.",
+        ),
+        click.option(
+            "--adaptive-concurrency/--fixed-concurrency",
+            default=True,
+            show_default=True,
+            help="Tune the number of parts in flight from the observed throughput, or keep the starting budget.",
+        ),
+        click.option(
+            "--concurrency-log",
+            type=click.Path(dir_okay=False, writable=True),
+            default=None,
+            help="Write every concurrency decision to this tsv file, to compare runs.",
+        ),
+        click.option(
+            "--order",
+            type=click.Choice(ordering.ORDERINGS),
+            default=DEFAULT_ORDERING,
+            show_default=True,
+            help="Download order: largest first (lpt), smallest first (spt), manifest order, or by --priority-column. "
+                 "'auto' picks from the sizes of the objects.",
+        ),
+        click.option(
+            "--priority-column",
+            default=None,
+            help="Manifest column with each object's priority, lower values download first. Used by --order priority.",
+        ),
+        click.option(
+            "--max-bandwidth",
+            default=None,
+            callback=_parse_bandwidth,
+            help="Cap the download bandwidth across every file, per second, e.g. 50MB. "
+                 "Files downloading at once share it equally.",
+        ),
+        click.option(
+            "--workers",
+            type=click.IntRange(min=1),
+            default=1,
+            show_default=True,
+            help="Number of processes downloading at once, each with its own share of the files.",
+        ),
+        click.option(
+            "--work-dir",
+            type=click.Path(file_okay=False),
+            default=None,
+            help="Directory shared by instances downloading the same manifest, e.g. on NFS. "
+                 "Each file is downloaded by the instance holding its lease in this directory.",
+        ),
+        click.option(
+            "--lease-ttl",
+            type=click.FloatRange(min=1),
+            default=300,
+            show_default=True,
+            help="Seconds without a heartbeat before another instance takes over a file, used with --work-dir.",
+        ),
+        click.option(
+            "--shard",
+            default=None,
+            callback=_parse_shard,
+            help="Only download shard i of N of the manifest, e.g. 0/4 to 3/4 for a 4 task array job. "
+                 "Shards have about the same number of bytes when the manifest has a size column.",
+        ),
+        click.option(
+            "--shard-by",
+            type=click.Choice(SHARD_BY),
+            default=DEFAULT_SHARD_BY,
+            show_default=True,
+            help="How --shard splits the manifest: by bytes where the manifest has sizes, or by a hash of the URI "
+                 "alone, which is the only split --stream can make. Every task of a job must use the same.",
+        ),
+        click.option(
+            "--size-column",
+            default=None,
+            help="Manifest column with each file's size in bytes, used by --shard. "
+                 f"By default the first of {', '.join(SIZE_COLUMNS)}.",
+        ),
+        click.option(
+            "--stream",
+            is_flag=True,
+            default=False,
+            help="Read the manifest as the downloads go and keep nothing of finished files, "
+                 "so memory stays flat for manifests of millions of rows.",
+        ),
+        click.option(
+            "--writer",
+            type=click.Choice(WRITERS),
+            default=DEFAULT_WRITER,
+            show_default=True,
+            help="How parts reach the disk: one file per part stitched at the end (parts), "
+                 "or written in place into a file allocated up front (preallocate), which writes every byte once.",
+        ),
+        click.option(
+            "--catalog",
+            is_flag=False,
+            flag_value=DEFAULT_CATALOG,
+            default=None,
+            help=f"SQLite catalog of completed downloads, so a rerun skips them with a stat instead of resolving "
+                 f"them. Without a path it is {DEFAULT_CATALOG} in the destination directory.",
+        ),
+        click.option(
+            "--revalidate",
+            is_flag=True,
+            default=False,
+            help="Hash every file in the catalog again instead of trusting its size, mtime and inode.",
+        ),
+        click.option(
+            "--repair",
+            is_flag=True,
+            default=False,
+            help="Check the files already in the destination against their checksum instead of trusting their size, "
+                 "and download again only the parts of those that do not match.",
+        ),
+        click.option(
+            "--hardlinks",
+            is_flag=True,
+            default=False,
+            help="Give files listed more than once with the same bytes one file under several names, "
+                 "rather than a reflink or a copy each. Editing one of them then changes the others.",
+        ),
+        click.option(
+            "--cache-dir",
+            type=click.Path(file_okay=False),
+            default=None,
+            help="Cache of downloaded files shared by every user and pipeline on the node, by checksum. "
+                 "A file found there is copied into the destination instead of downloaded.",
+        ),
+        click.option(
+            "--cache-size",
+            default=f"{DEFAULT_CACHE_SIZE // GB}GB",
+            show_default=True,
+            callback=_parse_size,
+            help="Most bytes the cache may hold, the least recently used files are removed beyond that.",
+        ),
+        click.option(
+            "--staging-dir",
+            type=click.Path(file_okay=False),
+            default=None,
+            help="Fast local directory, e.g. on NVMe, where parts are downloaded and stitched. "
+                 "Only verified files are moved to the destination.",
+        ),
+    ]
+    for option in reversed(options):
+        command = option(command)
+    return command
+
+
 @click.group()
 def cli():
     with open("drs_downloader.log", "w") as _:
@@ -67,22 +263,26 @@ def cli():
     "or not to download the file again if it already exists in the directory"
     "Example: True",
 )
+@_download_options
 def mock(
     verbose: bool,
     destination_dir: str,
     manifest_path: str,
     drs_column_name: str,
     duplicate: bool,
+    **options,
 ):
     """Generate test files locally, without the need for server."""
 
     #
     # get ids from manifest
-    ids_from_manifest = _extract_tsv_info(Path(manifest_path), drs_column_name)
+    ids_from_manifest = _manifest_ids(Path(manifest_path), drs_column_name, options["stream"])
 
     # perform downloads with a mock drs client
+    client_factory = functools.partial(MockDrsClient)
     _perform_downloads(
-        destination_dir, MockDrsClient(), ids_from_manifest, user_project=None, verbose=verbose, duplicate=duplicate,
+        destination_dir, client_factory(), ids_from_manifest, user_project=None, verbose=verbose, duplicate=duplicate,
+        manifest_path=Path(manifest_path), drs_column_name=drs_column_name, client_factory=client_factory, **options,
     )
 
 
@@ -139,6 +339,7 @@ def mock(
     help="This option is used when you want to run the downloader with URIS"
          "that you provide in string form with uris seperated by commas the command line. ex: 'uri1, uri2, uri3'",
 )
+@_download_options
 def terra(
     verbose: bool,
     destination_dir: str,
@@ -147,6 +348,7 @@ def terra(
     user_project: str,
     duplicate: bool,
     string_mode: str,
+    **options,
 ):
     """Copy files from terra.bio"""
 
@@ -155,7 +357,7 @@ def terra(
         ids_from_manifest = string_mode.split(",")
         ids_from_manifest = [s.replace(" ", "") for s in ids_from_manifest]
     else:
-        ids_from_manifest = _extract_tsv_info(Path(manifest_path), drs_column_name)
+        ids_from_manifest = _manifest_ids(Path(manifest_path), drs_column_name, options["stream"])
 
     Contains_AnVIL_Uris = check_for_AnVIL_URIS(ids_from_manifest)
     if Contains_AnVIL_Uris and not user_project:
@@ -172,14 +374,18 @@ def terra(
         exit(1)
 
     # perform downloads with a terra drs client
+    client_factory = functools.partial(TerraDrsClient)
     _perform_downloads(
         destination_dir,
-        TerraDrsClient(),
+        client_factory(),
         ids_from_manifest=ids_from_manifest,
         user_project=user_project,
         verbose=verbose,
         duplicate=duplicate,
-
+        manifest_path=None if string_mode is not None else Path(manifest_path),
+        drs_column_name=drs_column_name,
+        client_factory=client_factory,
+        **options,
     )
 
 
@@ -229,6 +435,7 @@ def terra(
          "or not to download the file again if it already exists in the directory"
          "Example: True",
 )
+@_download_options
 def gen3(
     verbose: bool,
     destination_dir: str,
@@ -237,19 +444,25 @@ def gen3(
     api_key_path: str,
     endpoint: str,
     duplicate: bool,
+    **options,
 ):
     """Copy files from gen3 server."""
     # read from manifest
     assert api_key_path is not None, "If using gen3 mode an api key path must be provided with --api-key-path"
-    ids_from_manifest = _extract_tsv_info(Path(manifest_path), drs_column_name)
+    ids_from_manifest = _manifest_ids(Path(manifest_path), drs_column_name, options["stream"])
 
+    client_factory = functools.partial(Gen3DrsClient, api_key_path=api_key_path, endpoint=endpoint)
     _perform_downloads(
         destination_dir,
-        Gen3DrsClient(api_key_path=api_key_path, endpoint=endpoint),
+        client_factory(),
         ids_from_manifest,
         verbose=verbose,
         duplicate=duplicate,
-        user_project=None
+        user_project=None,
+        manifest_path=Path(manifest_path),
+        drs_column_name=drs_column_name,
+        client_factory=client_factory,
+        **options,
     )
 
 
@@ -277,9 +490,13 @@ def pretty_size(bytes):
     return str(amount) + suffix, price
 
 
-def _end_routine(drs_client: TerraDrsClient, drs_objects: List[DrsObject], verbose: bool):
+def _end_routine(
+    drs_client: TerraDrsClient, drs_objects: List[DrsObject], verbose: bool, finished_ok: int = 0,
+    deduplicator: Optional[Deduplicator] = None, cache: Optional[ContentCache] = None,
+):
+    """Report on every object, finished_ok objects were already reported as they finished and are not in the list."""
     at_least_one_error = False
-    oks = 0
+    oks = finished_ok
     for drs_object in drs_objects:
         if len(drs_object.errors) == 0:
             file_logger.info(
@@ -293,8 +510,18 @@ def _end_routine(drs_client: TerraDrsClient, drs_objects: List[DrsObject], verbo
         file_logger.info(('done', 'statistics.max_files_open', drs_client.statistics.max_files_open))
         if verbose:
             logger.info(('done', 'statistics.max_files_open', drs_client.statistics.max_files_open))
-    file_logger.info("%s/%s files have downloaded successfully", oks, len(drs_objects))
-    logger.info("%s/%s files have downloaded successfully", oks, len(drs_objects))
+    file_logger.info("%s/%s files have downloaded successfully", oks, finished_ok + len(drs_objects))
+    logger.info("%s/%s files have downloaded successfully", oks, finished_ok + len(drs_objects))
+    if deduplicator is not None and deduplicator.objects > 0:
+        saved, _ = pretty_size(deduplicator.bytes)
+        message = f"{deduplicator.objects} files had the same bytes as another file, {saved} not downloaded again"
+        file_logger.info(message)
+        logger.info(message)
+    if cache is not None and cache.objects > 0:
+        saved, _ = pretty_size(cache.bytes)
+        message = f"{cache.objects} files were found in the cache {cache.root}, {saved} not downloaded again"
+        file_logger.info(message)
+        logger.info(message)
 
     for drs_object in drs_objects:
         if len(drs_object.errors) > 0:
@@ -323,9 +550,19 @@ def _end_routine(drs_client: TerraDrsClient, drs_objects: List[DrsObject], verbo
 
 
 def _perform_downloads(
-    destination_dir, drs_client, ids_from_manifest, user_project: str, verbose: bool, duplicate: bool
+    destination_dir, drs_client, ids_from_manifest, user_project: str, verbose: bool, duplicate: bool,
+    event_loop_name: str = DEFAULT_EVENT_LOOP, adaptive_concurrency: bool = True, concurrency_log: str = None,
+    order: str = DEFAULT_ORDERING, priority_column: str = None, manifest_path: Optional[Path] = None,
+    drs_column_name: str = None, max_bandwidth: int = None, workers: int = 1, work_dir: str = None,
+    lease_ttl: float = 300, shard: Optional[Tuple[int, int]] = None, shard_by: str = DEFAULT_SHARD_BY,
+    size_column: Optional[str] = None,
+    stream: bool = False, writer: str = DEFAULT_WRITER, client_factory: Optional[Callable[[], DrsClient]] = None,
+    catalog: Optional[str] = None, revalidate: bool = False, hardlinks: bool = False, cache_dir: Optional[str] = None,
+    cache_size: int = DEFAULT_CACHE_SIZE, staging_dir: Optional[str] = None, repair: bool = False,
 ):
     """Common helper method to run downloads."""
+    # an interrupted run saves what it has downloaded so far, the next run carries on from there
+    install_signal_handlers()
 
     try:
         if destination_dir:
@@ -337,33 +574,140 @@ def _perform_downloads(
         logger.error(f"Invalid --destination-dir path provided: {e}")
         exit(1)
 
+    if staging_dir is not None:
+        try:
+            staging_dir = Path(staging_dir)
+            staging_dir.mkdir(parents=True, exist_ok=True)
+        except OSError as e:
+            file_logger.error(f"Invalid --staging-dir path provided: {e}")
+            logger.error(f"Invalid --staging-dir path provided: {e}")
+            exit(1)
+        file_logger.info(f"Staging parts in: {staging_dir.resolve()}")
+
     file_logger.info(f"Downloading to: {destination_dir.resolve()}")
     logger.info(f"Downloading to: {destination_dir.resolve()}")
 
+    priorities = None
+    if order == "priority":
+        if priority_column is None or manifest_path is None:
+            file_logger.error("--order priority needs a manifest and a --priority-column")
+            logger.error("--order priority needs a manifest and a --priority-column")
+            exit(1)
+        priorities = _extract_priorities(manifest_path, drs_column_name, priority_column)
+
+    if stream and workers > 1:
+        file_logger.error("--stream cannot be combined with --workers")
+        logger.error("--stream cannot be combined with --workers")
+        exit(1)
+
+    if shard is not None and stream and shard_by != "hash":
+        # balancing by bytes needs the whole manifest in memory, a streamed task would get other files than its
+        # siblings or its previous run expect
+        file_logger.error("--shard with --stream can only split by hash, add --shard-by hash to every task")
+        logger.error("--shard with --stream can only split by hash, add --shard-by hash to every task")
+        exit(1)
+    if shard is not None and stream:
+        index, count = shard
+        ids_from_manifest = (uri for uri in ids_from_manifest if uri_hash(uri) % count == index)
+    elif shard is not None:
+        ids_from_manifest = _select_shard(
+            ids_from_manifest, shard, manifest_path, drs_column_name, verbose,
+            size_column=size_column, by_hash=shard_by == "hash",
+        )
+
+    leases = None
+    if work_dir is not None:
+        leases = LeaseBoard(Path(work_dir), ttl=lease_ttl)
+        file_logger.info(f"Sharing the manifest through {work_dir} as {leases.owner}")
+
+    if revalidate and catalog is None:
+        catalog = DEFAULT_CATALOG
+    if catalog is not None:
+        # given without a path, the catalog lives with the files it describes
+        catalog = Catalog(destination_dir / catalog if catalog == DEFAULT_CATALOG else Path(catalog), revalidate)
+        file_logger.info(f"Completed downloads are cataloged in {catalog.path}")
+
     # create a manager
-    drs_manager = DrsAsyncManager(drs_client=drs_client, show_progress=not verbose)
+    drs_manager = DrsAsyncManager(
+        drs_client=drs_client, show_progress=not verbose, event_loop_name=event_loop_name,
+        adaptive_concurrency=adaptive_concurrency, order=order, priorities=priorities, max_bandwidth=max_bandwidth,
+        leases=leases, writer=writer, catalog=catalog, hardlinks=hardlinks,
+        cache=ContentCache(Path(cache_dir), cache_size) if cache_dir is not None else None, staging_path=staging_dir,
+        repair=repair,
+    )
 
-    # call the server, get size, checksums etc.; sort them by size
-    drs_objects = drs_manager.get_objects(ids_from_manifest, verbose=verbose)
+    finished_ok = 0
+    if workers > 1 and client_factory is not None:
+        # resolve here, then each worker process downloads its share of the objects on its own event loop
+        drs_objects = drs_manager.get_objects(ids_from_manifest, verbose=verbose)
+        _report_resolved(drs_manager, drs_objects, verbose)
+        drs_objects = download_with_workers(
+            drs_manager, client_factory, drs_objects, destination_dir, user_project, duplicate, verbose, workers,
+            leases=leases,
+        )
+    elif stream:
+        drs_objects, finished_ok = drs_manager.run(
+            _stream_all(drs_manager, destination_dir, ids_from_manifest, user_project, verbose, duplicate)
+        )
+    else:
+        # the whole job runs on one event loop so connections, tokens and tasks survive between batches
+        drs_objects = drs_manager.run(
+            _download_all(drs_manager, destination_dir, ids_from_manifest, user_project, verbose, duplicate)
+        )
+
+    if catalog is not None:
+        catalog.close()
 
+    if concurrency_log and drs_manager.concurrency_controller is not None:
+        drs_manager.concurrency_controller.write_decisions(Path(concurrency_log))
+        file_logger.info(f"Concurrency decisions written to {concurrency_log}")
+
+    _end_routine(
+        drs_client, drs_objects, verbose, finished_ok=finished_ok, deduplicator=drs_manager.deduplicator,
+        cache=drs_manager.cache,
+    )
+
+
+def _select_shard(
+    ids_from_manifest: List[str], shard: Tuple[int, int], manifest_path: Optional[Path], drs_column_name: str,
+    verbose: bool, size_column: Optional[str] = None, by_hash: bool = False,
+) -> List[str]:
+    """Keep this task's shard of the URIs, balanced by bytes when the manifest has sizes unless split by hash."""
+    index, count = shard
+    sizes = {}
+    if manifest_path is not None and not by_hash:
+        sizes = _extract_sizes(manifest_path, drs_column_name, size_column)
+    selected = select_shard(ids_from_manifest, index, count, sizes)
+    total = sum(sizes.get(uri, 0) for uri in selected)
+    message = f"Shard {index}/{count}: {len(selected)} of {len(ids_from_manifest)} DRS objects"
+    if sizes:
+        message += f", {total} bytes"
+    file_logger.info(message)
+    if verbose:
+        logger.info(message)
+    return selected
+
+
+def _report_resolved(drs_manager: DrsAsyncManager, drs_objects: List[DrsObject], verbose: bool):
+    """Report on the whole manifest once every object has been resolved, then tune the manager to the workload."""
     file_logger.info(f"Drs Objects after get_objects function {drs_objects}")
 
-    # If every object has an error exit early since these early errors are not recoverable
+    # If every object has an error nothing was admitted for download, these early errors are not recoverable
     if all(len(obj.errors) > 0 for obj in drs_objects):
         file_logger.error("every single object recieved an\
 error in git objects function, so starting end routine early")
         logger.error("every single object recieved an error in git objects function, so starting end routine early")
-        _end_routine(drs_client, drs_objects, verbose)
+        return
 
-    # there are many reasons why this exception gets caught and many of them don't have
+    # there are many reasons why this happens and many of them don't have
     # much to do with the object's size, but things that happen along the way
     total_size_list = [total.size for total in drs_objects]
-    assert (sum(total_size_list) > 0), (
+    if sum(total_size_list) <= 0:
         logger.error("FATAL ERROR: No size data was returned from get_objects.\
- Check your uris to make sure that they are properly formatted"),
+ Check your uris to make sure that they are properly formatted")
         file_logger.error("FATAL ERROR: No size data was returned from get_objects.\
- Check your uris to make sure that they are properly formatted"),
-        exit())
+ Check your uris to make sure that they are properly formatted")
+        return
 
     total, price = pretty_size(sum(total_size_list))
     file_logger.info(f"Total download size is {total}")
@@ -371,46 +715,111 @@ error in git objects function, so starting end routine early")
     logger.info(f"Total download size is {total}")
     logger.info(f"Estimated download cost is ${price}")
 
-    # sorting by size here also moves errored out size 0 objects to the top so that they can be batched up
-    # together and skipped before the actual downloading starts
-    drs_objects.sort(key=lambda x: x.size, reverse=False)
-    # optimize based on workload
-    drs_objects = drs_manager.optimize_workload(verbose, drs_objects)
+    # optimize based on workload, applies to the objects that have not started downloading yet
+    drs_manager.optimize_workload(verbose, drs_objects)
 
-    file_logger.info(f"Drs Objects after optimize_workload function {drs_objects}")
-    if verbose:
-        logger.info(f"Drs Objects after optimize_workload function {drs_objects}")
-
-    # determine the total number of batches
-    total_batches = len(drs_objects) / DEFAULT_MAX_SIMULTANEOUS_OBJECT_SIGNERS
-    if math.ceil(total_batches) - total_batches > 0:
-        total_batches += 1
-        total_batches = int(total_batches)
-
-    progress_bar = tqdm.tqdm(
-        DrsAsyncManager.chunker(drs_objects, DEFAULT_MAX_SIMULTANEOUS_OBJECT_SIGNERS),
-        total=total_batches,
-        desc="TOTAL_DOWNLOAD_PROGRESS",
-        leave=False,
-        file=sys.stdout,
-        disable=(total_batches == 1),
+
+async def _download_all(
+    drs_manager: DrsAsyncManager, destination_dir: Path, ids_from_manifest, user_project: str, verbose: bool,
+    duplicate: bool
+) -> List[DrsObject]:
+    """Resolve and download every object on the running event loop, objects download as soon as they resolve."""
+
+    def _on_resolved(drs_objects: List[DrsObject]):
+        _report_resolved(drs_manager, drs_objects, verbose)
+
+    return await drs_manager.resolve_and_download(
+        ids_from_manifest, destination_dir, user_project=user_project, duplicate=duplicate, verbose=verbose,
+        on_resolved=_on_resolved,
     )
 
-    for chunk_of_drs_objects in progress_bar:
-        file_logger.info(str(progress_bar))
-        if all(len(obj.errors) > 0 for obj in chunk_of_drs_objects):
-            file_logger.warning(f"Every object in the batch has an error so \
-skipping downloading for objects {chunk_of_drs_objects}")
-            if verbose:
-                logger.warning(f"Every object in the batch has an error so \
-skipping downloading for objects {chunk_of_drs_objects}")
-            continue
-        # the scenario where some
 
-        drs_manager.download(chunk_of_drs_objects, destination_dir, user_project=user_project,
-                             duplicate=duplicate, verbose=verbose)
+async def _stream_all(
+    drs_manager: DrsAsyncManager, destination_dir: Path, ids_from_manifest: Iterable[str], user_project: str,
+    verbose: bool, duplicate: bool
+) -> Tuple[List[DrsObject], int]:
+    """Download the manifest in bounded memory, each object is reported as it finishes then let go.
 
-    _end_routine(drs_client, drs_objects, verbose)
+    Returns:
+        the objects that failed, and the number of objects downloaded successfully
+    """
+    counts = {"ok": 0, "bytes": 0}
+
+    def _on_finished(drs_object: DrsObject):
+        if len(drs_object.errors) == 0:
+            file_logger.info((drs_object.name, "OK", drs_object.size, len(drs_object.file_parts)))
+            logger.info((drs_object.name, "OK", drs_object.size, len(drs_object.file_parts)))
+            counts["ok"] += 1
+            counts["bytes"] += drs_object.size
+
+    failures = await drs_manager.resolve_and_download(
+        ids_from_manifest, destination_dir, user_project=user_project, duplicate=duplicate, verbose=verbose,
+        on_finished=_on_finished, keep_results=False,
+    )
+    if counts["bytes"] > 0:
+        total, _ = pretty_size(counts["bytes"])
+        file_logger.info(f"Total download size was {total}")
+        logger.info(f"Total download size was {total}")
+    return failures, counts["ok"]
+
+
+class _ManifestUris(object):
+    """The DRS URI's of a manifest, read from the file every time they are iterated instead of held in memory."""
+
+    def __init__(self, manifest_path: Path, drs_header: str):
+        """Check the manifest once up front, so that a bad row fails before any download starts.
+
+        Duplicate URI's are not checked, that needs every URI in memory.
+        """
+        assert (
+            manifest_path.is_file()
+        ), "The manifest file path and name given does not exist"
+        self.manifest_path = manifest_path
+        self.drs_header = drs_header
+        self._length = 0
+        for url in self._read():
+            if "drs://" not in url and "DRS://" not in url:
+                raise Exception(
+                    "Check that your header name for your DRS URIS is directly above the column of your DRS URIS"
+                )
+            self._length += 1
+
+    def _read(self) -> Iterator[str]:
+        with open(self.manifest_path) as file:
+            tsv_file = csv.reader(file, delimiter="\t")
+            uri_index = _uri_column(next(tsv_file), self.drs_header, self.manifest_path)
+            for row in tsv_file:
+                # solves an issue where blank lines would be read from the TSV
+                if row[uri_index] == '':
+                    continue
+                yield row[uri_index]
+
+    def __iter__(self) -> Iterator[str]:
+        return self._read()
+
+    def __len__(self) -> int:
+        return self._length
+
+
+def _manifest_ids(manifest_path: Path, drs_header: str, stream: bool) -> Iterable[str]:
+    """The DRS URI's of the manifest, read lazily with --stream."""
+    if stream:
+        return _ManifestUris(manifest_path, drs_header)
+    return _extract_tsv_info(manifest_path, drs_header)
+
+
+def _uri_column(headers: List[str], drs_header: str, manifest_path: Path) -> int:
+    """Index of the DRS URI column, the first header containing 'uri' when drs_header is None."""
+    if drs_header is None:
+        for index, col in enumerate(headers):
+            if "uri" in col.lower():
+                return index
+    elif drs_header in headers:
+        return headers.index(drs_header)
+    raise KeyError(
+        f"DRS header value '{drs_header}' not found in manifest file {manifest_path}."
+        " Please specify a new value with the --drs-column-name flag."
+    )
 
 
 def _extract_tsv_info(manifest_path: Path, drs_header: str) -> List[str]:
@@ -427,36 +836,17 @@ def _extract_tsv_info(manifest_path: Path, drs_header: str) -> List[str]:
     ), "The manifest file path and name given does not exist"
 
     uris = []
-    uri_index = 0
-    header = None
     with open(Path(manifest_path)) as file:
         tsv_file = csv.reader(file, delimiter="\t")
-        headers = next(tsv_file)
         # search for header name
-        if drs_header is None:
-            for col in headers:
-                if "uri" in col.lower():
-                    header = headers[headers.index(col)]
-                    uri_index = headers.index(col)
-                    break
-        else:
-            if drs_header in headers:
-                uri_index = headers.index(drs_header)
-                header = drs_header
+        uri_index = _uri_column(next(tsv_file), drs_header, manifest_path)
 
         # add url to urls list
-        if header is not None:
-            for row in tsv_file:
-                # solves an issue where blank lines would be read from the TSV
-                if row[uri_index] == '':
-                    continue
-                uris.append(row[uri_index])
-
-        else:
-            raise KeyError(
-                f"DRS header value '{drs_header}' not found in manifest file {manifest_path}."
-                " Please specify a new value with the --drs-column-name flag."
-            )
+        for row in tsv_file:
+            # solves an issue where blank lines would be read from the TSV
+            if row[uri_index] == '':
+                continue
+            uris.append(row[uri_index])
 
         for url in uris:
             if "drs://" in url or "DRS://" in url:
@@ -476,6 +866,86 @@ def _extract_tsv_info(manifest_path: Path, drs_header: str) -> List[str]:
     return uris
 
 
+def _extract_column(manifest_path: Path, drs_header: str, column_index: int, parse: Callable[[str], Any]) -> Dict:
+    """Every DRS URI's value in one other column of the TSV file, read in one pass.
+
+    Args:
+        manifest_path (str): The input file containing a list of DRS URI's.
+        drs_header (str): Column header for the DRS URI's.
+        column_index (int): Index of the column to read.
+        parse: Turns a cell into its value, rows where it raises ValueError are left out.
+    Returns:
+        Dict: The value of each URI, URI's with an empty cell are left out.
+    """
+    values = {}
+    with open(Path(manifest_path)) as file:
+        tsv_file = csv.reader(file, delimiter="\t")
+        uri_index = _uri_column(next(tsv_file), drs_header, manifest_path)
+        for row in tsv_file:
+            if uri_index >= len(row) or column_index >= len(row) or row[uri_index] == "" or row[column_index] == "":
+                continue
+            try:
+                values[row[uri_index]] = parse(row[column_index])
+            except ValueError:
+                continue
+    return values
+
+
+def _headers(manifest_path: Path) -> List[str]:
+    with open(Path(manifest_path)) as file:
+        return next(csv.reader(file, delimiter="\t"), [])
+
+
+def _extract_priorities(manifest_path: Path, drs_header: str, priority_header: str) -> Dict[str, float]:
+    """Extract each DRS URI's priority from the provided TSV file.
+
+    Args:
+        manifest_path (str): The input file containing a list of DRS URI's.
+        drs_header (str): Column header for the DRS URI's.
+        priority_header (str): Column header for the priorities, lower values download first.
+    Returns:
+        Dict[str, float]: The priority of each URI, URI's with an empty priority are left out.
+    """
+    headers = _headers(manifest_path)
+    if priority_header not in headers:
+        raise KeyError(
+            f"Priority header value '{priority_header}' not found in manifest file {manifest_path}."
+            " Please specify a new value with the --priority-column flag."
+        )
+    return _extract_column(manifest_path, drs_header, headers.index(priority_header), float)
+
+
+def _extract_sizes(manifest_path: Path, drs_header: str, size_header: Optional[str] = None) -> Dict[str, int]:
+    """Extract each DRS URI's size from the TSV file.
+
+    Args:
+        manifest_path (str): The input file containing a list of DRS URI's.
+        drs_header (str): Column header for the DRS URI's.
+        size_header (str): Column header for the sizes in bytes, by default the first of `SIZE_COLUMNS` found.
+    Returns:
+        Dict[str, int]: The size in bytes of each URI, empty when the manifest has no size column.
+    """
+    headers = _headers(manifest_path)
+    if size_header is not None:
+        if size_header not in headers:
+            raise KeyError(
+                f"Size header value '{size_header}' not found in manifest file {manifest_path}."
+                " Please specify a new value with the --size-column flag."
+            )
+        size_index = headers.index(size_header)
+    else:
+        size_index = next((headers.index(col) for col in SIZE_COLUMNS if col in headers), None)
+        if size_index is None:
+            return {}
+    return _extract_column(manifest_path, drs_header, size_index, _parse_bytes)
+
+
+def _parse_bytes(value: str) -> int:
+    if not value.isdigit():
+        raise ValueError(f"Not a size in bytes: {value}")
+    return int(value)
+
+
 if __name__ == "__main__":
     multiprocessing.freeze_support()
     cli()
@@ -6,11 +6,11 @@ import certifi
 from pathlib import Path
 from typing import Optional
 
-import aiofiles
 import aiohttp
 from aiohttp import ClientResponseError
 
 from drs_downloader.models import DrsClient, DrsObject, AccessMethod, Checksum
+from drs_downloader.signed_urls import url_expiry
 
 logger = logging.getLogger(__name__)
 
@@ -37,6 +37,19 @@ class Gen3DrsClient(DrsClient):
         self.access_token_resource_path = access_token_resource_path
         self.api_key_path = api_key_path
         self.drs_api = drs_api
+        self._session = None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        """Session shared by every request on the running event loop, keeps connections warm between requests."""
+        if self._session is None or self._session.closed:
+            context = ssl.create_default_context(cafile=certifi.where())
+            self._session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(ssl=context, limit=0))
+        return self._session
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
 
     async def authorize(self):
         full_key_path = os.path.expanduser(self.api_key_path)
@@ -62,8 +75,7 @@ class Gen3DrsClient(DrsClient):
     async def update_access_token(self):
         headers = {"Content-Type": "application/json"}
         api_url = "{0}{1}".format(self.endpoint, self.access_token_resource_path)
-        async with aiohttp.ClientSession(headers=headers) as session:
-            response = await session.post(api_url, headers=headers, json=self.api_key)
+        async with self._get_session().post(api_url, headers=headers, json=self.api_key) as response:
             if response.status == 200:
                 resp = await response.json()
                 self.token = resp["access_token"]
@@ -82,22 +94,26 @@ class Gen3DrsClient(DrsClient):
 
             headers = {"Range": f"bytes={start}-{size}"}
 
-            file_name = destination_path / f"{drs_object.name}.{start}.{size}.part"
-            Path(file_name).parent.mkdir(parents=True, exist_ok=True)
-
-            async with aiohttp.ClientSession(headers=headers) as session:
-                async with session.get(
-                    drs_object.access_methods[0].access_url
-                ) as request:
-                    file = await aiofiles.open(file_name, "wb")
-                    self.statistics.set_max_files_open()
-                    async for data in request.content.iter_any():  # uses less memory
-                        await file.write(data)
-                    await file.close()
-                    return Path(file_name)
+            destination_path.mkdir(parents=True, exist_ok=True)
+
+            async with self._get_session().get(
+                drs_object.access_methods[0].access_url, headers=headers
+            ) as request:
+                if request.status == 403 and "Request has expired" in await request.text():
+                    # the presigned url ran out, the manager signs the object again and retries its missing parts
+                    drs_object.fail("download_part", f"Signed url of {drs_object.name} expired", recoverable=True)
+                    return None
+                request.raise_for_status()
+                file = await self.open_part(drs_object, start, size, destination_path)
+                self.statistics.set_max_files_open()
+                async for data in request.content.iter_any():  # uses less memory
+                    await self.throttle(drs_object, len(data))
+                    await file.write(data)
+                await file.close()
+                return file.path
         except Exception as e:
             logger.error(f"gen3.download_part {str(e)}")
-            drs_object.errors.append(str(e))
+            drs_object.fail("download_part", str(e))
             return None
 
     async def sign_url(self, drs_object: DrsObject, verbose: bool, user_project=None) -> DrsObject:
@@ -107,24 +123,23 @@ class Gen3DrsClient(DrsClient):
             "authorization": "Bearer " + self.token,
             "content-type": "application/json",
         }
-        async with aiohttp.ClientSession(headers=headers) as session:
-            async with session.get(
-                url=f"{self.endpoint}/user/data/download/{drs_object.id.split(':')[-1]}"
-            ) as response:
-                try:
-                    self.statistics.set_max_files_open()
-                    response.raise_for_status()
-                    resp = await response.json(content_type=None)
-                    assert "url" in resp, resp
-                    url_ = resp["url"]
-                    drs_object.access_methods = [
-                        AccessMethod(access_url=url_, type="s3")
-                    ]
-                    return drs_object
-
-                except ClientResponseError as e:
-                    drs_object.errors.append(str(e))
-                    return drs_object
+        async with self._get_session().get(
+            url=f"{self.endpoint}/user/data/download/{drs_object.id.split(':')[-1]}", headers=headers
+        ) as response:
+            try:
+                self.statistics.set_max_files_open()
+                response.raise_for_status()
+                resp = await response.json(content_type=None)
+                assert "url" in resp, resp
+                url_ = resp["url"]
+                drs_object.access_methods = [
+                    AccessMethod(access_url=url_, type="s3", expires=url_expiry(url_))
+                ]
+                return drs_object
+
+            except ClientResponseError as e:
+                drs_object.fail("sign_url", str(e))
+                return drs_object
 
     async def get_object(self, object_id: str, verbose: bool) -> DrsObject:
         """Sends a POST request for the signed URL, hash, and file size of a given DRS object.
@@ -145,35 +160,33 @@ class Gen3DrsClient(DrsClient):
             "authorization": "Bearer " + self.token,
             "content-type": "application/json",
         }
-        context = ssl.create_default_context(cafile=certifi.where())
-        async with aiohttp.ClientSession(headers=headers) as session:
-            async with session.get(
-                url=f"{self.endpoint}{self.drs_api}/{object_id.split(':')[-1]}",
-                ssl=context
-            ) as response:
-                try:
-                    self.statistics.set_max_files_open()
-                    response.raise_for_status()
-                    resp = await response.json(content_type=None)
-
-                    assert resp["checksums"][0]["type"] == "md5", resp
-                    md5_ = resp["checksums"][0]["checksum"]
-                    size_ = resp["size"]
-                    name_ = resp["name"]
-                    return DrsObject(
-                        self_uri=object_id,
-                        size=size_,
-                        checksums=[Checksum(checksum=md5_, type="md5")],
-                        id=object_id,
-                        name=name_,
-                        access_methods=[AccessMethod(access_url="", type="gs")],
-                    )
-                except ClientResponseError as e:
-                    return DrsObject(
-                        self_uri=object_id,
-                        id=object_id,
-                        checksums=[],
-                        size=0,
-                        name=None,
-                        errors=[str(e)],
-                    )
+        async with self._get_session().get(
+            url=f"{self.endpoint}{self.drs_api}/{object_id.split(':')[-1]}",
+            headers=headers
+        ) as response:
+            try:
+                self.statistics.set_max_files_open()
+                response.raise_for_status()
+                resp = await response.json(content_type=None)
+
+                assert resp["checksums"][0]["type"] == "md5", resp
+                md5_ = resp["checksums"][0]["checksum"]
+                size_ = resp["size"]
+                name_ = resp["name"]
+                return DrsObject(
+                    self_uri=object_id,
+                    size=size_,
+                    checksums=[Checksum(checksum=md5_, type="md5")],
+                    id=object_id,
+                    name=name_,
+                    access_methods=[AccessMethod(access_url="", type="gs")],
+                )
+            except ClientResponseError as e:
+                return DrsObject(
+                    self_uri=object_id,
+                    id=object_id,
+                    checksums=[],
+                    size=0,
+                    name=None,
+                    errors=[str(e)],
+                )
@@ -1,4 +1,5 @@
 import asyncio
+import datetime
 import hashlib
 import logging
 import os
@@ -10,6 +11,7 @@ from typing import Optional
 
 from drs_downloader import MB
 from drs_downloader.models import DrsClient, DrsObject, AccessMethod, Checksum
+from drs_downloader.signed_urls import SIGNING_TIME_FORMAT, url_expiry
 
 logger = logging.getLogger(__name__)
 
@@ -48,10 +50,11 @@ class MockDrsClient(DrsClient):
         self.statistics.set_max_files_open()
         fp.close()
 
-        # provide expected result, e.g. X-Signature
-        access_url = f"{drs_object.self_uri}?X-Signature={uuid.uuid1()}"
-        # place it in the right spot in the drs object
-        drs_object.access_methods.append(AccessMethod(access_url=access_url, type="gs"))
+        # provide expected result, e.g. X-Signature, valid for an hour like a GCS V4 signature
+        signed = datetime.datetime.now(datetime.timezone.utc).strftime(SIGNING_TIME_FORMAT)
+        access_url = f"{drs_object.self_uri}?X-Goog-Date={signed}&X-Goog-Expires=3600&X-Signature={uuid.uuid1()}"
+        # place it in the right spot in the drs object, replacing the url of an earlier signature
+        drs_object.access_methods = [AccessMethod(access_url=access_url, type="gs", expires=url_expiry(access_url))]
 
         return drs_object
 
@@ -84,20 +87,16 @@ class MockDrsClient(DrsClient):
         with open(Path(os.getcwd(), f"{drs_object.name}.golden"), "rb") as f:
             f.seek(start)
             data = f.read(length_)
+        await self.throttle(drs_object, len(data))
 
-        (fd, name,) = tempfile.mkstemp(
-            prefix=f"{drs_object.name}.{start}.{size}.",
-            suffix=".part",
-            dir=str(destination_path),
-        )
-        with os.fdopen(fd, "wb") as fp:
-            sleep_duration = random.randint(1, 3)
-            await asyncio.sleep(delay=sleep_duration)
-            fp.write(data)
-            self.statistics.set_max_files_open()
-            fp.close()
+        fp = await self.open_part(drs_object, start, size, destination_path)
+        sleep_duration = random.randint(1, 3)
+        await asyncio.sleep(delay=sleep_duration)
+        await fp.write(data)
+        self.statistics.set_max_files_open()
+        await fp.close()
 
-        return Path(name)
+        return fp.path
 
     async def get_object(self, object_id: str, verbose: bool = False) -> DrsObject:
         """Fetch the object from repository DRS Service.
@@ -120,12 +119,13 @@ class MockDrsClient(DrsClient):
         self.statistics.set_max_files_open()
         fp.close()
 
-        id_ = str(uuid.uuid4())
+        # the same object every time it is fetched, so an interrupted download can be resumed
+        id_ = str(uuid.uuid5(uuid.NAMESPACE_URL, object_id))
         name_ = f"file-{id_}.txt"
 
         line = b"Lorem ipsum dolor sit amet, consectetur adipiscing elit, sed do eiusmod tempor incididunt ut labore et dolore magna aliqua.\n"  # noqa
         line_len = len(line)
-        number_of_lines = int(random.randint(line_len, MAX_SIZE_OF_OBJECT) / line_len)
+        number_of_lines = int(random.Random(object_id).randint(line_len, MAX_SIZE_OF_OBJECT) / line_len)
         lines = line * number_of_lines
         size_ = len(lines)
 
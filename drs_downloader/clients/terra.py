@@ -1,22 +1,22 @@
+import asyncio
 import subprocess
 from pathlib import Path
 from dataclasses import dataclass
 from typing import Optional
 from drs_downloader import is_AnVIL_URI
 
-import aiofiles
 import aiohttp
 import certifi
 import ssl
 import logging
 import google.auth.transport.requests
-import time
 import random
 import json
 
 from aiohttp import ClientResponseError, ClientConnectorError
 
 from drs_downloader.models import DrsClient, DrsObject, AccessMethod, Checksum
+from drs_downloader.signed_urls import url_expiry
 
 logger = logging.getLogger(__name__)
 file_logger = logging.getLogger("file_logger")
@@ -33,6 +33,7 @@ class TerraDrsClient(DrsClient):
             "https://drshub.dsde-prod.broadinstitute.org/api/v4/drs/resolve"
         )
         self.token = None
+        self._session = None
 
     @dataclass
     class GcloudInfo(object):
@@ -60,40 +61,51 @@ class TerraDrsClient(DrsClient):
         logger.info("gcloud token successfully fetched")
         return creds
 
+    def _get_session(self) -> aiohttp.ClientSession:
+        """Session shared by every request on the running event loop, keeps connections warm between requests."""
+        if self._session is None or self._session.closed:
+            context = ssl.create_default_context(cafile=certifi.where())
+            self._session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(ssl=context, limit=0))
+        return self._session
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
     async def download_part(
         self, drs_object: DrsObject, start: int, size: int, destination_path: Path, verbose: bool = False
     ) -> Optional[Path]:
         tries = 0
+        text = b""
         while True:
             try:
                 headers = {"Range": f"bytes={start}-{size}"}
-                file_name = destination_path / f"{drs_object.name}.{start}.{size}.part"
-                context = ssl.create_default_context(cafile=certifi.where())
-                async with aiohttp.ClientSession(headers=headers) as session:
-                    async with session.get(
-                        drs_object.access_methods[0].access_url, ssl=context
-                    ) as request:
-                        if request.status > 399:
-                            text = await request.content.read()
-
-                            # catches invalid project ids given to AnVIL data downloads
-                            if "User project specified in the request is invalid" in str(text.decode('ascii')):
-                                file_logger.info(f"{str(text.decode('ascii'))}")
-                                if verbose:
-                                    logger.info(f"{str(text.decode('ascii'))}")
-                                if len(drs_object.errors) == 0:
-                                    drs_object.errors.append("User project specified in --user-project \
+                async with self._get_session().get(
+                    drs_object.access_methods[0].access_url, headers=headers
+                ) as request:
+                    if request.status > 399:
+                        text = await request.content.read()
+
+                        # catches invalid project ids given to AnVIL data downloads
+                        if "User project specified in the request is invalid" in str(text.decode('ascii')):
+                            file_logger.info(f"{str(text.decode('ascii'))}")
+                            if verbose:
+                                logger.info(f"{str(text.decode('ascii'))}")
+                            if len(drs_object.errors) == 0:
+                                drs_object.fail("download_part", "User project specified in --user-project \
 option is invalid")
-                                return drs_object
+                            return drs_object
 
-                        request.raise_for_status()
+                    request.raise_for_status()
 
-                        file = await aiofiles.open(file_name, "wb")
-                        self.statistics.set_max_files_open()
-                        async for data in request.content.iter_any():  # uses less memory
-                            await file.write(data)
-                        await file.close()
-                        return Path(file_name)
+                    file = await self.open_part(drs_object, start, size, destination_path)
+                    self.statistics.set_max_files_open()
+                    async for data in request.content.iter_any():  # uses less memory
+                        await self.throttle(drs_object, len(data))
+                        await file.write(data)
+                    await file.close()
+                    return file.path
 
             except aiohttp.ClientResponseError as f:
                 tries += 1
@@ -101,24 +113,26 @@ option is invalid")
                     file_logger.info(f"Error Text Body {str(text)}")
                     if verbose:
                         logger.info(f"Error Text Body {str(text)}")
-                    drs_object.errors.append(f"RECOVERABLE in AIOHTTP {str(f)}")
+                    drs_object.fail("download_part", f"RECOVERABLE in AIOHTTP {str(f)}", recoverable=True)
                     return None
 
-                time.sleep((random.randint(0, 1000) / 1000) + 2**tries)
+                # other parts carry on while this one backs off
+                await asyncio.sleep((random.randint(0, 1000) / 1000) + 2**tries)
                 if tries > 2:
                     file_logger.info(f"Error Text Body {str(text)}")
                     if verbose:
                         logger.info(f"Error Text Body {str(text)}")
-                        return None
+                    drs_object.fail("download_part", f"NONRECOVERABLE ERROR {str(f)}")
+                    return None
 
             except Exception as e:
                 tries += 1
-                time.sleep((random.randint(0, 1000) / 1000) + 2**tries)
+                await asyncio.sleep((random.randint(0, 1000) / 1000) + 2**tries)
                 if tries > 2:
                     file_logger.info(f"Miscellaneous Error {str(text)}")
                     if verbose:
                         logger.info(f"Miscellaneous Error {str(text)}")
-                    drs_object.errors.append(f"NONRECOVERABLE ERROR {str(e)}")
+                    drs_object.fail("download_part", f"NONRECOVERABLE ERROR {str(e)}")
                     return None
 
     async def sign_url(self, drs_object: DrsObject, user_project: str, verbose: bool) -> DrsObject:
@@ -153,102 +167,86 @@ option is invalid")
             elif user_project is None or not user_project.startswith("terra-") or len(user_project) != 14:
                 # Since this would mean a user isn't providing a project id to an AnVIL uri,
                 # or the project id potentially could be invalid stop the downloader before it signs the URI
-                drs_object.errors.append(f"A requestor pays AnVIL DRS URI: {drs_object.self_uri} \
+                drs_object.fail("sign_url", f"A requestor pays AnVIL DRS URI: {drs_object.self_uri} \
 is specified but no Google project id is given.")
                 return drs_object
 
         tries = 0
-        context = ssl.create_default_context(cafile=certifi.where())
-        async with aiohttp.ClientSession(headers=headers) as session:
-            while (
-                True
-            ):  # This is here so that URL signing errors are caught they are rare, but I did capture one
-                try:
-                    async with session.post(url=self.endpoint, json=data, ssl=context) as response:
-                        while (True):
-                            try:
-                                self.statistics.set_max_files_open()
-
-                                # these lines produced an error saying that the content.read() had already closed
-                                if response.status > 399:
-                                    text = await response.content.read()
-
-                                response.raise_for_status()
-                                resp = await response.json(content_type=None)
-                                assert "accessUrl" in resp, resp
-                                if resp["accessUrl"] is None:
-                                    account_command = "gcloud config get-value account"
-                                    cmd = account_command.split(" ")
-                                    account = subprocess.check_output(cmd).decode("ascii")
-                                    raise Exception(
-                                        f"A valid URL was not returned from the server. \
-                                        Please check the access for {account}\n{resp}"
-                                    )
-                                url_ = resp["accessUrl"]["url"]
-                                type = "none"
-                                if "storage.googleapis.com" in url_:
-                                    file_logger.info(f"SIGNED URL: {url_}")
-                                    if verbose:
-                                        logger.info(f"SIGNED URL: {url_}")
-
-                                    type = "gs"
-                                    if "X-Goog-Credential" in url_:
-                                        goog_credential = url_.split("X-Goog-Credential=")[1]
-                                        # If a valid Google project and valid AnVIL DRS uri is used but
-                                        # the signed url does not include the requestor pays pet character
-                                        # add an error to the Drs object so that it does not continue
-                                        # the downloading process
-                                        # since AnVIL DRS uris must be using requestor pays methods
-                                        if vld_uri and not goog_credential.startswith("pet-"):
-                                            drs_object.errors.append(f"Requestor pays user project is specified but \
+        session = self._get_session()
+        while (
+            True
+        ):  # This is here so that URL signing errors are caught they are rare, but I did capture one
+            try:
+                async with session.post(url=self.endpoint, json=data, headers=headers) as response:
+                    while (True):
+                        try:
+                            self.statistics.set_max_files_open()
+
+                            # these lines produced an error saying that the content.read() had already closed
+                            if response.status > 399:
+                                text = await response.content.read()
+
+                            response.raise_for_status()
+                            resp = await response.json(content_type=None)
+                            assert "accessUrl" in resp, resp
+                            if resp["accessUrl"] is None:
+                                account_command = "gcloud config get-value account"
+                                cmd = account_command.split(" ")
+                                account = subprocess.check_output(cmd).decode("ascii")
+                                raise Exception(
+                                    f"A valid URL was not returned from the server. \
+                                    Please check the access for {account}\n{resp}"
+                                )
+                            url_ = resp["accessUrl"]["url"]
+                            type = "none"
+                            if "storage.googleapis.com" in url_:
+                                file_logger.info(f"SIGNED URL: {url_}")
+                                if verbose:
+                                    logger.info(f"SIGNED URL: {url_}")
+
+                                type = "gs"
+                                if "X-Goog-Credential" in url_:
+                                    goog_credential = url_.split("X-Goog-Credential=")[1]
+                                    # If a valid Google project and valid AnVIL DRS uri is used but
+                                    # the signed url does not include the requestor pays pet character
+                                    # add an error to the Drs object so that it does not continue
+                                    # the downloading process
+                                    # since AnVIL DRS uris must be using requestor pays methods
+                                    if vld_uri and not goog_credential.startswith("pet-"):
+                                        drs_object.fail("sign_url", f"Requestor pays user project is specified but \
 the signed URL Google credential contains unexpected value: {goog_credential}")
-                                            return drs_object
-
-                                drs_object.access_methods = [
-                                    AccessMethod(access_url=url_, type=type)
-                                ]
+                                        return drs_object
+
+                            drs_object.access_methods = [
+                                AccessMethod(access_url=url_, type=type, expires=url_expiry(url_))
+                            ]
+                            return drs_object
+                        except ClientResponseError as e:
+                            tries += 1
+                            if self.token.expired and self.token.expiry is not None:
+                                self.token = await self._get_auth_token()
+                            await asyncio.sleep((random.randint(0, 1000) / 1000) + 2**tries)
+                            if tries > 2:
+                                file_logger.error(f"value of text error  {str(text)}")
+                                file_logger.error(f"A file has failed the signing process, specifically {str(e)}")
+                                if verbose:
+                                    logger.error(f"value of text error  {str(text)}")
+                                    logger.error(f"A file has failed the signing process, specifically {str(e)}")
+                                # the failure stays on the object so the caller knows which one failed
+                                drs_object.fail("sign_url", f"error: {str(text)}", recoverable="401" in str(e))
                                 return drs_object
-                            except ClientResponseError as e:
-                                tries += 1
-                                if self.token.expired and self.token.expiry is not None:
-                                    self.token = await self._get_auth_token()
-                                time.sleep((random.randint(0, 1000) / 1000) + 2**tries)
-                                if tries > 2:
-                                    file_logger.error(f"value of text error  {str(text)}")
-                                    file_logger.error(f"A file has failed the signing process, specifically {str(e)}")
-                                    if verbose:
-                                        logger.error(f"value of text error  {str(text)}")
-                                        logger.error(f"A file has failed the signing process, specifically {str(e)}")
-                                        if "401" in str(e):
-                                            drs_object.errors.append(f"RECOVERABLE in AIOHTTP {str(e)}")
-
-                                    return DrsObject(
-                                        self_uri="",
-                                        id="",
-                                        checksums=[],
-                                        size=0,
-                                        name=None,
-                                        errors=[f"error: {str(text)}"],
-                                    )
-
-                except ClientConnectorError as e:
-                    tries += 1
-                    if self.token.expired and self.token.expiry is not None:
-                        self.token = await self._get_auth_token()
-                    time.sleep((random.randint(0, 1000) / 1000) + 2**tries)
-                    if tries > 2:
-                        drs_object.errors.append(str(e))
-                        file_logger.error(f"retry failed in sign_url function. Exiting with error status: {str(e)}")
-                        if verbose:
-                            logger.error(f"retry failed in sign_url function. Exiting with error status: {str(e)}")
-                            return DrsObject(
-                                self_uri="",
-                                id="",
-                                checksums=[],
-                                size=0,
-                                name=None,
-                                errors=[f"error: {str(text)}"],
-                            )
+
+            except ClientConnectorError as e:
+                tries += 1
+                if self.token.expired and self.token.expiry is not None:
+                    self.token = await self._get_auth_token()
+                await asyncio.sleep((random.randint(0, 1000) / 1000) + 2**tries)
+                if tries > 2:
+                    drs_object.fail("sign_url", str(e))
+                    file_logger.error(f"retry failed in sign_url function. Exiting with error status: {str(e)}")
+                    if verbose:
+                        logger.error(f"retry failed in sign_url function. Exiting with error status: {str(e)}")
+                    return drs_object
 
     async def get_object(self, object_id: str, verbose: bool = False) -> DrsObject:
         """Sends a POST request for the signed URL, hash, and file size of a given DRS object.
@@ -281,64 +279,63 @@ the signed URL Google credential contains unexpected value: {goog_credential}")
         }
 
         tries = 0
-        context = ssl.create_default_context(cafile=certifi.where())
-        async with aiohttp.ClientSession(headers=headers) as session:
-            while True:  # this is here for the somewhat more common Martha disconnects.
-                try:
-                    async with session.post(url=self.endpoint, json=data, ssl=context) as response:
-                        while True:
-                            try:
-                                self.statistics.set_max_files_open()
-                                if response.status > 399:
-                                    text = await response.content.read()
-
-                                response.raise_for_status()
-                                resp = await response.json(content_type=None)
-                                md5_ = resp["hashes"]["md5"]
-                                size_ = resp["size"]
-                                name_ = resp["fileName"]
-                                return DrsObject(
-                                    self_uri=object_id,
-                                    size=size_,
-                                    checksums=[Checksum(checksum=md5_, type="md5")],
-                                    id=object_id,
-                                    name=name_,
-                                )
-                            except ClientResponseError:
-                                # nested stringy json parsing
-                                message = json.loads(text)["message"]
-                                start_index = message.find("{")
-                                end_index = message.find("}")
-                                extracted_text = json.loads("{" + message[start_index + 1:end_index] + "}")
-                                file_logger.info(f'Client Response Error {extracted_text["status_code"]}: \
+        session = self._get_session()
+        while True:  # this is here for the somewhat more common Martha disconnects.
+            try:
+                async with session.post(url=self.endpoint, json=data, headers=headers) as response:
+                    while True:
+                        try:
+                            self.statistics.set_max_files_open()
+                            if response.status > 399:
+                                text = await response.content.read()
+
+                            response.raise_for_status()
+                            resp = await response.json(content_type=None)
+                            md5_ = resp["hashes"]["md5"]
+                            size_ = resp["size"]
+                            name_ = resp["fileName"]
+                            return DrsObject(
+                                self_uri=object_id,
+                                size=size_,
+                                checksums=[Checksum(checksum=md5_, type="md5")],
+                                id=object_id,
+                                name=name_,
+                            )
+                        except ClientResponseError:
+                            # nested stringy json parsing
+                            message = json.loads(text)["message"]
+                            start_index = message.find("{")
+                            end_index = message.find("}")
+                            extracted_text = json.loads("{" + message[start_index + 1:end_index] + "}")
+                            file_logger.info(f'Client Response Error {extracted_text["status_code"]}: \
 {extracted_text["msg"]}')
-                                if verbose:
-                                    logger.info(f'Client Response Error {extracted_text["status_code"]}: \
+                            if verbose:
+                                logger.info(f'Client Response Error {extracted_text["status_code"]}: \
 {extracted_text["msg"]}')
-                                return DrsObject(
-                                    self_uri=object_id,
-                                    id=object_id,
-                                    checksums=[],
-                                    size=0,
-                                    name=None,
-                                    errors=[f'{extracted_text["status_code"]}: {extracted_text["msg"]} on \
+                            return DrsObject(
+                                self_uri=object_id,
+                                id=object_id,
+                                checksums=[],
+                                size=0,
+                                name=None,
+                                errors=[f'{extracted_text["status_code"]}: {extracted_text["msg"]} on \
 URI: {object_id}'],
-                                )
-                except ClientConnectorError as e:
-                    tries += 1
-                    file_logger.info(f"ClientConnectorError: {str(e)} while fetching object information")
+                            )
+            except ClientConnectorError as e:
+                tries += 1
+                file_logger.info(f"ClientConnectorError: {str(e)} while fetching object information")
+                if verbose:
+                    logger.info(f"ClientConnectorError: {str(e)} while fetching object information")
+                await asyncio.sleep((random.randint(0, 1000) / 1000) + 2**tries)
+                if tries > 2:
                     if verbose:
-                        logger.info(f"ClientConnectorError: {str(e)} while fetching object information")
-                    time.sleep((random.randint(0, 1000) / 1000) + 2**tries)
-                    if tries > 2:
-                        if verbose:
-                            logger.error(f"value of text error {str(text)}")
-                            logger.error(f"retry failed in get_object function. Exiting with error status: {str(e)}")
-                        return DrsObject(
-                            self_uri=object_id,
-                            id=object_id,
-                            checksums=[],
-                            size=0,
-                            name=None,
-                            errors=[str(e)],
-                        )
+                        logger.error(f"value of text error {str(text)}")
+                        logger.error(f"retry failed in get_object function. Exiting with error status: {str(e)}")
+                    return DrsObject(
+                        self_uri=object_id,
+                        id=object_id,
+                        checksums=[],
+                        size=0,
+                        name=None,
+                        errors=[str(e)],
+                    )
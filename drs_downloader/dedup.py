@@ -0,0 +1,170 @@
+"""Fetch the bytes of objects listed more than once in a manifest only once.
+
+Objects with the same checksum and size, e.g. the same crai under the URIs of two workspaces, share their bytes.
+The first one to be signed downloads them, the others wait without holding a connection and are then given their
+own file in the destination as a reflink or else a copy of the first one's. Hardlinks are only used when asked
+for: the files then share one inode, so editing or truncating one changes the others.
+If the download fails, the next object of the group downloads the bytes instead.
+
+Only the files of the `max_sources` groups downloaded or shared from last are remembered, so a streamed manifest of
+any length is deduplicated in bounded memory; a group seen again after that is downloaded again.
+"""
+import collections
+import errno
+import logging
+import os
+import shutil
+import threading
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+from drs_downloader import DEFAULT_DEDUP_SOURCES
+from drs_downloader.models import DrsObject
+
+file_logger = logging.getLogger("file_logger")
+
+# FICLONE from linux/fs.h, share the source's extents with the new file
+_FICLONE = 0x40049409
+
+# the filesystem cannot link or clone these files, the next way is tried
+_UNSUPPORTED = {
+    errno.EXDEV, errno.EPERM, errno.EOPNOTSUPP, errno.ENOTSUP, errno.ENOTTY, errno.EINVAL, errno.EMLINK, errno.ENOSYS,
+}
+
+
+def _hardlink(source: Path, destination: Path):
+    os.link(source, destination)
+
+
+def _reflink(source: Path, destination: Path):
+    import fcntl
+
+    with open(source, "rb") as src, open(destination, "wb") as dst:
+        try:
+            fcntl.ioctl(dst.fileno(), _FICLONE, src.fileno())
+        except OSError:
+            dst.close()
+            destination.unlink()
+            raise
+
+
+def _copy(source: Path, destination: Path):
+    # copy_file_range or sendfile where the platform has them
+    shutil.copyfile(source, destination)
+
+
+LINKS: List[Tuple[str, Callable[[Path, Path], None]]] = [
+    (name, link)
+    for name, link, available in [
+        ("reflink", _reflink, os.name == "posix" and os.uname().sysname == "Linux"),
+        ("copy", _copy, True),
+    ]
+    if available
+]
+"""Ways of making a file with the bytes of another that can then be changed on its own, cheapest first."""
+
+HARDLINKS: List[Tuple[str, Callable[[Path, Path], None]]] = (
+    [("hardlink", _hardlink)] if hasattr(os, "link") else []
+) + LINKS
+"""LINKS, after a hardlink where the platform has them: the two names are then one file."""
+
+
+def place(source: Path, destination: Path, links=None) -> str:
+    """Make destination a file with the bytes of source, replacing whatever is there.
+
+    The file is made under a temporary name and renamed, so destination is never seen half written.
+
+    Returns:
+        how the file was made, e.g. reflink
+    """
+    links = LINKS if links is None else links
+    temporary = destination.with_name(f"{destination.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    for name, link in links:
+        try:
+            link(source, temporary)
+        except OSError as e:
+            temporary.unlink(missing_ok=True)
+            if e.errno not in _UNSUPPORTED or name == links[-1][0]:
+                raise
+            continue
+        os.replace(temporary, destination)
+        return name
+
+
+ContentKey = Tuple[str, str, int]
+
+
+def content_key(drs_object: DrsObject) -> Optional[ContentKey]:
+    """Checksum type, checksum and size; None for an object without a checksum, which is never shared."""
+    if not drs_object.checksums or not drs_object.checksums[0].checksum:
+        return None
+    checksum = drs_object.checksums[0]
+    return checksum.type, checksum.checksum.lower(), drs_object.size
+
+
+class Deduplicator(object):
+    """Groups of objects with the same bytes, and what sharing them saved."""
+
+    def __init__(self, hardlinks: bool = False, max_sources: int = DEFAULT_DEDUP_SOURCES):
+        """
+        Args:
+            hardlinks: give the objects of a group one file under several names where the filesystem allows
+            max_sources: most groups whose file is remembered, the least recently used is forgotten first
+        """
+        self.links = HARDLINKS if hardlinks else LINKS
+        self.max_sources = max_sources
+        self._downloading: Dict[ContentKey, List[DrsObject]] = {}
+        self._downloaded: "collections.OrderedDict[ContentKey, Path]" = collections.OrderedDict()
+        self.objects = 0
+        """Objects made from the bytes of another."""
+        self.bytes = 0
+        """Bytes not downloaded thanks to it."""
+
+    def source(self, drs_object: DrsObject) -> Optional[Path]:
+        """The file of an object with the same bytes that is already downloaded."""
+        key = content_key(drs_object)
+        path = self._downloaded.get(key) if key is not None else None
+        if path is not None and not path.is_file():
+            del self._downloaded[key]
+            return None
+        if path is not None:
+            self._downloaded.move_to_end(key)
+        return path
+
+    def follow(self, drs_object: DrsObject) -> bool:
+        """True if an object with the same bytes is downloading, drs_object then waits for it in `finished`.
+
+        Otherwise drs_object downloads the bytes for every object of its group that comes after it.
+        """
+        key = content_key(drs_object)
+        if key is None:
+            return False
+        if key in self._downloading:
+            self._downloading[key].append(drs_object)
+            return True
+        self._downloading[key] = []
+        return False
+
+    def finished(self, drs_object: DrsObject) -> Tuple[List[DrsObject], Optional[DrsObject]]:
+        """The object downloading the bytes of its group is done.
+
+        Returns:
+            the objects waiting for its bytes, and the next one to download them if it failed
+        """
+        key = content_key(drs_object)
+        if key is None or key not in self._downloading:
+            return [], None
+        if len(drs_object.errors) == 0 and drs_object.path is not None:
+            self._downloaded[key] = drs_object.path
+            if len(self._downloaded) > self.max_sources:
+                self._downloaded.popitem(last=False)
+            return self._downloading.pop(key), None
+        followers = self._downloading.pop(key)
+        if not followers:
+            return [], None
+        self._downloading[key] = followers[1:]
+        return [], followers[0]
+
+    def saved(self, drs_object: DrsObject):
+        self.objects += 1
+        self.bytes += drs_object.size
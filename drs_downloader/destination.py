@@ -0,0 +1,114 @@
+"""What is already in the destination directory, read with one pass over it instead of a listing per object.
+
+The same pass lists the `.part` files left by interrupted downloads, by object name.
+"""
+import logging
+import os
+from pathlib import Path
+from typing import Dict, List, Optional, Set, Tuple
+
+from drs_downloader.models import DrsObject
+from drs_downloader.parts import parse_part_name
+
+file_logger = logging.getLogger("file_logger")
+
+COMPLETE = "complete"
+"""A file of the object's name and size is in the destination."""
+RESUMABLE = "resumable"
+"""A file of the object's name is in the destination but not of its size, e.g. left by an interrupted stitch."""
+MISSING = "missing"
+
+
+class DestinationIndex(object):
+    """The files in a destination directory by name, sizes are looked up only for names the manifest asks for.
+
+    Decisions are kept by object id, so an object retried or seen again costs a dictionary lookup. A run that sees
+    each object once, e.g. a streamed manifest, lets go of an object's entry and decision with `forget` once it is
+    finished, so the index shrinks as the manifest goes rather than growing with it.
+    """
+
+    def __init__(
+        self, destination_path: Path, names: Optional[Dict[str, Optional[int]]] = None,
+        parts: Optional[Dict[str, List[Tuple[int, int]]]] = None,
+    ):
+        """
+        Args:
+            destination_path: directory the files are downloaded to
+            names: size of every file in it by name, None where it has not been looked up yet
+            parts: first and last byte of every `.part` file in it, by object name
+        """
+        self.destination_path = Path(destination_path)
+        self._sizes: Dict[str, Optional[int]] = names if names is not None else {}
+        self._parts: Dict[str, List[Tuple[int, int]]] = parts if parts is not None else {}
+        self._complete: Set[str] = set()
+        self._resumable: Set[str] = set()
+
+    @classmethod
+    def scan(cls, destination_path: Path) -> "DestinationIndex":
+        """Index the files in destination_path, a missing directory is an empty one."""
+        names = {}
+        parts = {}
+        try:
+            with os.scandir(destination_path) as entries:
+                for entry in entries:
+                    # the type comes with the directory entry on most filesystems, no stat per file
+                    if entry.is_file():
+                        names[entry.name] = None
+                        part = parse_part_name(entry.name)
+                        if part is not None:
+                            parts.setdefault(part[0], []).append(part[1:])
+        except FileNotFoundError:
+            pass
+        file_logger.info(f"{len(names)} files in {destination_path}")
+        return cls(destination_path, names, parts)
+
+    def size(self, name: str) -> Optional[int]:
+        """Size of the file of that name, None if there is none."""
+        if name not in self._sizes:
+            return None
+        size = self._sizes[name]
+        if size is None:
+            try:
+                size = os.stat(self.destination_path / name).st_size
+            except FileNotFoundError:
+                del self._sizes[name]
+                return None
+            self._sizes[name] = size
+        return size
+
+    def parts(self, name: str) -> List[Tuple[int, int]]:
+        """First and last byte of every `.part` file of the object `name` when the directory was scanned."""
+        return self._parts.get(name, [])
+
+    def status(self, drs_object: DrsObject) -> str:
+        """COMPLETE, RESUMABLE or MISSING."""
+        if drs_object.id in self._complete:
+            return COMPLETE
+        if drs_object.id in self._resumable:
+            return RESUMABLE
+        size = self.size(drs_object.name) if drs_object.name else None
+        if size is None:
+            return MISSING
+        if size == drs_object.size:
+            self._complete.add(drs_object.id)
+            return COMPLETE
+        self._resumable.add(drs_object.id)
+        return RESUMABLE
+
+    def is_resumable(self, object_id: str) -> bool:
+        """The object's name is taken by a file of the wrong size, which its download is to replace."""
+        return object_id in self._resumable
+
+    def add(self, drs_object: DrsObject):
+        """The object's file is complete."""
+        self._sizes[drs_object.name] = drs_object.size
+        self._resumable.discard(drs_object.id)
+        self._complete.add(drs_object.id)
+
+    def forget(self, drs_object: DrsObject):
+        """Drop what is known of the object and of the files under its name, it is not looked up again."""
+        self._complete.discard(drs_object.id)
+        self._resumable.discard(drs_object.id)
+        if drs_object.name:
+            self._sizes.pop(drs_object.name, None)
+            self._parts.pop(drs_object.name, None)
@@ -0,0 +1,115 @@
+"""Only start objects whose bytes fit on disk, the others wait instead of failing with ENOSPC halfway."""
+import asyncio
+import logging
+import os
+import shutil
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Tuple
+
+from drs_downloader import DEFAULT_DISK_HEADROOM
+
+file_logger = logging.getLogger("file_logger")
+
+
+def free_bytes(path: Path) -> int:
+    """Bytes available to this user on the filesystem holding path, statvfs f_bavail * f_frsize on posix."""
+    return shutil.disk_usage(path).free
+
+
+class NotEnoughDiskSpace(Exception):
+    """An object does not fit on disk even with nothing else downloading."""
+
+
+class DiskSpace(object):
+    """Reserve the disk space an object needs before it starts, per filesystem.
+
+    A reservation is what the object has still to write: its remaining parts where the parts are kept and the
+    stitched file in the destination, which at the peak is about twice its size on one filesystem. As parts land
+    on disk they show up in the free space, so they are taken off the reservation (see `consumed`).
+    """
+
+    def __init__(
+        self,
+        headroom: int = DEFAULT_DISK_HEADROOM,
+        free_space: Callable[[Path], int] = free_bytes,
+        poll_interval: float = 5.0,
+        share: float = 1.0,
+    ):
+        """
+        Args:
+            headroom: bytes always left free on every filesystem
+            free_space: returns the free bytes of the filesystem holding a path
+            poll_interval: seconds between checks while objects wait, space may be freed by other processes
+            share: fraction of the free space this process may reserve, for worker processes sharing a disk
+        """
+        self.headroom = headroom
+        self.free_space = free_space
+        self.poll_interval = poll_interval
+        self.share = share
+        self._reserved: Dict[Any, Dict[int, int]] = {}
+        self._paths: Dict[int, Path] = {}
+        self._changed = asyncio.Condition()
+
+    def _outstanding(self, device: int) -> int:
+        return sum(reservation.get(device, 0) for reservation in self._reserved.values())
+
+    def _fits(self, need: Dict[int, int]) -> bool:
+        return all(
+            self.free_space(self._paths[device]) * self.share - self._outstanding(device) - self.headroom >= nbytes
+            for device, nbytes in need.items()
+        )
+
+    @staticmethod
+    def device(path: Path) -> int:
+        return os.stat(path).st_dev
+
+    @asynccontextmanager
+    async def reserve(self, key: Any, need: Iterable[Tuple[Path, int]]):
+        """Wait until the bytes fit, hold them while the object downloads.
+
+        Args:
+            key: the object
+            need: (directory, bytes to be written there), directories on the same filesystem add up
+
+        Raises:
+            NotEnoughDiskSpace: the object cannot fit even with nothing else downloading
+        """
+        by_device: Dict[int, int] = {}
+        for path, nbytes in need:
+            device = self.device(path)
+            self._paths.setdefault(device, Path(path))
+            by_device[device] = by_device.get(device, 0) + max(0, nbytes)
+
+        async with self._changed:
+            waited = False
+            while not self._fits(by_device):
+                if not self._reserved:
+                    raise NotEnoughDiskSpace(
+                        f"{key} needs {sum(by_device.values())} bytes, "
+                        f"only {min(self.free_space(self._paths[d]) for d in by_device)} are free"
+                    )
+                if not waited:
+                    file_logger.info(f"Waiting for disk space to download {key}")
+                    waited = True
+                try:
+                    await asyncio.wait_for(self._changed.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+            self._reserved[key] = by_device
+
+        try:
+            yield self
+        finally:
+            async with self._changed:
+                self._reserved.pop(key, None)
+                self._changed.notify_all()
+
+    def consumed(self, key: Any, path: Path, nbytes: int):
+        """Bytes of a reservation have been written to disk, the free space now accounts for them."""
+        reservation = self._reserved.get(key)
+        if reservation is None:
+            return
+        device = self.device(path)
+        if device in reservation:
+            reservation[device] = max(0, reservation[device] - nbytes)
@@ -0,0 +1,111 @@
+"""Run the whole download job on a single, long lived event loop.
+
+The loop implementation is pluggable:
+
+- asyncio: the standard library loop.
+- uvloop: a faster libuv based loop, used when the optional `uvloop` package is installed.
+- auto: uvloop where it is installed, asyncio otherwise.
+"""
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, TypeVar
+
+from drs_downloader import DEFAULT_EVENT_LOOP
+
+logger = logging.getLogger()
+file_logger = logging.getLogger("file_logger")
+
+T = TypeVar("T")
+
+
+def _uvloop_factory() -> asyncio.AbstractEventLoop:
+    import uvloop
+
+    return uvloop.new_event_loop()
+
+
+LOOP_FACTORIES: Dict[str, Callable[[], asyncio.AbstractEventLoop]] = {
+    "asyncio": asyncio.new_event_loop,
+    "uvloop": _uvloop_factory,
+}
+
+
+def uvloop_available() -> bool:
+    """True if the optional uvloop package can be imported."""
+    try:
+        import uvloop  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def resolve_loop_name(name: str = DEFAULT_EVENT_LOOP) -> str:
+    """Map a requested loop name to an installed loop implementation.
+
+    Args:
+        name: one of `auto`, `asyncio` or `uvloop`
+
+    Returns:
+        the name of the loop implementation that will be used
+    """
+    if name == "auto":
+        return "uvloop" if uvloop_available() else "asyncio"
+    if name not in LOOP_FACTORIES:
+        raise ValueError(f"Unknown event loop '{name}', expected one of {['auto'] + list(LOOP_FACTORIES)}")
+    if name == "uvloop" and not uvloop_available():
+        raise ValueError("Event loop 'uvloop' requested but the uvloop package is not installed.")
+    return name
+
+
+def new_event_loop(name: str = DEFAULT_EVENT_LOOP) -> asyncio.AbstractEventLoop:
+    """Create a new event loop of the requested implementation."""
+    return LOOP_FACTORIES[resolve_loop_name(name)]()
+
+
+def run(main: Awaitable[T], name: str = DEFAULT_EVENT_LOOP) -> T:
+    """Run a coroutine to completion on a new event loop, like `asyncio.run` with a pluggable loop.
+
+    Args:
+        main: the coroutine to run, typically the entire job
+        name: loop implementation, see `LOOP_FACTORIES`
+
+    Returns:
+        the result of the coroutine
+    """
+    loop = new_event_loop(name)
+    file_logger.info(f"Running on event loop {type(loop).__module__}.{type(loop).__name__}")
+    try:
+        asyncio.set_event_loop(loop)
+        return loop.run_until_complete(main)
+    finally:
+        try:
+            _cancel_all_tasks(loop)
+            loop.run_until_complete(loop.shutdown_asyncgens())
+            loop.run_until_complete(loop.shutdown_default_executor())
+        finally:
+            asyncio.set_event_loop(None)
+            loop.close()
+
+
+def _cancel_all_tasks(loop: asyncio.AbstractEventLoop):
+    """Cancel anything left running on the loop, mirrors the cleanup in `asyncio.run`."""
+    to_cancel = asyncio.all_tasks(loop)
+    if not to_cancel:
+        return
+
+    for task in to_cancel:
+        task.cancel()
+
+    loop.run_until_complete(asyncio.gather(*to_cancel, return_exceptions=True))
+
+    for task in to_cancel:
+        if task.cancelled():
+            continue
+        if task.exception() is not None:
+            loop.call_exception_handler(
+                {
+                    "message": "unhandled exception during event loop shutdown",
+                    "exception": task.exception(),
+                    "task": task,
+                }
+            )
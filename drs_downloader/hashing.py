@@ -0,0 +1,198 @@
+"""Compute an object's checksum while its parts download, instead of in a second pass over the file.
+
+Parts finish out of order, but a hash can only be fed in order. The frontier is the first part not yet in the
+hash: the bytes of that part go into the hash as they are written, bytes of later parts are held in memory until
+the frontier reaches them. Past a memory budget a later part keeps nothing and is read back from disk once the
+frontier gets there. When the last byte arrives only the parts still held, if any, are left to hash.
+"""
+import asyncio
+import hashlib
+import mmap
+import os
+from pathlib import Path
+from typing import List, Optional, Sequence, Tuple
+
+from drs_downloader import DEFAULT_HASH_BUFFER, MB
+from drs_downloader.writers import PartSink
+
+
+def _update(checksum, chunks: List[bytes]):
+    for chunk in chunks:
+        checksum.update(chunk)
+
+
+def _update_from_file(checksum, path: Path, offset: int, length: Optional[int]):
+    """Feed `length` bytes of the file from `offset`, or up to its end if length is None."""
+    with open(path, "rb") as f:
+        end = os.fstat(f.fileno()).st_size
+        if length is not None:
+            end = min(end, offset + length)
+        if end <= offset:
+            return
+        # hashed straight from the page cache, without copying into Python buffers
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped, memoryview(mapped) as view:
+            for position in range(offset, end, 10 * MB):
+                checksum.update(view[position:min(position + 10 * MB, end)])
+
+
+def hash_file(checksum, path: Path):
+    """Feed the whole file."""
+    _update_from_file(checksum, path, 0, None)
+
+
+class _Part(object):
+    def __init__(self, start: int, size: int):
+        self.start = start
+        self.size = size
+        self.chunks: List[bytes] = []
+        self.opened = False
+        self.hashed = False
+        """Some of its bytes are in the hash."""
+        self.overflow = False
+        """Its bytes did not fit in memory, it is read back from disk."""
+        self.closed = False
+        self.path: Optional[Path] = None
+
+
+class _Tee(PartSink):
+    def __init__(self, frontier: "HashFrontier", index: int, sink: PartSink):
+        self.path = sink.path
+        self._frontier = frontier
+        self._index = index
+        self._sink = sink
+
+    async def write(self, data: bytes):
+        await self._sink.write(data)
+        self._frontier.feed(self._index, data)
+
+    async def close(self):
+        await self._sink.close()
+        await self._frontier.complete(self._index, self.path)
+
+
+class HashFrontier(object):
+    """The checksum of one object, fed in order as its parts arrive."""
+
+    def __init__(
+        self, checksum, parts: Sequence[Tuple[int, int]], object_size: int, in_place: bool,
+        max_buffered: int = DEFAULT_HASH_BUFFER,
+    ):
+        """
+        Args:
+            checksum: a new hashlib object
+            parts: (start, size) of every part, in order
+            object_size: bytes of the object, the last part may claim one more
+            in_place: parts are written at their offset in one file rather than each to its own file
+            max_buffered: most bytes of later parts held in memory
+        """
+        self.checksum = checksum
+        self.object_size = object_size
+        self.in_place = in_place
+        self.max_buffered = max_buffered
+        self._parts = [_Part(start, size) for start, size in parts]
+        self._indexes = {start: index for index, (start, _) in enumerate(parts)}
+        self._index = 0
+        self._buffered = 0
+        self._draining = False
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._broken = False
+        """A part was written again after some of its bytes were hashed, the file is hashed from disk instead."""
+
+    def track(self, start: int, sink: PartSink) -> PartSink:
+        """Wrap the sink of the part from `start`, its bytes go into the hash as they are written."""
+        index = self._indexes.get(start)
+        if index is None:
+            self._broken = True
+            return sink
+        part = self._parts[index]
+        if part.opened:
+            # written again, e.g. a retry after the connection dropped
+            if part.hashed:
+                self._broken = True
+            self._buffered -= sum(len(chunk) for chunk in part.chunks)
+            part.chunks = []
+            part.overflow = False
+        part.opened = True
+        return _Tee(self, index, sink)
+
+    def feed(self, index: int, data: bytes):
+        part = self._parts[index]
+        if self._broken or part.overflow:
+            return
+        if index == self._index and not self._draining and not part.chunks:
+            self.checksum.update(data)
+            part.hashed = True
+            return
+        part.chunks.append(data)
+        self._buffered += len(data)
+        if self._buffered > self.max_buffered and index != self._index:
+            # read back from disk when its turn comes
+            self._buffered -= sum(len(chunk) for chunk in part.chunks)
+            part.chunks = []
+            part.overflow = True
+
+    def existing(self, index: int, path: Path):
+        """The part was already on disk, e.g. from an interrupted download."""
+        part = self._parts[index]
+        part.closed = True
+        part.overflow = True
+        part.path = path
+
+    async def complete(self, index: int, path: Path):
+        part = self._parts[index]
+        part.closed = True
+        part.path = path
+        await self._advance()
+
+    def _location(self, part: _Part) -> Tuple[Path, int, Optional[int]]:
+        if self.in_place:
+            return part.path, part.start, min(part.size + 1, self.object_size) - part.start
+        return part.path, 0, None
+
+    async def _advance(self):
+        """Move the frontier past every part that is complete, or hash what has arrived of the next one."""
+        if self._draining or self._broken:
+            return
+        self._draining = True
+        self._idle.clear()
+        try:
+            while self._index < len(self._parts):
+                part = self._parts[self._index]
+                if part.chunks:
+                    chunks, part.chunks = part.chunks, []
+                    self._buffered -= sum(len(chunk) for chunk in chunks)
+                    part.hashed = True
+                    await asyncio.to_thread(_update, self.checksum, chunks)
+                    continue
+                if not part.closed:
+                    break
+                if part.overflow:
+                    part.hashed = True
+                    await asyncio.to_thread(_update_from_file, self.checksum, *self._location(part))
+                self._index += 1
+        finally:
+            self._draining = False
+            self._idle.set()
+
+    async def finish(self, paths: Sequence[Path]):
+        """The checksum once every part is on disk.
+
+        Args:
+            paths: the path of every part, as returned by download_part
+        """
+        for part, path in zip(self._parts, paths):
+            if not part.closed:
+                # written without open_part, the bytes are only on disk
+                part.closed = True
+                part.overflow = True
+                part.path = path
+        # a part that finished earlier may still be hashing
+        await self._idle.wait()
+        await self._advance()
+        if self._broken or self._index < len(self._parts):
+            self.checksum = hashlib.new(self.checksum.name)
+            for part, path in zip(self._parts, paths):
+                part.path = path
+                await asyncio.to_thread(_update_from_file, self.checksum, *self._location(part))
+        return self.checksum
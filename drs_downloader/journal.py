@@ -0,0 +1,245 @@
+"""Record which bytes of an object are on disk, so an interrupted download resumes without looking at its parts.
+
+Each object being downloaded has a journal, `{name}.journal` in the destination, holding its size, its part size
+and the byte ranges written so far as a range set, e.g. `0-20971520,41943042-52428800`. A range is added once its
+bytes have been synced to disk, along with the CRC-32 of the part's bytes: a part left by an interrupted download
+is only reused if its bytes still match, and an object that fails its checksum can be repaired by downloading
+again only the parts that no longer match or were never hashed.
+
+The journal is rewritten to a temporary file and renamed over the previous one, so a crash at any point leaves
+either the old or the new journal, never a mix. Journals are saved at most every `flush_interval` seconds while
+parts keep arriving, and at once when an object stops, fails or the process receives SIGINT or SIGTERM.
+"""
+import bisect
+import json
+import logging
+import os
+import signal
+import threading
+import time
+import weakref
+import zlib
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+file_logger = logging.getLogger("file_logger")
+
+JOURNAL_FORMAT = 1
+
+
+class RangeSet(object):
+    """Disjoint inclusive byte ranges, kept sorted; touching ranges are merged."""
+
+    def __init__(self, ranges: Optional[List[Tuple[int, int]]] = None):
+        self._starts: List[int] = []
+        self._ends: List[int] = []
+        for start, end in ranges or []:
+            self.add(start, end)
+
+    def add(self, start: int, end: int):
+        """Add the bytes from start to end, inclusive."""
+        if end < start:
+            return
+        # the first range that ends at or after start - 1 and the first that starts after end + 1
+        low = bisect.bisect_left(self._ends, start - 1)
+        high = bisect.bisect_right(self._starts, end + 1)
+        if low < high:
+            start = min(start, self._starts[low])
+            end = max(end, self._ends[high - 1])
+        self._starts[low:high] = [start]
+        self._ends[low:high] = [end]
+
+    def covers(self, start: int, end: int) -> bool:
+        """True if every byte from start to end is in the set."""
+        index = bisect.bisect_right(self._starts, start) - 1
+        return index >= 0 and self._ends[index] >= end
+
+    def total(self) -> int:
+        """Number of bytes in the set."""
+        return sum(end - start + 1 for start, end in self)
+
+    def __iter__(self) -> Iterator[Tuple[int, int]]:
+        return iter(zip(self._starts, self._ends))
+
+    def __len__(self) -> int:
+        return len(self._starts)
+
+    def __str__(self) -> str:
+        return ",".join(f"{start}-{end}" for start, end in self)
+
+    @classmethod
+    def parse(cls, text: str) -> "RangeSet":
+        """
+        Raises:
+            ValueError: not of the form `start-end,start-end`
+        """
+        ranges = []
+        for item in filter(None, text.split(",")):
+            start, end = item.split("-")
+            ranges.append((int(start), int(end)))
+        return cls(ranges)
+
+
+def file_crc(path: Path, offset: int, length: int) -> Optional[int]:
+    """CRC-32 of `length` bytes of the file from `offset`, None if the file is missing or shorter."""
+    crc = 0
+    try:
+        with open(path, "rb") as f:
+            f.seek(offset)
+            while length > 0:
+                buffer = f.read(min(length, 10 * 1024 * 1024))
+                if not buffer:
+                    return None
+                crc = zlib.crc32(buffer, crc)
+                length -= len(buffer)
+    except FileNotFoundError:
+        return None
+    return crc
+
+
+_OPEN: "weakref.WeakSet[Journal]" = weakref.WeakSet()
+
+
+class Journal(object):
+    """The byte ranges of one object already on disk."""
+
+    def __init__(self, path: Path, object_size: int, part_size: int, ranges: Optional[RangeSet] = None,
+                 flush_interval: float = 1.0, crcs: Optional[Dict[int, int]] = None):
+        """
+        Args:
+            path: where the journal is saved
+            object_size: bytes of the object
+            part_size: part size of the download, a resumed download keeps it so its ranges line up with its parts
+            ranges: bytes already on disk
+            flush_interval: most seconds a finished part may go unsaved while the download carries on
+            crcs: CRC-32 of the parts on disk, by the part's first byte
+        """
+        self.path = Path(path)
+        self.object_size = object_size
+        self.part_size = part_size
+        self.ranges = ranges if ranges is not None else RangeSet()
+        self.crcs = crcs if crcs is not None else {}
+        self.flush_interval = flush_interval
+        self.resumed = False
+        """Loaded from an earlier, interrupted download."""
+        self._dirty = True
+        self._flushed_at = 0.0
+        self._lock = threading.RLock()
+        _OPEN.add(self)
+
+    @classmethod
+    def load(cls, path: Path, object_size: int) -> Optional["Journal"]:
+        """The journal saved at path, None if there is none or it is not for an object of this size."""
+        try:
+            with open(path) as f:
+                saved = json.load(f)
+            if saved["format"] != JOURNAL_FORMAT or saved["size"] != object_size:
+                return None
+            crcs = {int(start): int(crc) for start, crc in saved.get("crc32", {}).items()}
+            journal = cls(path, object_size, int(saved["part_size"]), RangeSet.parse(saved["ranges"]), crcs=crcs)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            file_logger.warning(f"Ignoring unreadable journal {path}: {e}")
+            return None
+        journal.resumed = True
+        journal._dirty = False
+        return journal
+
+    def part_end(self, start: int, size: int) -> int:
+        """Last byte of the part from start to size, the last part asks for one byte past the end of the object."""
+        return min(size, self.object_size - 1)
+
+    def has_part(self, start: int, size: int) -> bool:
+        return self.covers(start, self.part_end(start, size))
+
+    def covers(self, start: int, end: int) -> bool:
+        with self._lock:
+            return self.ranges.covers(start, end)
+
+    def add_part(self, start: int, size: int, crc: Optional[int] = None):
+        """The part's bytes are synced to disk, crc is their CRC-32 if it is known."""
+        with self._lock:
+            self.ranges.add(start, self.part_end(start, size))
+            if crc is not None:
+                self.crcs[start] = crc
+            else:
+                self.crcs.pop(start, None)
+            self._dirty = True
+
+    def verify_part(self, start: int, size: int, path: Path, offset: int) -> Optional[bool]:
+        """Whether the part's bytes in the file at path, from offset, still match its CRC-32.
+
+        Returns:
+            None if the part was not hashed, e.g. it was left by a version without journals
+        """
+        with self._lock:
+            expected = self.crcs.get(start)
+        if expected is None:
+            return None
+        return file_crc(path, offset, self.part_end(start, size) - start + 1) == expected
+
+    def flush(self, force: bool = True):
+        """Save the journal if it changed, unless it was saved less than flush_interval ago and force is False."""
+        with self._lock:
+            if not self._dirty or (not force and time.monotonic() - self._flushed_at < self.flush_interval):
+                return
+            text = json.dumps(
+                {"format": JOURNAL_FORMAT, "size": self.object_size, "part_size": self.part_size,
+                 "ranges": str(self.ranges), "crc32": {str(start): crc for start, crc in self.crcs.items()}}
+            )
+            temporary = self.path.with_name(f"{self.path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+            with open(temporary, "w") as f:
+                f.write(text)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temporary, self.path)
+            self._dirty = False
+            self._flushed_at = time.monotonic()
+
+    def close(self):
+        """Save what is left to save, the journal stays for the next attempt."""
+        self.flush()
+        _OPEN.discard(self)
+
+    def remove(self):
+        """The object is complete, its journal is no longer needed."""
+        with self._lock:
+            _OPEN.discard(self)
+            self._dirty = False
+            self.path.unlink(missing_ok=True)
+
+
+def flush_all():
+    """Save every journal with unsaved ranges."""
+    for journal in list(_OPEN):
+        try:
+            journal.flush()
+        except OSError as e:
+            file_logger.warning(f"Could not save journal {journal.path}: {e}")
+
+
+_installed = False
+
+
+def install_signal_handlers():
+    """Save the journals before the process stops on SIGINT or SIGTERM, then stop as it would have.
+
+    Only the main thread may set signal handlers, elsewhere this does nothing.
+    """
+    global _installed
+    if _installed or threading.current_thread() is not threading.main_thread():
+        return
+    _installed = True
+    for signum in [signal.SIGINT, signal.SIGTERM]:
+        previous = signal.getsignal(signum)
+
+        def _handler(received, frame, previous=previous):
+            flush_all()
+            if callable(previous):
+                previous(received, frame)
+            elif previous != signal.SIG_IGN:
+                signal.signal(received, signal.SIG_DFL)
+                os.kill(os.getpid(), received)
+
+        signal.signal(signum, _handler)
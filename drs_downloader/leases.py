@@ -0,0 +1,149 @@
+"""Share one manifest between several downloader instances through lease files in a shared work directory.
+
+Before an instance works on an object it creates `<work dir>/<key>.lease` with O_EXCL, so only one instance holds
+it. The holder touches its leases every `heartbeat` seconds; a lease not touched for `ttl` seconds belongs to an
+instance that died and may be taken over. Once an object is downloaded a `<key>.done` marker stops anyone claiming
+it again. An object taken over resumes from the parts its previous holder left in the shared destination.
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import socket
+import time
+import uuid
+from pathlib import Path
+from typing import Dict, Optional
+
+file_logger = logging.getLogger("file_logger")
+
+
+class LeaseBoard(object):
+    """Claim, heartbeat and release leases on objects for this instance."""
+
+    def __init__(self, work_dir: Path, ttl: float = 300.0, heartbeat: Optional[float] = None, owner: str = None):
+        """
+        Args:
+            work_dir: directory shared by every instance, e.g. on NFS
+            ttl: seconds without a heartbeat before a lease counts as abandoned
+            heartbeat: seconds between heartbeats, a quarter of the ttl by default
+            owner: identifies this instance in the lease files
+        """
+        self.work_dir = Path(work_dir)
+        self.work_dir.mkdir(parents=True, exist_ok=True)
+        self.ttl = ttl
+        self.heartbeat = heartbeat if heartbeat is not None else ttl / 4
+        self.owner = owner or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.held: Dict[str, Path] = {}
+        """Object id -> lease file, for the leases this instance holds."""
+        self._heartbeat_task: Optional[asyncio.Task] = None
+
+    @staticmethod
+    def key(object_id: str) -> str:
+        return hashlib.sha1(object_id.encode()).hexdigest()
+
+    def _lease_path(self, object_id: str) -> Path:
+        return self.work_dir / f"{self.key(object_id)}.lease"
+
+    def _done_path(self, object_id: str) -> Path:
+        return self.work_dir / f"{self.key(object_id)}.done"
+
+    def is_done(self, object_id: str) -> bool:
+        return self._done_path(object_id).exists()
+
+    def _create(self, path: Path) -> bool:
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+        except FileExistsError:
+            return False
+        with os.fdopen(fd, "w") as f:
+            f.write(self.owner)
+        return True
+
+    def _owner_of(self, path: Path) -> Optional[str]:
+        try:
+            return path.read_text()
+        except OSError:
+            return None
+
+    def try_claim(self, object_id: str) -> bool:
+        """Take the lease on an object unless it is done or held by a live instance."""
+        if object_id in self.held:
+            return True
+        if self.is_done(object_id):
+            return False
+        path = self._lease_path(object_id)
+        if not self._create(path):
+            try:
+                age = time.time() - path.stat().st_mtime
+            except FileNotFoundError:
+                age = None
+            if age is not None and age < self.ttl:
+                return False
+            # abandoned: move it aside first, the rename only succeeds for one of the instances taking over
+            stale = path.with_name(f"{path.name}.{uuid.uuid4().hex}.stale")
+            try:
+                os.rename(path, stale)
+            except FileNotFoundError:
+                pass
+            else:
+                # what was moved is judged by its own age: another instance may have taken the lease over between
+                # our check and the rename, its new lease is then fresh and given back
+                if time.time() - stale.stat().st_mtime < self.ttl:
+                    os.rename(stale, path)
+                    return False
+                previous_owner = self._owner_of(stale)
+                stale.unlink(missing_ok=True)
+                file_logger.info(f"Taking over the abandoned lease on {object_id} from {previous_owner}")
+            if not self._create(path) or self.is_done(object_id):
+                return False
+        self.held[object_id] = path
+        return True
+
+    def release(self, object_id: str, done: bool):
+        """Give up the lease, with done the object is never claimed again."""
+        path = self.held.pop(object_id, None)
+        if done:
+            self._create(self._done_path(object_id))
+        if path is not None and self._owner_of(path) == self.owner:
+            path.unlink(missing_ok=True)
+
+    def beat(self):
+        """Touch every lease held, warn about leases another instance has taken over."""
+        for object_id, path in list(self.held.items()):
+            if self._owner_of(path) != self.owner:
+                file_logger.warning(f"Lost the lease on {object_id}, another instance took it over")
+                self.held.pop(object_id, None)
+                continue
+            try:
+                os.utime(path)
+            except FileNotFoundError:
+                self.held.pop(object_id, None)
+
+    async def claim(self, object_id: str) -> bool:
+        return await asyncio.to_thread(self.try_claim, object_id)
+
+    async def release_async(self, object_id: str, done: bool):
+        await asyncio.to_thread(self.release, object_id, done)
+
+    async def _heartbeat_loop(self):
+        while True:
+            await asyncio.sleep(self.heartbeat)
+            await asyncio.to_thread(self.beat)
+
+    def start(self):
+        """Heartbeat on the running event loop until `stop`."""
+        if self._heartbeat_task is None:
+            self._heartbeat_task = asyncio.create_task(self._heartbeat_loop())
+
+    async def stop(self):
+        """Stop the heartbeat and give back any lease still held, e.g. after an interruption."""
+        if self._heartbeat_task is not None:
+            self._heartbeat_task.cancel()
+            try:
+                await self._heartbeat_task
+            except asyncio.CancelledError:
+                pass
+            self._heartbeat_task = None
+        for object_id in list(self.held):
+            await self.release_async(object_id, done=False)
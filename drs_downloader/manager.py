@@ -1,28 +1,50 @@
 import asyncio
+import functools
 import hashlib
 import logging
-import math
-import shutil
 from abc import ABC, abstractmethod
 from pathlib import Path
-from typing import List, Iterator, Tuple, Collection
+from typing import Any, Awaitable, Callable, Collection, Dict, Iterable, Iterator, List, Optional, Sized, Tuple
 import os
+import sqlite3
 import tqdm
 import tqdm.asyncio
 import sys
 import time
 
 from drs_downloader import (
+    DEFAULT_EVENT_LOOP,
+    DEFAULT_MAX_ADAPTIVE_DOWNLOADERS,
+    DEFAULT_MAX_OBJECT_RETRIES,
     DEFAULT_MAX_SIMULTANEOUS_OBJECT_RETRIEVERS,
     DEFAULT_MAX_SIMULTANEOUS_PART_HANDLERS,
     DEFAULT_MAX_SIMULTANEOUS_DOWNLOADERS,
     DEFAULT_MAX_SIMULTANEOUS_OBJECT_SIGNERS,
+    DEFAULT_ORDERING,
     DEFAULT_PART_SIZE,
+    DEFAULT_REORDER_WINDOW,
+    DEFAULT_RESIGN_MARGIN,
+    DEFAULT_WRITER,
     MB,
     GB,
 )
 
-from drs_downloader.models import DrsClient, DrsObject
+from drs_downloader import event_loop
+from drs_downloader import ordering
+from drs_downloader.bandwidth import BandwidthLimiter
+from drs_downloader.cache import ContentCache
+from drs_downloader.catalog import Catalog, CatalogEntry
+from drs_downloader.dedup import HARDLINKS, Deduplicator, place
+from drs_downloader.destination import COMPLETE, RESUMABLE, DestinationIndex
+from drs_downloader.disk import DiskSpace, NotEnoughDiskSpace
+from drs_downloader.hashing import HashFrontier, hash_file
+from drs_downloader.journal import Journal
+from drs_downloader.leases import LeaseBoard
+from drs_downloader.models import DrsClient, DrsObject, ObjectState
+from drs_downloader.parts import PartSizer
+from drs_downloader.scheduler import AIMDController, PartScheduler
+from drs_downloader.signed_urls import expires_within
+from drs_downloader.writers import copy_into, make_writer, publish
 
 logger = logging.getLogger()
 file_logger = logging.getLogger("file_logger")
@@ -45,6 +67,9 @@ file_logger.setLevel(logging.DEBUG)
 file_logger.addHandler(file_handler)
 file_logger.propagate = False
 
+# marks the end of the work on a pipeline queue
+_DONE = object()
+
 
 class DrsManager(ABC):
     """Manage DRSClient workload."""
@@ -76,6 +101,29 @@ class DrsManager(ABC):
             list of updated DrsObjects
         """
 
+    @abstractmethod
+    async def get_objects_async(self, object_ids: List[str]) -> List[DrsObject]:
+        """Fetch list of DRSObject from passed ids on the running event loop.
+
+        Args:
+            object_ids: list of objects to fetch
+        """
+        pass
+
+    @abstractmethod
+    async def download_async(
+        self, drs_objects: List[DrsObject], destination_path: Path
+    ) -> List[DrsObject]:
+        """Split the drs_objects into manageable parts, download the files on the running event loop.
+
+        Args:
+            drs_objects: objects to download
+            destination_path: directory where to write files when complete
+
+        Returns:
+            list of updated DrsObjects
+        """
+
     @abstractmethod
     async def optimize_workload(self, drs_objects: List[DrsObject]) -> List[DrsObject]:
         """
@@ -91,26 +139,6 @@ class DrsManager(ABC):
         return drs_objects
 
 
-class Wrapped(object):
-    def __init__(self, file, hash_method):
-        """
-        Wrap the read() method and calculate hash
-        Args:
-            file: destination file
-            hash_method: instantiated hash_method
-        """
-        self._file = file
-        self._hash_method = hash_method
-
-    def read(self, size):
-        buffer = self._file.read(size)
-        self._hash_method.update(buffer)
-        return buffer
-
-    def __getattr__(self, attr):
-        return getattr(self._file, attr)
-
-
 class DrsAsyncManager(DrsManager):
     """Manage DRSClient workload with asyncio threads, display progress."""
 
@@ -123,16 +151,57 @@ class DrsAsyncManager(DrsManager):
         max_simultaneous_downloaders=DEFAULT_MAX_SIMULTANEOUS_DOWNLOADERS,
         max_simultaneous_part_handlers=DEFAULT_MAX_SIMULTANEOUS_PART_HANDLERS,
         max_simultaneous_object_signers=DEFAULT_MAX_SIMULTANEOUS_OBJECT_SIGNERS,
+        event_loop_name: str = DEFAULT_EVENT_LOOP,
+        adaptive_concurrency: bool = True,
+        max_adaptive_downloaders: int = DEFAULT_MAX_ADAPTIVE_DOWNLOADERS,
+        order: str = DEFAULT_ORDERING,
+        priorities: Optional[Dict[str, float]] = None,
+        reorder_window: int = DEFAULT_REORDER_WINDOW,
+        max_bandwidth: Optional[int] = None,
+        disk_space: Optional[DiskSpace] = None,
+        leases: Optional[LeaseBoard] = None,
+        resign_margin: float = DEFAULT_RESIGN_MARGIN,
+        max_object_retries: int = DEFAULT_MAX_OBJECT_RETRIES,
+        writer: str = DEFAULT_WRITER,
+        catalog: Optional[Catalog] = None,
+        deduplicate: bool = True,
+        hardlinks: bool = False,
+        cache: Optional[ContentCache] = None,
+        staging_path: Optional[Path] = None,
+        repair: bool = False,
     ):
         """
 
         Args:
             drs_client: the client that will interact with server
             show_progress: show progress bars
-            part_size: tweak to optimize workload
+            part_size: part size aimed for until the per-connection throughput is known, see `PartSizer`
             max_simultaneous_object_retrievers: tweak to optimize workload
-            max_simultaneous_downloaders: tweak to optimize workload
-            max_simultaneous_part_handlers: tweak to optimize workload
+            max_simultaneous_downloaders: connection budget, parts in flight across every object
+            max_simultaneous_part_handlers: an object's share of the budget while other objects are waiting
+            event_loop_name: loop implementation used by the synchronous entry points, see `event_loop`
+            adaptive_concurrency: tune the budget from observed throughput, starting at max_simultaneous_downloaders
+            max_adaptive_downloaders: the most parts in flight the tuned budget may grow to
+            order: which resolved object is signed and downloaded next, see `ordering`
+            priorities: priority of each DRS URI, for the priority order
+            reorder_window: the most resolved objects waiting to be ordered before signing
+            max_bandwidth: bytes per second across every download, shared fairly between objects; None for no cap
+            disk_space: admission control for the destination's free space, see `DiskSpace`
+            leases: share the manifest with other instances, each object is only worked on by the lease holder
+            resign_margin: sign an object again when its url expires in less than this many seconds
+            max_object_retries: times an object with a recoverable failure is signed again and its missing parts
+                retried
+            writer: how parts are written, as part files stitched at the end or in place, see `writers`
+            catalog: completed downloads, an object still complete in the destination is neither resolved nor
+                downloaded again
+            deduplicate: download the bytes of objects with the same checksum and size once, see `dedup`
+            hardlinks: objects with the same bytes share one file under several names rather than each having a
+                reflink or copy
+            cache: objects shared by every process on the node, looked up before signing, see `cache`
+            staging_path: fast local directory for the parts and the stitched file, only verified files are moved
+                to the destination
+            repair: check the files of the right size already in the destination against their checksum, those
+                that do not match have only their damaged parts downloaded again, see `_repair_file`
         """
         # """Implements abstract constructor."""
         super().__init__(drs_client=drs_client)
@@ -142,6 +211,34 @@ class DrsAsyncManager(DrsManager):
         self.max_simultaneous_part_handlers = max_simultaneous_part_handlers
         self.disable = not show_progress
         self.part_size = part_size
+        self.part_sizer = PartSizer()
+        self.event_loop_name = event_loop_name
+        self.order = order
+        self.ordering_policy = ordering.make_policy(order, priorities)
+        self.reorder_window = reorder_window
+        self.disk_space = disk_space if disk_space is not None else DiskSpace()
+        self.leases = leases
+        self.resign_margin = resign_margin
+        self.max_object_retries = max_object_retries
+        self.catalog = catalog
+        self.deduplicator = Deduplicator(hardlinks) if deduplicate else None
+        self.cache = cache
+        self.staging_path = Path(staging_path) if staging_path is not None else None
+        self.repair = repair
+        # the files already in the destination, and in staging if there is one, scanned once per run
+        self.destination_index: Optional[DestinationIndex] = None
+        self.staging_index: Optional[DestinationIndex] = None
+        # every download_part of the client writes its bytes through it
+        self._drs_client.part_writer = make_writer(writer)
+        self._drs_client.hash_frontiers = {}
+        if max_bandwidth is not None:
+            # every download_part stream of the client draws from the same bucket
+            self._drs_client.bandwidth_limiter = BandwidthLimiter(max_bandwidth)
+        # one budget of connections shared by the parts of every object being downloaded
+        self._part_scheduler = PartScheduler(max_simultaneous_downloaders, max_simultaneous_part_handlers)
+        self.concurrency_controller = (
+            AIMDController(self._part_scheduler, maximum=max_adaptive_downloaders) if adaptive_concurrency else None
+        )
 
     @staticmethod
     def _parts_generator(
@@ -163,45 +260,34 @@ class DrsAsyncManager(DrsManager):
             # start += part_size
         yield start, size
 
-    async def wait_till_completed(self, tasks, err_function_msg):
-        completed_tasks = []
-        while tasks:
-            done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
-            for t in done:
-                try:
-                    y = await t
-                    completed_tasks.append(y)
-
-                except Exception as e:
-                    updated_drs_object = DrsObject(
-                        self_uri="",
-                        id="",
-                        checksums=[],
-                        size=0,
-                        name=None,
-                        errors=[f"Exception in {err_function_msg} function {str(e)}"]
-                    )
-
-                    completed_tasks.append(updated_drs_object)
-                    t.cancel()
-
-        return completed_tasks
-
     async def _run_download_parts(
-        self, drs_object: DrsObject, destination_path: Path, verbose: bool
+        self, drs_object: DrsObject, destination_path: Path, verbose: bool,
+        before_part: Optional[Callable[[], Awaitable[None]]] = None,
     ) -> DrsObject:
-        """Determine number of parts for signed url and create tasks for each part, run them in batches.
+        """Determine number of parts for signed url and hand them to the part scheduler, then stitch them.
 
         Args:
             drs_object: Information about a bucket object
+            before_part: awaited as each part starts, e.g. to sign the object again before its url expires
 
         Returns:
             list of paths to files for each part, in order.
         """
+        writer = self._drs_client.part_writer
+        # parts, journals and the stitched file stay in staging until the object is verified
+        work_path = self._work_path(destination_path)
+        # parts left by an interrupted download are only reused if the layout stays the same
+        part_size = writer.existing_part_size(
+            drs_object.name, drs_object.size, work_path, parts=self._index(work_path).parts(drs_object.name)
+        )
+        if part_size is None:
+            part_size = self.part_sizer.part_size(drs_object.size, default=self.part_size)
+        file_logger.info(f"{drs_object.name} part size {part_size}")
+
         # create a list of parts
         parts = []
         for start, size in self._parts_generator(
-            size=drs_object.size, part_size=self.part_size
+            size=drs_object.size, part_size=part_size
         ):
             parts.append(
                 (
@@ -217,94 +303,131 @@ class DrsAsyncManager(DrsManager):
                 logger.warning(f'Warning: tasks > 1000 {drs_object.name} has over 1000 parts and is a large download. \
                 ({len(parts)})')
 
-        if drs_object.size > 20 * MB:
-            self.disable = False
-        else:
-            self.disable = True
+        # several objects download at once, so progress display is decided per object
+        disable = drs_object.size <= 20 * MB
 
-        paths = []
-        # TODO - tqdm ugly here?
         progress_bar = tqdm.tqdm(
-            DrsAsyncManager.chunker(parts, self.max_simultaneous_part_handlers),
-            total=math.ceil(len(parts) / self.max_simultaneous_part_handlers),
+            total=len(parts),
             desc="File Download Progress",
             file=sys.stdout,
             leave=False,
-            disable=self.disable,
+            disable=disable,
         )
-        for chunk_parts in progress_bar:
-            file_logger.info(str(progress_bar))
-
-            chunk_tasks = []
-            existing_chunks = []
-            for start, size in chunk_parts:
-                # Check if part file exists and if so verify the expected size.
-                # If size matches the expected value then return the Path of the file_name for eventual reassembly.
-                # If size does not match then attempt to restart the download.
-                file_name = destination_path / f"{drs_object.name}.{start}.{size}.part"
-                file_path = Path(file_name)
-
-                if self.check_existing_parts(file_path, start, size, verbose):
-                    existing_chunks.append(file_path)
-                    continue
+        existing_chunks = []
 
-                task = asyncio.create_task(
-                    self._drs_client.download_part(
-                        drs_object=drs_object,
-                        start=start,
-                        size=size,
-                        destination_path=destination_path,
-                        verbose=verbose
-                    )
+        # the checksum follows the parts as they arrive, rather than reading the whole file again at the end
+        checksum_type = drs_object.checksums[0].type
+        frontier = None
+        if checksum_type in hashlib.algorithms_available:
+            frontier = HashFrontier(hashlib.new(checksum_type), parts, drs_object.size, writer.in_place)
+        # the parts already on disk are in the object's journal
+        journal = await asyncio.to_thread(
+            writer.prepare, drs_object.name, drs_object.size, work_path, part_size
+        )
+        if writer.in_place:
+            # the whole object was allocated up front
+            self.disk_space.consumed(drs_object.id, work_path, drs_object.size)
+
+        async def _download_part(start: int, size: int) -> Optional[Path]:
+            part_start_time = time.monotonic()
+            path = None
+            try:
+                if before_part is not None:
+                    await before_part()
+                path = await self._drs_client.download_part(
+                    drs_object=drs_object,
+                    start=start,
+                    size=size,
+                    destination_path=work_path,
+                    verbose=verbose
                 )
-                chunk_tasks.append(task)
-
-            chunk_paths = await self.wait_till_completed(chunk_tasks, "download_parts")
-
-            if len(existing_chunks) > 0:
-                file_logger.info(f"{drs_object.name} had {len(existing_chunks)} existing parts.")
-
-            chunk_paths.extend(existing_chunks)
-            # something bad happened
-            if None in chunk_paths:
-                if any(
-                    [
-                        "RECOVERABLE in AIOHTTP" in str(error)
-                        for error in drs_object.errors
-                    ]
-                ):
-                    return drs_object
-                else:
-                    file_logger.error(f"{drs_object.name} had missing part.")
-                    if verbose:
-                        logger.error(f"{drs_object.name} had missing part.")
-                    return drs_object
-
-            paths.extend(chunk_paths)
-
-        """
-       logger.info(" LIST OF DRS OBJECT ERRORS AFTER DLOAD IN RUN DOWNLOAD PARTS",drs_object.errors)
-       logger.info("RECOVERABLE? ",any(['RECOVERABLE' in str(error) for error in drs_object.errors]))
-
-        if(any(['RECOVERABLE' in str(error) for error in drs_object.errors])):
-                return drs_object
-        """
+                if isinstance(path, Path):
+                    self.part_sizer.record(size - start + 1, time.monotonic() - part_start_time)
+                    if not writer.in_place:
+                        self.disk_space.consumed(drs_object.id, work_path, size - start + 1)
+                return path
+            except Exception as e:
+                drs_object.fail("download_part", f"Exception in download_parts function {str(e)}")
+                return None
+            finally:
+                if self.concurrency_controller is not None:
+                    self.concurrency_controller.record(
+                        size - start + 1, time.monotonic() - part_start_time, isinstance(path, Path)
+                    )
+                progress_bar.update(1)
+                file_logger.info(str(progress_bar))
 
-        if (
-            None not in chunk_paths and len(existing_chunks) == 0 and self.disable is True
-        ):
+        paths = [None] * len(parts)
+        jobs = {}
+        for index, (start, size) in enumerate(parts):
+            if writer.in_place:
+                file_path = writer.download_path(drs_object.name, work_path)
+            else:
+                file_path = writer.part_path(drs_object.name, start, size, work_path)
+            if journal.has_part(start, size):
+                # a part whose bytes changed since they were written is downloaded again
+                offset = start if writer.in_place else 0
+                reusable = await asyncio.to_thread(journal.verify_part, start, size, file_path, offset) is not False
+                if not reusable:
+                    file_logger.info(f"{drs_object.name} part {start}-{size} does not match its CRC-32")
+                    if verbose:
+                        logger.info(f"{drs_object.name} part {start}-{size} does not match its CRC-32")
+            else:
+                # parts left by a version without journals are checked by their name and size
+                legacy = not journal.resumed and not writer.in_place
+                reusable = legacy and self.check_existing_parts(file_path, start, size, verbose)
+                if reusable:
+                    journal.add_part(start, size)
+            if reusable:
+                existing_chunks.append(file_path)
+                paths[index] = file_path
+                if frontier is not None:
+                    frontier.existing(index, file_path)
+                progress_bar.update(1)
+                continue
+            jobs[index] = functools.partial(_download_part, start, size)
+
+        # parts from every active object share one budget of connections
+        if frontier is not None:
+            self._drs_client.hash_frontiers[drs_object.id] = frontier
+        try:
+            results = await self._part_scheduler.run(drs_object.id, list(jobs.values()))
+        finally:
+            self._drs_client.hash_frontiers.pop(drs_object.id, None)
+        for index, path in zip(jobs, results):
+            paths[index] = path
+        progress_bar.close()
+
+        if len(existing_chunks) > 0:
+            file_logger.info(f"{drs_object.name} had {len(existing_chunks)} existing parts.")
+
+        # something bad happened
+        if None in paths or any(not isinstance(path, Path) for path in paths):
+            if not drs_object.recoverable:
+                file_logger.error(f"{drs_object.name} had missing part.")
+                if verbose:
+                    logger.error(f"{drs_object.name} had missing part.")
+                if len(drs_object.errors) == 0:
+                    drs_object.fail("download_part", f"{drs_object.name} had missing part.")
+            return drs_object
+
+        if len(existing_chunks) == 0 and disable is True:
             file_logger.info("%s Downloaded sucessfully", drs_object.name)
             if verbose:
                 logger.info("%s Downloaded sucessfully", drs_object.name)
 
-        drs_object.file_parts = paths
+        drs_object.file_parts = list(paths)
 
         i = 1
         filename = (
             f"{drs_object.name}" or drs_object.access_methods[0].access_url.split("/")[-1].split("?")[0]
         )
         original_file_name = Path(filename)
+        index = self.destination_index
         while True:
+            if i == 1 and index is not None and index.is_resumable(drs_object.id):
+                # a file of the wrong size left under this name, e.g. by an interrupted stitch, is replaced
+                break
             if os.path.isfile(destination_path.joinpath(filename)):
                 filename = f"{original_file_name}({i})"
                 i = i + 1
@@ -313,193 +436,941 @@ class DrsAsyncManager(DrsManager):
 
         # re-assemble and test the file parts
         # hash function dynamic
-        checksum_type = drs_object.checksums[0].type
         assert (
             checksum_type in hashlib.algorithms_available
         ), f"Checksum {checksum_type} not supported."
-        checksum = hashlib.new(checksum_type)
-        with open(destination_path.joinpath(filename), "wb") as wfd:
-            # sort the items of the list in place - Numerically based on start i.e. "xxxxxx.start.end.part"
-            drs_object.file_parts.sort(key=lambda x: int(str(x).split(".")[-3]))
-
-            T_0 = time.time()
-            progress_bar = tqdm.tqdm(
-                drs_object.file_parts,
-                total=len(drs_object.file_parts),
-                desc=f"       {drs_object.name:50.50} stitching",
-                file=sys.stdout,
-                leave=False,
-                disable=self.disable,
-            )
-            for f in progress_bar:
-                file_logger.info(str(progress_bar))
-                fd = open(f, "rb")  # NOT ASYNC
-                wrapped_fd = Wrapped(fd, checksum)
-                # efficient way to write
-                await asyncio.to_thread(
-                    shutil.copyfileobj, wrapped_fd, wfd, 1024 * 1024 * 10
+        T_0 = time.time()
+        checksum = await frontier.finish(paths)
+        T_FIN = time.time()
+        file_logger.info(f"TOTAL 'HASHING' TIME after the last part {T_FIN-T_0} {original_file_name}")
+        if verbose:
+            logger.info(f"TOTAL 'HASHING' TIME after the last part {T_FIN-T_0} {original_file_name}")
+        # in place the file gets its final name
+        writer.finish(drs_object.name, work_path, filename)
+        if not writer.in_place:
+            # file_parts are in the order of the parts
+            with open(work_path.joinpath(filename), "wb") as wfd:
+                T_0 = time.time()
+                progress_bar = tqdm.tqdm(
+                    drs_object.file_parts,
+                    total=len(drs_object.file_parts),
+                    desc=f"       {drs_object.name:50.50} stitching",
+                    file=sys.stdout,
+                    leave=False,
+                    disable=disable,
                 )
-                # explicitly close all
-                wrapped_fd.close()
-                f.unlink()
-                fd.close()
-                wfd.flush()
-
-            T_FIN = time.time()
-            file_logger.info(f"TOTAL 'STITCHING' (md5 10*MB no flush) TIME {T_FIN-T_0} {original_file_name}")
-            if verbose:
-                logger.info(f"TOTAL 'STITCHING' (md5 10*MB no flush) TIME {T_FIN-T_0} {original_file_name}")
+                offset = 0
+                methods = set()
+                for f in progress_bar:
+                    file_logger.info(str(progress_bar))
+                    # in the kernel where possible, the bytes do not go through Python
+                    copied, method = await asyncio.to_thread(copy_into, f, wfd.fileno(), offset)
+                    offset += copied
+                    methods.add(method)
+                    f.unlink()
+
+                T_FIN = time.time()
+                message = f"TOTAL 'STITCHING' ({', '.join(sorted(methods))}) TIME {T_FIN-T_0} {original_file_name}"
+                file_logger.info(message)
+                if verbose:
+                    logger.info(message)
         actual_checksum = checksum.hexdigest()
 
-        actual_size = os.stat(Path(destination_path.joinpath(filename))).st_size
-
         # compare calculated md5 vs expected
         expected_checksum = drs_object.checksums[0].checksum
+        if expected_checksum != actual_checksum:
+            repaired = await self._repair(
+                drs_object, work_path, filename, parts, journal, _download_part, verbose
+            )
+            if repaired is not None:
+                actual_checksum = repaired.hexdigest()
+
+        actual_size = os.stat(Path(work_path.joinpath(filename))).st_size
+
         if expected_checksum != actual_checksum:
             msg = f"Actual {checksum_type} hash {actual_checksum} does not match expected {expected_checksum}"
             file_logger.error(msg)
             if verbose:
                 logger.error(msg)
-            drs_object.errors.append(msg)
+            drs_object.fail("stitch", msg)
 
         if drs_object.size != actual_size:
             msg = f"The actual size {actual_size} does not match expected size {drs_object.size}"
-            drs_object.errors.append(msg)
+            drs_object.fail("stitch", msg)
+
+        if len(drs_object.errors) == 0 and work_path != destination_path:
+            try:
+                method = await asyncio.to_thread(publish, work_path / filename, destination_path / filename)
+                file_logger.info(f"{drs_object.name} moved from {work_path} to {destination_path} ({method})")
+            except OSError as e:
+                drs_object.fail("stitch", f"Could not move {filename} from {work_path} to {destination_path}: {e}")
 
-        # parts will be purposefully saved if there is an error so that
-        # recovery script can have a chance to rebuild the file
+        if len(drs_object.errors) == 0:
+            drs_object.path = destination_path / filename
+
+        if expected_checksum != actual_checksum:
+            # the journal is kept, with repair a later run downloads again only the parts that do not match it
+            writer.close(drs_object.name, work_path)
+        else:
+            writer.done(drs_object.name, work_path)
 
         return drs_object
 
-    async def _run_download(
-        self, drs_objects: List[DrsObject], destination_path: Path, user_project: str, verbose: bool
-    ) -> List[DrsObject]:
+    async def _repair(
+        self, drs_object: DrsObject, destination_path: Path, filename: str, parts: List[Tuple[int, int]],
+        journal: Journal, download_part: Callable[[int, int], Awaitable[Optional[Path]]], verbose: bool,
+    ):
+        """Download again the parts of an object that failed its checksum whose bytes no longer match their CRC-32,
+        or were never hashed, and write them into its file.
+
+        Returns:
+            the checksum of the repaired file, None if no part is to blame or a part could not be downloaded
         """
-        Create tasks to sign and download, display progress.
+        writer = self._drs_client.part_writer
+        final_path = destination_path / filename
+        damaged = []
+        for start, size in parts:
+            if await asyncio.to_thread(journal.verify_part, start, size, final_path, start) is not True:
+                damaged.append((start, size))
+        if len(damaged) == 0:
+            return None
+
+        message = f"{drs_object.name} failed its checksum, downloading {len(damaged)} of {len(parts)} parts again"
+        file_logger.warning(message)
+        if verbose:
+            logger.warning(message)
+        if writer.in_place:
+            # back to a file being downloaded, the parts are written at their offset again
+            journal.flush()
+            os.replace(final_path, writer.download_path(drs_object.name, destination_path))
+            await asyncio.to_thread(
+                writer.prepare, drs_object.name, drs_object.size, destination_path, journal.part_size
+            )
+        try:
+            paths = await self._part_scheduler.run(
+                drs_object.id, [functools.partial(download_part, start, size) for start, size in damaged]
+            )
+        finally:
+            writer.finish(drs_object.name, destination_path, filename)
+        if any(not isinstance(path, Path) for path in paths):
+            return None
+        if not writer.in_place:
+            with open(final_path, "r+b") as f:
+                for (start, _), path in zip(damaged, paths):
+                    await asyncio.to_thread(copy_into, path, f.fileno(), start)
+                    path.unlink()
+
+        checksum = hashlib.new(drs_object.checksums[0].type)
+        await asyncio.to_thread(hash_file, checksum, final_path)
+        return checksum
+
+    async def _repair_file(
+        self, drs_object: DrsObject, destination_path: Path, verbose: bool,
+        before_part: Optional[Callable[[], Awaitable[None]]] = None,
+    ):
+        """Repair a file already in the destination that does not match its checksum, see `_repair`.
+
+        The parts to download again are those that no longer match their CRC-32 in the journal its download left;
+        every part when it has no journal or every part matches. The journal is kept if the file still does not
+        match.
+        """
+        writer = self._drs_client.part_writer
+        journal_path = writer.journal_path(drs_object.name, destination_path)
+        journal = await asyncio.to_thread(Journal.load, journal_path, drs_object.size)
+        part_size = (
+            journal.part_size if journal is not None
+            else self.part_sizer.part_size(drs_object.size, default=self.part_size)
+        )
+        if not writer.in_place:
+            journal = await asyncio.to_thread(
+                writer.prepare, drs_object.name, drs_object.size, destination_path, part_size
+            )
+        elif journal is None:
+            # in place the file is prepared once it is back to being downloaded, in `_repair`
+            journal = Journal(journal_path, drs_object.size, part_size)
+        parts = list(self._parts_generator(size=drs_object.size, part_size=part_size))
+
+        async def _download_part(start: int, size: int) -> Optional[Path]:
+            try:
+                if before_part is not None:
+                    await before_part()
+                return await self._drs_client.download_part(
+                    drs_object=drs_object, start=start, size=size, destination_path=destination_path,
+                    verbose=verbose,
+                )
+            except Exception as e:
+                drs_object.fail("download_part", f"Exception in download_parts function {str(e)}")
+                return None
+
+        checksum = await self._repair(
+            drs_object, destination_path, drs_object.name, parts, journal, _download_part, verbose
+        )
+        if checksum is None and len(drs_object.errors) == 0:
+            # every part matches its CRC-32, its bytes were wrong as they arrived: no part is to blame over another
+            checksum = await self._repair(
+                drs_object, destination_path, drs_object.name, parts,
+                Journal(journal_path, drs_object.size, part_size), _download_part, verbose,
+            )
+        expected_checksum = drs_object.checksums[0].checksum
+        if checksum is None or checksum.hexdigest() != expected_checksum:
+            actual = checksum.hexdigest() if checksum is not None else "unchanged"
+            msg = f"Repaired {drs_object.checksums[0].type} hash {actual} does not match expected {expected_checksum}"
+            file_logger.error(msg)
+            if verbose:
+                logger.error(msg)
+            if len(drs_object.errors) == 0:
+                drs_object.fail("stitch", msg)
+            writer.close(drs_object.name, destination_path)
+            return
+        drs_object.path = destination_path / drs_object.name
+        writer.done(drs_object.name, destination_path)
+
+    async def _matches_checksum(self, drs_object: DrsObject, path: Path) -> Optional[bool]:
+        """Whether the file at path has the object's checksum, None if it cannot be computed here."""
+        if not drs_object.checksums or drs_object.checksums[0].type not in hashlib.algorithms_available:
+            return None
+        checksum = hashlib.new(drs_object.checksums[0].type)
+        await asyncio.to_thread(hash_file, checksum, path)
+        return checksum.hexdigest() == drs_object.checksums[0].checksum
+
+    @classmethod
+    def chunker(cls, seq: Collection, size: int) -> Iterator:
+        """Iterate over a list in chunks.
+
         Args:
-            drs_objects: list of drs objects to download
+            seq: an iterable
+            size: desired chunk size
 
         Returns:
-            updated list of drs objects
+            an iterator that returns lists of size or less
         """
+        return (seq[pos: pos + size] for pos in range(0, len(seq), size))
 
-        # first sign the urls
-        tasks = []
-        file_logger.info(f" drs_objects before entering sign_url function {drs_objects}")
-        if verbose:
-            logger.info(f" drs_objects before entering sign_url function {drs_objects}")
-        for drs_object in drs_objects:
-            if len(drs_object.errors) == 0:
-                task = asyncio.create_task(self._drs_client.sign_url(drs_object=drs_object,
-                                           user_project=user_project, verbose=verbose))
-                tasks.append(task)
+    @staticmethod
+    async def _run_stage(
+        handler: Callable[[Any], Awaitable[Any]], inbox: asyncio.Queue, outbox: Optional[asyncio.Queue],
+        concurrency: int
+    ):
+        """Run `concurrency` workers that take items from inbox, handle them and pass non None results on.
 
-        drs_objects_with_signed_urls = await self.wait_till_completed(tasks, "sign_url")
+        Each stage finishes once it has seen the upstream `_DONE` marker and drained its work, then tells the
+        next stage it is done.
 
-        tasks = []
-        for drs_object in drs_objects_with_signed_urls:
-            if len(drs_object.errors) == 0:
-                task = asyncio.create_task(
-                    self._run_download_parts(
-                        drs_object=drs_object, destination_path=destination_path, verbose=verbose
-                    )
-                )
-                tasks.append(task)
+        Args:
+            handler: coroutine applied to each item, returns the item for the next stage or None to drop it
+            inbox: bounded queue filled by the previous stage
+            outbox: bounded queue read by the next stage, None for the last stage
+            concurrency: number of workers for this stage
+        """
 
-            else:
-                file_logger.error(
-                    f"{drs_object.id} has error {drs_object.errors}, not attempting anything further"
-                )
-                logger.error(
-                    f"{drs_object.id} has error {drs_object.errors}, not attempting anything further"
-                )
+        async def _worker():
+            while True:
+                item = await inbox.get()
+                if item is _DONE:
+                    # let the sibling workers see the marker too
+                    await inbox.put(_DONE)
+                    return
+                result = await handler(item)
+                if result is not None and outbox is not None:
+                    await outbox.put(result)
 
-        drs_objects_with_file_parts = await self.wait_till_completed(tasks, "run_download_parts")
-        return drs_objects_with_file_parts
+        await asyncio.gather(*[_worker() for _ in range(max(1, concurrency))])
+        if outbox is not None:
+            await outbox.put(_DONE)
 
-    async def _run_get_objects(
-        self, object_ids: List[str], leave: bool, verbose: bool
+    @staticmethod
+    async def _feed(items: Iterable, outbox: asyncio.Queue):
+        """Put every item onto the first stage's queue, waiting whenever that stage is busy."""
+        for item in items:
+            await outbox.put(item)
+        await outbox.put(_DONE)
+
+    async def _pipeline(
+        self,
+        destination_path: Optional[Path],
+        user_project: Optional[str],
+        duplicate: bool,
+        verbose: bool,
+        object_ids: Optional[Iterable[str]] = None,
+        drs_objects: Optional[Iterable[DrsObject]] = None,
+        resolve_only: bool = False,
+        on_resolved: Optional[Callable[[List[DrsObject]], None]] = None,
+        on_finished: Optional[Callable[[DrsObject], None]] = None,
+        keep_results: bool = True,
     ) -> List[DrsObject]:
-        """Create async tasks to retrieve list DrsObject, displays progress.
+        """Stream objects through the get_object -> sign_url -> download_part stages.
+
+        Stages are connected by bounded queues and each has its own concurrency, so the first bytes flow as soon
+        as the first object resolves and a slow object only ever holds its own slot.
 
         Args:
-            object_ids: object_id from manifest
-            leave: leave flag to keep progress indicator displayed
+            destination_path: directory where to write files when complete
+            user_project: Google project billed for requester pays downloads
+            duplicate: download again even if a file of the same name exists
+            object_ids: ids to resolve, either these or drs_objects are given
+            drs_objects: already resolved objects, these skip the get_object stage
+            resolve_only: stop after the get_object stage
+            on_resolved: called with every resolved object once the get_object stage has finished
+            on_finished: called with each object once it is downloaded, skipped or has failed
+            keep_results: False to let go of every object once on_finished has seen it, memory then only grows
+                with the failures. Objects are not ordered across the whole manifest, only within the reorder
+                window, and on_resolved is not called.
 
         Returns:
+            every object, in the order given; without keep_results only the objects that failed
+        """
+        resolve_queue = asyncio.Queue(maxsize=self.max_simultaneous_object_retrievers)
+        # scanned when the first object is admitted
+        self.destination_index = None
+        self.staging_index = None
+        # objects with the same bytes are downloaded once, the stages that resolve objects see every one
+        dedup = self.deduplicator if self.deduplicator is not None and not resolve_only else None
+        # resolved objects wait here, the ordering policy decides which one is signed and downloaded next
+        sign_queue = ordering.OrderedQueue(self.ordering_policy, maxsize=self.reorder_window)
+        # objects waiting on the part scheduler are what lets a tuned budget grow past its starting point
+        download_concurrency = max(
+            self.max_simultaneous_downloaders,
+            self.concurrency_controller.maximum if self.concurrency_controller is not None else 0,
+        )
+        download_queue = asyncio.Queue(maxsize=self.max_simultaneous_downloaders)
+
+        items = object_ids if object_ids is not None else drs_objects
+        total = len(items) if isinstance(items, Sized) else None
+        results = {}
+        failures = []
+        counts = {"skipped": 0, "admitted": 0, "elsewhere": 0, "tried": 0}
+        leases = self.leases if not resolve_only else None
+        # objects whose lease another instance held, claimed again once the rest of the manifest has been tried
+        elsewhere: List[Tuple[Any, str]] = []
+        all_tried = asyncio.Event()
+        # with repair, files already in the destination waiting to be checked against their checksum
+        to_check = set()
+
+        resolve_progress = tqdm.tqdm(
+            total=total,
+            desc="Get Objects Progress",
+            file=sys.stdout,
+            leave=False,
+            disable=self.disable or object_ids is None,
+        )
+        download_progress = tqdm.tqdm(
+            total=total,
+            desc="TOTAL_DOWNLOAD_PROGRESS",
+            file=sys.stdout,
+            leave=False,
+            disable=self.disable or resolve_only or total == 1,
+        )
 
+        def _finished(drs_object: DrsObject):
+            if drs_object.state != ObjectState.SKIPPED:
+                drs_object.state = ObjectState.DONE if len(drs_object.errors) == 0 else ObjectState.FAILED
+            download_progress.update(1)
+            if leases is not None:
+                # leases are keyed on the URI in the manifest
+                leases.release(drs_object.self_uri, done=len(drs_object.errors) == 0)
+            if not keep_results:
+                # each object is seen once, its entries in the listings are of no more use
+                for index in (self.destination_index, self.staging_index):
+                    if index is not None:
+                        index.forget(drs_object)
+            elif drs_object.state == ObjectState.DONE and self.destination_index is not None:
+                self.destination_index.add(drs_object)
+            if drs_object.state == ObjectState.DONE and drs_object.path is not None:
+                self._catalog(drs_object)
+            if on_finished is not None:
+                on_finished(drs_object)
+            if not keep_results:
+                # keep nothing of a finished object but what the final report needs about a failure
+                drs_object.access_methods = []
+                drs_object.file_parts = []
+                if self._drs_client.bandwidth_limiter is not None:
+                    self._drs_client.bandwidth_limiter.forget(drs_object.id)
+                if len(drs_object.errors) > 0:
+                    failures.append(drs_object)
+
+        def _admit(drs_object: DrsObject) -> Optional[DrsObject]:
+            """Decide whether a resolved object goes on to be signed."""
+            if resolve_only:
+                return None
+            if len(drs_object.errors) > 0:
+                file_logger.error(f"{drs_object.id} has error {drs_object.errors}, not attempting anything further")
+                logger.error(f"{drs_object.id} has error {drs_object.errors}, not attempting anything further")
+                _finished(drs_object)
+                return None
+            status = self._destination_status(drs_object, destination_path, duplicate)
+            if status == COMPLETE and self.repair:
+                # checked before it is signed, see `_intact`
+                to_check.add(drs_object.id)
+                counts["admitted"] += 1
+                return drs_object
+            if status == COMPLETE:
+                file_logger.info(f"{drs_object.name} already exists in {destination_path}. Skipping download.")
+                if verbose:
+                    logger.info(f"{drs_object.name} already exists in {destination_path}. Skipping download.")
+                drs_object.state = ObjectState.SKIPPED
+                drs_object.path = destination_path / drs_object.name
+                # matched on name and size only, so not cataloged: the catalog only holds files verified by checksum
+                counts["skipped"] += 1
+                _finished(drs_object)
+                return None
+            if status == RESUMABLE:
+                message = f"{drs_object.name} in {destination_path} is the wrong size, downloading it again"
+                file_logger.info(message)
+                if verbose:
+                    logger.info(message)
+            counts["admitted"] += 1
+            return drs_object
+
+        def _cataloged(index: int, entry: CatalogEntry):
+            """An object still complete in the destination since it was cataloged, skipped without resolving it."""
+            drs_object = entry.drs_object()
+            file_logger.info(f"{drs_object.name} is complete in {destination_path} per the catalog. Skipping download.")
+            if verbose:
+                logger.info(f"{drs_object.name} is complete in {destination_path} per the catalog. Skipping download.")
+            if keep_results:
+                results[index] = drs_object
+            counts["skipped"] += 1
+            _finished(drs_object)
+
+        async def _claim(item: Any, object_id: str) -> bool:
+            """Take the lease on an object, one held by another instance is kept to be claimed again later."""
+            if await leases.claim(object_id):
+                return True
+            if await asyncio.to_thread(leases.is_done, object_id):
+                counts["elsewhere"] += 1
+                download_progress.update(1)
+            else:
+                elsewhere.append((item, object_id))
+            return False
+
+        async def _retry_elsewhere(put: Callable[[Any], Awaitable[None]]):
+            """Claim again the objects another instance held, until each is done or its lease is taken over."""
+            if elsewhere:
+                message = f"Waiting on {len(elsewhere)} DRS objects being downloaded by other instances"
+                file_logger.info(message)
+                if verbose:
+                    logger.info(message)
+            while elsewhere:
+                await asyncio.sleep(leases.heartbeat)
+                waiting = list(elsewhere)
+                elsewhere.clear()
+                for item, object_id in waiting:
+                    if await _claim(item, object_id):
+                        await put(item)
+
+        async def _resolve(item: Tuple[int, str]) -> Optional[Tuple[int, DrsObject]]:
+            try:
+                return await _resolve_claimed(item)
+            finally:
+                counts["tried"] += 1
+                if counts["tried"] == counts.get("fed"):
+                    all_tried.set()
+
+        async def _resolve_claimed(item: Tuple[int, str]) -> Optional[Tuple[int, DrsObject]]:
+            index, object_id = item
+            entry = await self._completed(object_id, destination_path, duplicate)
+            if entry is not None:
+                resolve_progress.update(1)
+                _cataloged(index, entry)
+                return None
+            if leases is not None and not await _claim(item, object_id):
+                # done, or being downloaded by another instance
+                return None
+            try:
+                drs_object = await self._drs_client.get_object(object_id=object_id, verbose=verbose)
+            except Exception as e:
+                drs_object = DrsObject(
+                    self_uri=object_id,
+                    id=object_id,
+                    checksums=[],
+                    size=0,
+                    name=None,
+                )
+                drs_object.fail("get_object", f"Exception in get_object function {str(e)}")
+            if len(drs_object.errors) == 0:
+                drs_object.state = ObjectState.RESOLVED
+            if keep_results:
+                results[index] = drs_object
+            resolve_progress.update(1)
+            file_logger.info(str(resolve_progress))
+            return (index, drs_object) if _admit(drs_object) is not None else None
+
+        async def _sign(drs_object: DrsObject) -> Optional[DrsObject]:
+            try:
+                signed = await self._drs_client.sign_url(
+                    drs_object=drs_object, user_project=user_project, verbose=verbose
+                )
+            except Exception as e:
+                signed = drs_object
+                drs_object.fail("sign_url", f"Exception in sign_url function {str(e)}")
+
+            # keep the identity of the object even if the client handed back a different one
+            if signed is None:
+                drs_object.fail("sign_url", "No signed url was returned")
+            elif signed is not drs_object:
+                drs_object.errors.extend(signed.errors)
+                drs_object.failures.extend(signed.failures)
+                if len(signed.errors) == 0:
+                    drs_object.access_methods = signed.access_methods
+
+            if len(drs_object.errors) > 0:
+                file_logger.error(f"{drs_object.id} has error {drs_object.errors}, not attempting anything further")
+                logger.error(f"{drs_object.id} has error {drs_object.errors}, not attempting anything further")
+                _finished(drs_object)
+                return None
+            drs_object.state = ObjectState.SIGNED
+            return drs_object
+
+        async def _resign_if_expiring(drs_object: DrsObject, lock: asyncio.Lock):
+            """Sign again shortly before the url expires, parts already running keep the url they started with."""
+            if not drs_object.access_methods or not expires_within(drs_object.access_methods[0], self.resign_margin):
+                return
+            async with lock:
+                # another part of the object may have signed it again while this one waited
+                access_method = drs_object.access_methods[0]
+                if not expires_within(access_method, self.resign_margin):
+                    return
+                file_logger.info(f"Signed url of {drs_object.name} expires at {access_method.expires}, signing again")
+                if verbose:
+                    logger.info(f"Signed url of {drs_object.name} expires at {access_method.expires}, signing again")
+                errors, failures = len(drs_object.errors), len(drs_object.failures)
+                try:
+                    signed = await self._drs_client.sign_url(
+                        drs_object=drs_object, user_project=user_project, verbose=verbose
+                    )
+                except Exception as e:
+                    signed = None
+                    drs_object.errors.append(f"Exception in sign_url function {str(e)}")
+                # errors are not kept, the current url still works for a while and if it runs out the object is
+                # signed again as a recoverable error
+                failed = drs_object.errors[errors:]
+                del drs_object.errors[errors:]
+                del drs_object.failures[failures:]
+                if signed is None:
+                    failed = failed or ["No signed url was returned"]
+                elif signed is not drs_object:
+                    failed = failed or signed.errors
+                    if len(failed) == 0:
+                        drs_object.access_methods = signed.access_methods
+                if len(failed) > 0:
+                    file_logger.warning(f"Signing {drs_object.name} again failed, keeping the current url: {failed}")
+
+        async def _intact(drs_object: DrsObject) -> bool:
+            """A file already in the destination matches its checksum and is skipped, else it is to be repaired."""
+            path = destination_path / drs_object.name
+            try:
+                matches = await self._matches_checksum(drs_object, path)
+            except OSError as e:
+                file_logger.warning(f"Could not check {path}: {str(e)}")
+                matches = False
+            if matches is False:
+                message = f"{drs_object.name} in {destination_path} does not match its checksum, repairing it"
+                file_logger.info(message)
+                if verbose:
+                    logger.info(message)
+                return False
+            to_check.discard(drs_object.id)
+            message = f"{drs_object.name} in {destination_path} matches its checksum. Skipping download."
+            file_logger.info(message)
+            if verbose:
+                logger.info(message)
+            drs_object.state = ObjectState.SKIPPED
+            drs_object.path = path
+            counts["skipped"] += 1
+            if matches:
+                self._catalog(drs_object)
+            _finished(drs_object)
+            return True
+
+        async def _sign_next(item: Tuple[int, DrsObject]) -> Optional[DrsObject]:
+            _, drs_object = item
+            if drs_object.id in to_check:
+                # nothing else is made from its file until it is known to be intact
+                if await _intact(drs_object):
+                    return None
+                signed = await _sign(drs_object)
+                if signed is None:
+                    to_check.discard(drs_object.id)
+                return signed
+            if dedup is not None:
+                source = dedup.source(drs_object)
+                if source is not None:
+                    await _share(drs_object, source)
+                    return None
+            if self.cache is not None and await _from_cache(drs_object):
+                return None
+            if dedup is not None:
+                if dedup.follow(drs_object):
+                    message = f"{drs_object.name} has the same bytes as an object being downloaded, waiting for it"
+                    file_logger.info(message)
+                    if verbose:
+                        logger.info(message)
+                    return None
+            signed = await _sign(drs_object)
+            if signed is None and dedup is not None:
+                await _release_group(drs_object)
+            return signed
+
+        async def _share(drs_object: DrsObject, source: Path):
+            """Give an object the file of another with the same bytes instead of downloading it."""
+            destination = destination_path / drs_object.name
+            if destination != source or duplicate:
+                # under the same name the source already is that file, unless duplicates get numbered names
+                destination = self._free_destination(drs_object.name, destination_path, duplicate)
+            try:
+                method = "same file"
+                if destination != source:
+                    method = await asyncio.to_thread(place, source, destination, dedup.links)
+            except OSError as e:
+                drs_object.fail("download_part", f"Could not make {destination} from {source}: {str(e)}")
+            else:
+                drs_object.path = destination
+                dedup.saved(drs_object)
+                message = f"{drs_object.name} has the same bytes as {source.name}, not downloaded again ({method})"
+                file_logger.info(message)
+                if verbose:
+                    logger.info(message)
+            _finished(drs_object)
+
+        async def _from_cache(drs_object: DrsObject) -> bool:
+            """Place an object found in the cache in the destination, without signing or downloading it."""
+            destination = self._free_destination(drs_object.name, destination_path, duplicate)
+            try:
+                method = await asyncio.to_thread(self.cache.fetch, drs_object, destination)
+            except OSError as e:
+                file_logger.warning(f"Could not take {drs_object.name} from the cache {self.cache.root}: {str(e)}")
+                return False
+            if method is None:
+                return False
+            drs_object.path = destination
+            self.cache.saved(drs_object)
+            message = f"{drs_object.name} is in the cache {self.cache.root}, not downloaded ({method})"
+            file_logger.info(message)
+            if verbose:
+                logger.info(message)
+            _finished(drs_object)
+            return True
+
+        async def _release_group(drs_object: DrsObject):
+            """Hand the bytes of a finished object to the objects waiting for them, or their download to the next."""
+            followers, successor = dedup.finished(drs_object)
+            for follower in followers:
+                await _share(follower, drs_object.path)
+            if successor is not None:
+                # this stage is still running, so the next object of the group is signed and downloaded right here
+                if await _sign(successor) is None:
+                    await _release_group(successor)
+                else:
+                    await _download(successor)
+
+        async def _download(drs_object: DrsObject) -> None:
+            await _download_object(drs_object)
+            if dedup is not None:
+                await _release_group(drs_object)
+            if self.cache is not None and len(drs_object.errors) == 0 and drs_object.path is not None:
+                try:
+                    await asyncio.to_thread(self.cache.add, drs_object, drs_object.path)
+                except OSError as e:
+                    file_logger.warning(f"Could not add {drs_object.name} to the cache {self.cache.root}: {str(e)}")
+
+        async def _download_object(drs_object: DrsObject) -> None:
+            drs_object.state = ObjectState.DOWNLOADING
+            resign_lock = asyncio.Lock()
+            attempts = 0
+
+            async def _before_part():
+                await _resign_if_expiring(drs_object, resign_lock)
+
+            if drs_object.id in to_check:
+                to_check.discard(drs_object.id)
+                try:
+                    await self._repair_file(drs_object, destination_path, verbose, before_part=_before_part)
+                except Exception as e:
+                    drs_object.fail("download_part", f"Exception in repair_file function {str(e)}")
+                _finished(drs_object)
+                return
+
+            try:
+                # wait for the object's parts and stitched file to fit on disk before writing anything
+                async with self.disk_space.reserve(drs_object.id, self._disk_needed(drs_object, destination_path)):
+                    while True:
+                        try:
+                            await self._run_download_parts(
+                                drs_object=drs_object, destination_path=destination_path, verbose=verbose,
+                                before_part=_before_part,
+                            )
+                        except Exception as e:
+                            drs_object.fail("download_part", f"Exception in run_download_parts function {str(e)}")
+
+                        if not drs_object.recoverable or attempts >= self.max_object_retries:
+                            break
+
+                        # e.g. the signed url expired: sign only this object again, its parts already on disk are
+                        # kept and only the missing ones are downloaded, other objects carry on meanwhile
+                        attempts += 1
+                        message = (
+                            f"{drs_object.name} had a recoverable failure, signing again and retrying its missing "
+                            f"parts ({attempts}/{self.max_object_retries}): {drs_object.errors}"
+                        )
+                        file_logger.info(message)
+                        if verbose:
+                            logger.info(message)
+                        drs_object.clear_errors()
+                        if await _sign(drs_object) is None:
+                            return
+                        drs_object.state = ObjectState.DOWNLOADING
+            except NotEnoughDiskSpace as e:
+                drs_object.fail("download_part", f"Not enough disk space: {str(e)}")
+                file_logger.error(f"{drs_object.name} not downloaded, not enough disk space: {str(e)}")
+                logger.error(f"{drs_object.name} not downloaded, not enough disk space: {str(e)}")
+            finally:
+                # the object's journal and file stay open between attempts, not once it is given up on
+                self._drs_client.part_writer.close(drs_object.name, self._work_path(destination_path))
+
+            _finished(drs_object)
+            file_logger.info(str(download_progress))
+
+        async def _resolve_stage():
+            await self._run_stage(
+                _resolve, resolve_queue, None if resolve_only else sign_queue,
+                self.max_simultaneous_object_retrievers
+            )
+            resolve_progress.close()
+            if not keep_results:
+                return
+            if not resolve_only:
+                # resolution holds back while the sign queue is full, by now the rest of the manifest is signed
+                _choose_order(sign_queue.waiting())
+            if on_resolved is not None:
+                on_resolved([results[index] for index in sorted(results)])
+
+        def _choose_order(window: List[DrsObject]):
+            """Order the objects waiting to be signed, now that their sizes are known.
+
+            The sign queue holds at most reorder_window objects, the order and the predictions only cover those.
+            """
+            sized = [drs_object for drs_object in window if len(drs_object.errors) == 0]
+            if not sized:
+                return
+            share = self._part_scheduler.per_object_limit
+            lanes = max(1, self._part_scheduler.limit // share)
+            lane_throughput = share * (
+                self.part_sizer.per_connection_throughput or ordering.ASSUMED_CONNECTION_THROUGHPUT
+            )
+            policy, predictions = ordering.choose_policy(sized, lanes, lane_throughput)
+            if self.order != "auto":
+                policy = self.ordering_policy
+                if policy.name in predictions:
+                    predictions = {policy.name: predictions[policy.name]}
+                else:
+                    predictions[policy.name] = ordering.predict_makespan(
+                        ordering.ordered_sizes(policy, sized), lanes, lane_throughput
+                    )
+            message = (
+                f"Ordering {self.order}: downloading the {len(sized)} objects waiting to be signed, at most "
+                f"{self.reorder_window} at a time, in {policy.name} order, predicted makespan "
+                f"{ordering.describe_predictions(predictions)}"
+            )
+            file_logger.info(message)
+            if verbose:
+                logger.info(message)
+            sign_queue.reorder(policy)
+
+        async def _feed_resolved():
+            resolved = list(drs_objects)
+            # objects enter the bounded sign queue in the order given, the first window of them is ordered first
+            _choose_order(resolved[:self.reorder_window])
+            for index, drs_object in enumerate(resolved):
+                entry = await self._completed(drs_object.self_uri, destination_path, duplicate)
+                if entry is not None:
+                    _cataloged(index, entry)
+                    continue
+                if leases is not None and not await _claim((index, drs_object), drs_object.self_uri):
+                    continue
+                await _enqueue((index, drs_object))
+            if leases is not None:
+                await _retry_elsewhere(_enqueue)
+            await sign_queue.put(_DONE)
+
+        async def _enqueue(item: Tuple[int, DrsObject]):
+            index, drs_object = item
+            if keep_results:
+                results[index] = drs_object
+            if _admit(drs_object) is not None:
+                await sign_queue.put((index, drs_object))
+
+        async def _feed_claims(items: Iterable[Tuple[int, str]]):
+            """Feed the manifest, then the objects held elsewhere once every one of it has been tried."""
+            fed = 0
+            for item in items:
+                await resolve_queue.put(item)
+                fed += 1
+            counts["fed"] = fed
+            if counts["tried"] < fed:
+                await all_tried.wait()
+            await _retry_elsewhere(resolve_queue.put)
+            await resolve_queue.put(_DONE)
+
+        if object_ids is not None and leases is not None:
+            stages = [_feed_claims(enumerate(object_ids)), _resolve_stage()]
+        elif object_ids is not None:
+            stages = [self._feed(enumerate(object_ids), resolve_queue), _resolve_stage()]
+        else:
+            stages = [_feed_resolved()]
+        if not resolve_only:
+            stages.extend(
+                [
+                    self._run_stage(_sign_next, sign_queue, download_queue, self.max_simultaneous_object_signers),
+                    self._run_stage(_download, download_queue, None, download_concurrency),
+                ]
+            )
+
+        if leases is not None:
+            leases.start()
+        tasks = [asyncio.create_task(stage) for stage in stages]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            if leases is not None:
+                await leases.stop()
+            download_progress.close()
+            if self.concurrency_controller is not None:
+                self.concurrency_controller.close()
+
+        if not resolve_only:
+            file_logger.info(f"Peak parts in flight {self._part_scheduler.peak_in_flight}")
+            if self.concurrency_controller is not None:
+                file_logger.info(self.concurrency_controller.summary())
+                if verbose:
+                    logger.info(self.concurrency_controller.summary())
+
+        if counts["elsewhere"] > 0:
+            file_logger.info(f"{counts['elsewhere']} DRS objects were downloaded by other instances")
+            if verbose:
+                logger.info(f"{counts['elsewhere']} DRS objects were downloaded by other instances")
+
+        if not resolve_only and counts["admitted"] == 0 and counts["skipped"] > 0:
+            file_logger.info(f"All DRS objects already present in {destination_path}.")
+            logger.info(f"All DRS objects already present in {destination_path}.")
+
+        if not keep_results:
+            return failures
+        return [results[index] for index in sorted(results)]
+
+    def share_settings(self, shares: int) -> Dict[str, Any]:
+        """Constructor arguments for a manager doing one of `shares` equal parts of this manager's work.
+
+        The connection budget and the bandwidth cap are split, the other settings are copied.
         """
+        bandwidth_limiter = self._drs_client.bandwidth_limiter
+        return dict(
+            part_size=self.part_size,
+            max_simultaneous_object_retrievers=self.max_simultaneous_object_retrievers,
+            max_simultaneous_object_signers=self.max_simultaneous_object_signers,
+            max_simultaneous_downloaders=max(1, self._part_scheduler.limit // shares),
+            max_simultaneous_part_handlers=self._part_scheduler.per_object_limit,
+            event_loop_name=self.event_loop_name,
+            adaptive_concurrency=self.concurrency_controller is not None,
+            order=self.ordering_policy.name,
+            priorities=getattr(self.ordering_policy, "priorities", None),
+            reorder_window=self.reorder_window,
+            resign_margin=self.resign_margin,
+            max_object_retries=self.max_object_retries,
+            writer=self._drs_client.part_writer.name,
+            catalog=self.catalog,
+            deduplicate=self.deduplicator is not None,
+            hardlinks=self.deduplicator is not None and self.deduplicator.links is HARDLINKS,
+            cache=self.cache,
+            staging_path=self.staging_path,
+            repair=self.repair,
+            max_bandwidth=int(bandwidth_limiter.rate / shares) if bandwidth_limiter is not None else None,
+        )
 
-        tasks = []
-        for object_id in object_ids:
-            task = asyncio.create_task(self._drs_client.get_object(object_id=object_id, verbose=verbose))
-            tasks.append(task)
+    def _work_path(self, destination_path: Path) -> Path:
+        """Where an object's parts are written and stitched, the staging directory if there is one."""
+        return self.staging_path if self.staging_path is not None else destination_path
 
-        object_information = []
+    def _disk_needed(self, drs_object: DrsObject, destination_path: Path) -> List[Tuple[Path, int]]:
+        """Bytes an object still has to write: the parts not yet on disk, then the stitched file.
 
-        object_information = await self.wait_till_completed(tasks, "get_object")
+        With staging on another filesystem, the stitched file is then copied to the destination.
+        """
+        work_path = self._work_path(destination_path)
+        needed = []
+        if work_path != destination_path and os.stat(work_path).st_dev != os.stat(destination_path).st_dev:
+            needed.append((destination_path, drs_object.size))
+        writer = self._drs_client.part_writer
+        if writer.in_place:
+            # a single file, part of it may have been allocated by an interrupted download
+            try:
+                allocated = os.stat(writer.download_path(drs_object.name, work_path)).st_blocks * 512
+            except (FileNotFoundError, AttributeError):
+                allocated = 0
+            return needed + [(work_path, drs_object.size - allocated)]
+        journal = Journal.load(writer.journal_path(drs_object.name, work_path), drs_object.size)
+        if journal is not None:
+            existing = journal.ranges.total()
+        else:
+            # parts left by a version without journals, found in the listing of the directory made once per run
+            existing = 0
+            for start, end in self._index(work_path).parts(drs_object.name):
+                try:
+                    existing += os.stat(writer.part_path(drs_object.name, start, end, work_path)).st_size
+                except FileNotFoundError:
+                    pass
+        return needed + [(work_path, drs_object.size - existing), (work_path, drs_object.size)]
 
-        return object_information
+    async def close(self):
+        """Release the client's pooled connections, call once the event loop has no more work."""
+        await self._drs_client.close()
 
-    @classmethod
-    def chunker(cls, seq: Collection, size: int) -> Iterator:
-        """Iterate over a list in chunks.
+    def run(self, coroutine):
+        """Run a coroutine on its own event loop, then release the client's resources bound to that loop.
 
         Args:
-            seq: an iterable
-            size: desired chunk size
+            coroutine: typically the entire job, so that connections and tokens are reused throughout
 
         Returns:
-            an iterator that returns lists of size or less
+            the result of the coroutine
         """
-        return (seq[pos: pos + size] for pos in range(0, len(seq), size))
+
+        async def _run_and_close():
+            try:
+                return await coroutine
+            finally:
+                await self.close()
+
+        return event_loop.run(_run_and_close(), self.event_loop_name)
 
     def get_objects(self, object_ids: List[str], verbose: bool) -> List[DrsObject]:
-        """Create tasks for all object_ids, run them in batches, get information about the object.
+        """Get information about every object.
+
+        Synchronous wrapper around `get_objects_async`, callers already on an event loop should await that instead.
 
         Args:
             object_ids: list of objects to fetch
         """
+        return self.run(self.get_objects_async(object_ids, verbose=verbose))
 
-        drs_objects = []
+    async def get_objects_async(self, object_ids: List[str], verbose: bool) -> List[DrsObject]:
+        """Get information about every object, max_simultaneous_object_retrievers at a time.
 
-        total_batches = math.ceil(
-            len(object_ids) / self.max_simultaneous_object_retrievers
+        Args:
+            object_ids: list of objects to fetch
+        """
+        return await self._pipeline(
+            destination_path=None, user_project=None, duplicate=False, verbose=verbose,
+            object_ids=object_ids, resolve_only=True,
         )
-        # rounding
-        # this would imply that if batch count is 9.3, and you round down the last .3 is never
-        # actually downloaded since there are only 9 batches. math.ciel would round up if there is a decimal at all
-
-        current = 0
-        progress = tqdm.tqdm(
-            DrsAsyncManager.chunker(
-                object_ids, self.max_simultaneous_object_retrievers),
-            total=total_batches,
-            desc="Get Objects Progress",
-            file=sys.stdout,
-            leave=False,
-            disable=self.disable)
-
-        for chunk_of_object_ids in progress:
-            file_logger.info(str(progress))
-
-            if verbose:
-                logger.info(f'Batch {chunk_of_object_ids} of {total_batches}')
-            drs_objects.extend(
-                asyncio.run(
-                    self._run_get_objects(
-                        object_ids=chunk_of_object_ids, leave=(current == total_batches), verbose=verbose
-                    )
-                )
-            )
-            current += 1
-
-        return drs_objects
 
     def download(
         self, drs_objects: List[DrsObject], destination_path: Path, user_project: str, duplicate: bool, verbose: bool
     ) -> List[DrsObject]:
-        """Split the drs_objects into manageable sizes, download the files.
+        """Sign and download objects that have already been resolved.
+
+        Synchronous wrapper around `download_async`, callers already on an event loop should await that instead.
 
         Args:
             drs_objects: list of DrsObject
@@ -508,70 +1379,58 @@ class DrsAsyncManager(DrsManager):
         Returns:
             DrsObjects updated with _file_parts
         """
-        while True:
-
-            filtered_objects = self.filter_existing_files(
-                drs_objects, destination_path, duplicate=duplicate, verbose=verbose
+        return self.run(
+            self.download_async(
+                drs_objects, destination_path, user_project=user_project, duplicate=duplicate, verbose=verbose
             )
-            file_logger.info(f"Drs Objects after filter_existing_files function {filtered_objects}")
-            if verbose:
-                logger.info(f"Drs Objects after filter_existing_files function {filtered_objects}")
-
-            if len(filtered_objects) < len(drs_objects):
-                complete_objects = [
-                    obj for obj in drs_objects if obj not in filtered_objects
-                ]
-                for obj in complete_objects:
-                    file_logger.info(f"{obj.name} already exists in {destination_path}. Skipping download.")
-                    if verbose:
-                        logger.info(f"{obj.name} already exists in {destination_path}. Skipping download.")
-
-                if len(filtered_objects) == 0:
-                    file_logger.info(
-                        f"Some DRS objects already present in {destination_path}."
-                    )
-                    logger.info(
-                        f"Some DRS objects already present in {destination_path}."
-                    )
-                    return
-
-            current = 0
-            updated_drs_objects = []
-
-            for chunk_of_drs_objects in DrsAsyncManager.chunker(
-                filtered_objects, self.max_simultaneous_object_retrievers
-            ):
+        )
 
-                completed_chunk = asyncio.run(
-                    self._run_download(
-                        drs_objects=chunk_of_drs_objects,
-                        destination_path=destination_path,
-                        user_project=user_project, verbose=verbose
-                    )
-                )
-                current += 1
-                updated_drs_objects.extend(completed_chunk)
+    async def download_async(
+        self, drs_objects: List[DrsObject], destination_path: Path, user_project: str, duplicate: bool, verbose: bool,
+        on_finished: Optional[Callable[[DrsObject], None]] = None,
+    ) -> List[DrsObject]:
+        """Sign and download objects that have already been resolved.
 
-            file_logger.info(f"UPDATED DRS OBJECTS \n\n {updated_drs_objects}")
-            if verbose:
-                logger.info(f"UPDATED DRS OBJECTS \n\n {updated_drs_objects}")
+        Args:
+            drs_objects: list of DrsObject
+            destination_path: directory where to write files when complete
+            on_finished: called with each object once it is downloaded, skipped or has failed
 
-            if "RECOVERABLE in AIOHTTP" not in str(updated_drs_objects):
-                break
+        Returns:
+            DrsObjects updated with _file_parts
+        """
+        return await self._pipeline(
+            destination_path=destination_path, user_project=user_project, duplicate=duplicate, verbose=verbose,
+            drs_objects=drs_objects, on_finished=on_finished,
+        )
 
-            file_logger.info("RECOVERABLE in AIOHTTP present in some objects, so picking up where\
-left off \n\n")
-            if verbose:
-                logger.info("RECOVERABLE in AIOHTTP present in some objects, so picking up where\
-left off \n\n")
+    async def resolve_and_download(
+        self,
+        object_ids: Iterable[str],
+        destination_path: Path,
+        user_project: str,
+        duplicate: bool,
+        verbose: bool,
+        on_resolved: Optional[Callable[[List[DrsObject]], None]] = None,
+        on_finished: Optional[Callable[[DrsObject], None]] = None,
+        keep_results: bool = True,
+    ) -> List[DrsObject]:
+        """Resolve, sign and download, objects start downloading as soon as they resolve.
 
-            # Iterate through objects only deleting the ones that have
-            # the recoverable error
-            for drsobject in drs_objects:
-                if "RECOVERABLE in AIOHTTP" in str(drsobject.errors):
-                    drsobject.errors.clear()
+        Args:
+            object_ids: DRS URIs from the manifest, may be a lazy iterator
+            destination_path: directory where to write files when complete
+            on_resolved: called with every resolved object once resolution has finished
+            on_finished: called with each object once it is downloaded, skipped or has failed
+            keep_results: False to stream a manifest of any length in bounded memory, see `_pipeline`
 
-        return updated_drs_objects
+        Returns:
+            every DrsObject, in manifest order; without keep_results only the objects that failed
+        """
+        return await self._pipeline(
+            destination_path=destination_path, user_project=user_project, duplicate=duplicate, verbose=verbose,
+            object_ids=object_ids, on_resolved=on_resolved, on_finished=on_finished, keep_results=keep_results,
+        )
 
     def optimize_workload(
         self, verbose, drs_objects: List[DrsObject]
@@ -586,14 +1445,12 @@ left off \n\n")
         """
         # Now that we have the objects to download, we have an opportunity to shape the downloads
         # e.g. are the smallest files first?  tweak MAX_* to optimize per workload
-        # TODO: If part sizes changed here, would this result in an error in test recovery?
-        # Going to maek all part sizes 128MB to solve the problem above except for the small files because in that case
-        # there is a pytest written for them that will fail otherwise
+        # The part size set here is only where the PartSizer starts, each object's part size is chosen when it
+        # starts downloading. Parts left by an interrupted download keep their layout, see existing_part_size.
 
         if len(drs_objects) == 1:
             self.max_simultaneous_part_handlers = 50
             self.part_size = 64 * MB
-            self.max_simultaneous_downloaders = 10
             file_logger.info("part_size=%s", self.part_size)
             if verbose:
                 logger.info("part_size=%s", self.part_size)
@@ -601,7 +1458,6 @@ left off \n\n")
         elif any(True for drs_object in drs_objects if (int(drs_object.size) > GB)):
             self.max_simultaneous_part_handlers = 3
             self.part_size = 128 * MB
-            self.max_simultaneous_downloaders = 10
             file_logger.info("part_size=%s", self.part_size)
             if verbose:
                 logger.info("part_size=%s", self.part_size)
@@ -609,7 +1465,6 @@ left off \n\n")
         elif all((drs_object.size < (5 * MB)) for drs_object in drs_objects):
             self.part_size = 1 * MB
             self.max_simultaneous_part_handlers = 2
-            self.max_simultaneous_downloaders = 10
             file_logger.info("part_size=%s", self.part_size)
             file_logger.info("part_handlers=%s", self.max_simultaneous_part_handlers)
             if verbose:
@@ -619,15 +1474,73 @@ left off \n\n")
         else:
             self.part_size = 128 * MB
             self.max_simultaneous_part_handlers = 10
-            self.max_simultaneous_downloaders = 10
             file_logger.info("part_size=%s", self.part_size)
             file_logger.info("part_handlers=%s", self.max_simultaneous_part_handlers)
             if verbose:
                 logger.info("part_size=%s", self.part_size)
                 logger.info("part_handlers=%s", self.max_simultaneous_part_handlers)
 
+        # only each object's share changes: downloads are already running, the connection budget they share is
+        # where the concurrency controller has tuned it to
+        self._part_scheduler.set_limits(self._part_scheduler.limit, self.max_simultaneous_part_handlers)
+        file_logger.info("downloaders=%s", self._part_scheduler.limit)
+        if verbose:
+            logger.info("downloaders=%s", self._part_scheduler.limit)
+
         return drs_objects
 
+    async def _completed(
+        self, uri: str, destination_path: Optional[Path], duplicate: bool
+    ) -> Optional[CatalogEntry]:
+        """The catalog entry of an object still complete in the destination, see `Catalog.completed`."""
+        if self.catalog is None or destination_path is None or duplicate is True:
+            return None
+        try:
+            return await asyncio.to_thread(self.catalog.completed, uri, destination_path)
+        except sqlite3.Error as e:
+            file_logger.warning(f"Could not read the catalog {self.catalog.path}: {e}")
+            return None
+
+    def _catalog(self, drs_object: DrsObject):
+        """Record a complete object, the catalog is only a shortcut so failing to write it fails nothing."""
+        if self.catalog is None:
+            return
+        try:
+            self.catalog.record(drs_object, drs_object.path)
+        except (sqlite3.Error, OSError) as e:
+            file_logger.warning(f"Could not record {drs_object.name} in the catalog {self.catalog.path}: {e}")
+
+    @staticmethod
+    def _free_destination(name: str, destination_path: Path, duplicate: bool) -> Path:
+        """Where a file placed rather than downloaded goes, numbered like a download when duplicates are wanted."""
+        destination = destination_path / name
+        i = 1
+        while duplicate and destination.exists():
+            destination = destination_path / f"{name}({i})"
+            i += 1
+        return destination
+
+    def _destination_status(self, drs_object: DrsObject, destination_path: Path, duplicate: bool) -> Optional[str]:
+        """Whether the object's file is already in the destination, see `DestinationIndex.status`.
+
+        Returns:
+            None when duplicates are downloaded anyway
+        """
+        if duplicate is True:
+            return None
+        return self._index(destination_path).status(drs_object)
+
+    def _index(self, path: Path) -> DestinationIndex:
+        """The files in the destination or the staging directory, listed on first use in a run."""
+        path = Path(path)
+        if self.staging_path is not None and path == self.staging_path:
+            if self.staging_index is None:
+                self.staging_index = DestinationIndex.scan(path)
+            return self.staging_index
+        if self.destination_index is None or self.destination_index.destination_path != path:
+            self.destination_index = DestinationIndex.scan(path)
+        return self.destination_index
+
     def filter_existing_files(
         self, drs_objects: List[DrsObject], destination_path: Path, duplicate: bool, verbose: bool
     ) -> List[DrsObject]:
@@ -647,20 +1560,9 @@ left off \n\n")
         if duplicate is True:
             return drs_objects
 
-        # Testing File filtering by size also
-        """
-        for drs in drs_objects:
-            logger.info(f"drs.size: {drs.size}  != os.path.getsize(drs.name) {os.path.getsize(drs.name)}")
-            if(drs.size != os.path.getsize(drs.name)):
-                logger.warning(f"{drs.name} is the wrong size,
-                consider running this command again with the --duplicate flag
-                 so that your current file with the same name is
-                  not overwritten by this one that is on the path to downloading")
-        """
-        filtered_objects = [
-            drs for drs in drs_objects if (drs.name not in os.listdir(destination_path))
-            #  or drs.size != os.path.getsize(drs.name) <-- this is used for filtering out wrong sized stuff
-        ]
+        # one pass over the directory for every object, a file of the wrong size is downloaded again
+        index = DestinationIndex.scan(destination_path)
+        filtered_objects = [drs for drs in drs_objects if index.status(drs) != COMPLETE]
         file_logger.info(f"VALUE OF FILTERED OBJECTS {filtered_objects}")
         if verbose:
             logger.info(f"VALUE OF FILTERED OBJECTS {filtered_objects}")
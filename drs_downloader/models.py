@@ -3,9 +3,15 @@ import platform
 import threading
 from abc import ABC, abstractmethod
 from dataclasses import dataclass, field
+from datetime import datetime
+from enum import Enum
 from pathlib import Path
 from typing import List, Dict, Optional
 
+from drs_downloader.bandwidth import BandwidthLimiter
+from drs_downloader.hashing import HashFrontier
+from drs_downloader.writers import PartFiles, PartSink, PartWriter
+
 
 @dataclass
 class AccessMethod(object):
@@ -15,6 +21,8 @@ class AccessMethod(object):
     """An AccessURL that can be used to fetch the actual object bytes."""
     type: str
     """Type of the access method. enum (s3, gs, ftp, gsiftp, globus, htsget, https, file)"""
+    expires: Optional[datetime] = None
+    """When the signed access_url stops working, in UTC; None if unknown."""
 
 
 @dataclass
@@ -37,6 +45,30 @@ class Checksum(object):
     """The digest method used to create the checksum."""
 
 
+class ObjectState(Enum):
+    """Where an object is on its way through the get_object -> sign_url -> download_part stages."""
+
+    PENDING = "pending"
+    RESOLVED = "resolved"
+    SIGNED = "signed"
+    DOWNLOADING = "downloading"
+    DONE = "done"
+    SKIPPED = "skipped"
+    FAILED = "failed"
+
+
+@dataclass
+class Failure(object):
+    """Why an object failed, kept on the object itself."""
+
+    stage: str
+    """Where it failed: get_object, sign_url, download_part or stitch."""
+    message: str
+    """The error, also in DrsObject.errors."""
+    recoverable: bool = False
+    """Signing the object again and retrying its missing parts may succeed, e.g. after the url expired."""
+
+
 @dataclass
 class DrsObject(object):
     """See https://ga4gh.github.io/data-repository-service-schemas/preview/release/drs-1.0.0/docs/#_drsobject"""
@@ -57,6 +89,27 @@ class DrsObject(object):
     """List of errors."""
     access_methods: List[AccessMethod] = field(default_factory=list)
     """Signed url."""
+    state: ObjectState = ObjectState.PENDING
+    """Where the object is in the pipeline."""
+    failures: List[Failure] = field(default_factory=list)
+    """Typed record of the errors added with `fail`."""
+    path: Optional[Path] = None
+    """Where the object's file is, once it is complete."""
+
+    def fail(self, stage: str, message: str, recoverable: bool = False):
+        """Record an error, the object fails unless a recoverable failure is retried successfully."""
+        self.failures.append(Failure(stage=stage, message=message, recoverable=recoverable))
+        self.errors.append(message)
+
+    @property
+    def recoverable(self) -> bool:
+        """True if a failure may go away by signing again and retrying the parts not yet on disk."""
+        return any(failure.recoverable for failure in self.failures)
+
+    def clear_errors(self):
+        """Forget every error before retrying."""
+        self.errors.clear()
+        self.failures.clear()
 
 
 @dataclass
@@ -89,9 +142,28 @@ class Statistics:
 class DrsClient(ABC):
     """Interact with DRS service."""
 
+    bandwidth_limiter: Optional[BandwidthLimiter] = None
+    """Shared by every download_part stream when the bandwidth is capped."""
+    part_writer: PartWriter = PartFiles()
+    """Where download_part writes the bytes of a part, see `writers`."""
+    hash_frontiers: Optional[Dict[str, HashFrontier]] = None
+    """Checksums computed as the parts are written, by object id, see `hashing`."""
+
     def __init__(self, statistics: Statistics = Statistics()):
         self.statistics = statistics
 
+    async def throttle(self, drs_object: DrsObject, nbytes: int):
+        """Call from download_part for every chunk received, waits for the object's share of a capped bandwidth."""
+        if self.bandwidth_limiter is not None:
+            await self.bandwidth_limiter.acquire(drs_object.id, nbytes)
+
+    async def open_part(self, drs_object: DrsObject, start: int, size: int, destination_path: Path) -> PartSink:
+        """Call from download_part to write a part, return the sink's path once it is closed."""
+        sink = await self.part_writer.open(drs_object.name, start, size, destination_path)
+        if self.hash_frontiers is not None and drs_object.id in self.hash_frontiers:
+            sink = self.hash_frontiers[drs_object.id].track(start, sink)
+        return sink
+
     @abstractmethod
     async def download_part(
         self, drs_object: DrsObject, start: int, size: int, destination_path: Path, verbose: bool = False
@@ -123,3 +195,7 @@ class DrsClient(ABC):
     async def get_object(self, object_id: str) -> DrsObject:
         """Retrieve size, checksums, etc. populate DrsObject."""
         pass
+
+    async def close(self):
+        """Release resources kept between requests, e.g. pooled connections bound to the running event loop."""
+        pass
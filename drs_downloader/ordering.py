@@ -0,0 +1,184 @@
+"""Decide which resolved object is signed and downloaded next.
+
+Policies:
+
+- lpt: largest first, the big objects start early so the end of the run is not a few huge files on a few connections.
+- spt: smallest first, the most files complete early.
+- manifest: the order of the manifest.
+- priority: a column of the manifest, lower values first, objects without a value last.
+- auto: whichever of lpt, spt and manifest predicts the shortest makespan for the sizes resolved.
+
+The queue of objects waiting to be signed is bounded, a policy orders the objects waiting in it at a time rather
+than the whole manifest; predictions are made for those objects.
+"""
+import asyncio
+import heapq
+import itertools
+import math
+from abc import ABC, abstractmethod
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from drs_downloader import MB
+from drs_downloader.models import DrsObject
+
+ORDERINGS = ["auto", "lpt", "spt", "manifest", "priority"]
+
+ASSUMED_CONNECTION_THROUGHPUT = 10 * MB
+"""Bytes per second per connection used for predictions until a part has been measured."""
+
+
+class OrderingPolicy(ABC):
+    """Sort key for objects waiting to be signed, smaller keys go first."""
+
+    name: str
+
+    @abstractmethod
+    def key(self, index: int, drs_object: DrsObject) -> Tuple:
+        """
+        Args:
+            index: position of the object in the manifest
+            drs_object: the resolved object
+        """
+        pass
+
+
+class LargestFirst(OrderingPolicy):
+    name = "lpt"
+
+    def key(self, index: int, drs_object: DrsObject) -> Tuple:
+        return -drs_object.size, index
+
+
+class SmallestFirst(OrderingPolicy):
+    name = "spt"
+
+    def key(self, index: int, drs_object: DrsObject) -> Tuple:
+        return drs_object.size, index
+
+
+class ManifestOrder(OrderingPolicy):
+    name = "manifest"
+
+    def key(self, index: int, drs_object: DrsObject) -> Tuple:
+        return (index,)
+
+
+class PriorityOrder(OrderingPolicy):
+    name = "priority"
+
+    def __init__(self, priorities: Dict[str, float]):
+        """
+        Args:
+            priorities: priority of each DRS URI, lower values go first
+        """
+        self.priorities = priorities
+
+    def key(self, index: int, drs_object: DrsObject) -> Tuple:
+        priority = self.priorities.get(drs_object.id, self.priorities.get(drs_object.self_uri))
+        return (0, priority, index) if priority is not None else (1, 0, index)
+
+
+SIZE_POLICIES: Dict[str, OrderingPolicy] = {
+    policy.name: policy for policy in [ManifestOrder(), SmallestFirst(), LargestFirst()]
+}
+
+
+def make_policy(name: str, priorities: Optional[Dict[str, float]] = None) -> OrderingPolicy:
+    """Policy for a name given on the command line, `auto` starts in manifest order until sizes are known."""
+    if name == "priority":
+        if priorities is None:
+            raise ValueError("The priority ordering needs a priority for each DRS URI.")
+        return PriorityOrder(priorities)
+    if name == "auto":
+        return SIZE_POLICIES["manifest"]
+    if name not in SIZE_POLICIES:
+        raise ValueError(f"Unknown ordering '{name}', expected one of {ORDERINGS}")
+    return SIZE_POLICIES[name]
+
+
+def predict_makespan(sizes: Sequence[int], lanes: int, lane_throughput: float) -> float:
+    """Seconds until the last object finishes if objects start in the order given.
+
+    Each object is modeled as running on one lane, a lane being an object's share of the connection budget, and
+    starts on whichever lane frees up first.
+
+    Args:
+        sizes: object sizes in bytes, in download order
+        lanes: number of objects downloading at once
+        lane_throughput: bytes per second of one lane
+    """
+    finish_times = [0.0] * max(1, lanes)
+    for size in sizes:
+        start = heapq.heappop(finish_times)
+        heapq.heappush(finish_times, start + size / lane_throughput)
+    return max(finish_times)
+
+
+def ordered_sizes(policy: OrderingPolicy, drs_objects: Sequence[DrsObject]) -> List[int]:
+    """Sizes of the objects in the order the policy would download them."""
+    ranked = sorted(enumerate(drs_objects), key=lambda item: policy.key(*item))
+    return [drs_object.size for _, drs_object in ranked]
+
+
+def choose_policy(
+    drs_objects: Sequence[DrsObject], lanes: int, lane_throughput: float
+) -> Tuple[OrderingPolicy, Dict[str, float]]:
+    """Pick the size policy with the shortest predicted makespan.
+
+    Predictions within 1% count as a tie, ties go to smallest first then manifest order, so that files complete
+    as early as possible when the order makes no difference to the end of the run.
+
+    Returns:
+        the policy and the predicted makespan of every size policy
+    """
+    predictions = {
+        name: predict_makespan(ordered_sizes(policy, drs_objects), lanes, lane_throughput)
+        for name, policy in SIZE_POLICIES.items()
+    }
+    best = min(predictions.values())
+    for name in ["spt", "manifest", "lpt"]:
+        if predictions[name] <= best * 1.01:
+            return SIZE_POLICIES[name], predictions
+    return SIZE_POLICIES["lpt"], predictions
+
+
+class OrderedQueue(asyncio.Queue):
+    """A bounded queue of (index, DrsObject) that hands out the item the policy ranks first.
+
+    The policy can change while items are waiting, see `reorder`. The `_DONE` marker and any other non tuple item
+    sort after every object.
+    """
+
+    def __init__(self, policy: OrderingPolicy, maxsize: int = 0):
+        self.policy = policy
+        self._sequence = itertools.count()
+        super().__init__(maxsize=maxsize)
+
+    def _rank(self, item: Any) -> Tuple:
+        if isinstance(item, tuple):
+            return (0,) + self.policy.key(*item)
+        return (1,)
+
+    def _init(self, maxsize):
+        self._queue = []
+
+    def _put(self, item):
+        heapq.heappush(self._queue, (self._rank(item), next(self._sequence), item))
+
+    def _get(self):
+        return heapq.heappop(self._queue)[-1]
+
+    def waiting(self) -> List[DrsObject]:
+        """The objects waiting, the only ones an ordering applies to."""
+        return [item[-1][1] for item in self._queue if isinstance(item[-1], tuple)]
+
+    def reorder(self, policy: OrderingPolicy):
+        """Switch policy, items already waiting are ranked again."""
+        self.policy = policy
+        self._queue = [(self._rank(item), sequence, item) for _, sequence, item in self._queue]
+        heapq.heapify(self._queue)
+
+
+def describe_predictions(predictions: Dict[str, float]) -> str:
+    """One line summary of predicted makespans, for the log."""
+    return ", ".join(f"{name} {math.ceil(seconds)}s" for name, seconds in predictions.items())
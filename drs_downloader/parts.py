@@ -0,0 +1,122 @@
+"""Choose how each object is split into parts."""
+import math
+import os
+import re
+from pathlib import Path
+from typing import Iterable, Optional, Tuple
+
+from drs_downloader import (
+    DEFAULT_MAX_PART_SIZE,
+    DEFAULT_MAX_PARTS,
+    DEFAULT_MIN_PART_SIZE,
+    DEFAULT_MIN_PARTS,
+    DEFAULT_TARGET_PART_SECONDS,
+    MB,
+)
+
+
+class PartSizer(object):
+    """Pick a part size per object from its size and the throughput one connection achieves.
+
+    A part should take about `target_part_seconds` on one connection, so large objects do not end up with
+    thousands of tiny parts. That size is then bounded so that:
+
+    - an object has at least `min_parts` parts, medium objects still download in parallel
+    - an object has at most `max_parts` parts, this wins over `max_part_size`
+    - a part is never smaller than `min_part_size`, small objects download in one or two parts
+    """
+
+    def __init__(
+        self,
+        min_part_size: int = DEFAULT_MIN_PART_SIZE,
+        max_part_size: int = DEFAULT_MAX_PART_SIZE,
+        min_parts: int = DEFAULT_MIN_PARTS,
+        max_parts: int = DEFAULT_MAX_PARTS,
+        target_part_seconds: float = DEFAULT_TARGET_PART_SECONDS,
+    ):
+        self.min_part_size = min_part_size
+        self.max_part_size = max(min_part_size, max_part_size)
+        self.min_parts = max(1, min_parts)
+        self.max_parts = max(self.min_parts, max_parts)
+        self.target_part_seconds = target_part_seconds
+        self.per_connection_throughput: Optional[float] = None
+        """Bytes per second one connection achieves, None until a part has finished."""
+
+    def record(self, nbytes: int, seconds: float):
+        """Measure a part that downloaded successfully."""
+        if seconds <= 0:
+            return
+        throughput = nbytes / seconds
+        if self.per_connection_throughput is None:
+            self.per_connection_throughput = throughput
+        else:
+            self.per_connection_throughput = 0.8 * self.per_connection_throughput + 0.2 * throughput
+
+    def part_size(self, size: int, default: int) -> int:
+        """Part size for an object.
+
+        Args:
+            size: size of the object in bytes
+            default: part size to aim for until a part has finished and the throughput is known
+
+        Returns:
+            part size in bytes, a multiple of 1 MB unless the object is a single part
+        """
+        if size <= self.min_part_size:
+            return max(size, 1)
+
+        if self.per_connection_throughput is None:
+            part_size = default
+        else:
+            part_size = self.per_connection_throughput * self.target_part_seconds
+        part_size = min(part_size, self.max_part_size, math.ceil(size / self.min_parts))
+        # too many parts is worse than parts larger than max_part_size
+        part_size = max(part_size, self.min_part_size, size / self.max_parts)
+        return math.ceil(part_size / MB) * MB
+
+
+_PART_NAME = re.compile(r"(.+)\.(\d+)\.(\d+)\.part$")
+
+
+def parse_part_name(filename: str) -> Optional[Tuple[str, int, int]]:
+    """Object name, first and last byte of a `{name}.{start}.{end}.part` file, None for any other file."""
+    match = _PART_NAME.match(filename)
+    if match is None:
+        return None
+    return match.group(1), int(match.group(2)), int(match.group(3))
+
+
+def part_size_of(parts: Iterable[Tuple[int, int]], size: int) -> Optional[int]:
+    """Part size of an object's parts, given as (start, end); None if none of them tells.
+
+    The last part ends at the object's size and says nothing about the part size.
+    """
+    for start, end in parts:
+        if end != size and end > start:
+            return end - start
+    return None
+
+
+def existing_part_size(name: str, destination_path: Path, size: int) -> Optional[int]:
+    """Part size used by an earlier, interrupted download of an object, so that its parts can be reused.
+
+    Lists the directory, see `DestinationIndex.parts` for the parts of every object from one listing.
+
+    Args:
+        name: name of the object, parts are saved as `{name}.{start}.{end}.part`
+        destination_path: directory holding the parts
+        size: size of the object, the last part ends there and says nothing about the part size
+
+    Returns:
+        the part size of the parts found, None if there are none
+    """
+    try:
+        entries = list(os.scandir(destination_path))
+    except OSError:
+        return None
+    parts = []
+    for entry in entries:
+        part = parse_part_name(entry.name)
+        if part is not None and part[0] == name:
+            parts.append(part[1:])
+    return part_size_of(parts, size)
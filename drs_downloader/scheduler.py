@@ -0,0 +1,310 @@
+"""Schedule part downloads from every active object under one connection budget, and tune that budget."""
+import asyncio
+import csv
+import logging
+import time
+from collections import OrderedDict, deque
+from dataclasses import astuple, dataclass, fields
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+
+from drs_downloader import DEFAULT_MAX_ADAPTIVE_DOWNLOADERS, MB
+
+file_logger = logging.getLogger("file_logger")
+
+Job = Callable[[], Awaitable[Any]]
+
+
+class PartScheduler(object):
+    """Share one budget of connections between the parts of every active object.
+
+    Parts are started round robin across objects, so a large object cannot starve the others and the total
+    number of sockets is the same whatever the mix of file sizes. Under contention each object is held to
+    `per_object_limit` parts in flight; if no other object is waiting, an object may use the whole budget.
+    """
+
+    def __init__(self, limit: int, per_object_limit: int):
+        """
+        Args:
+            limit: maximum number of parts in flight across every object
+            per_object_limit: share of the budget an object may hold while others are waiting
+        """
+        self.limit = max(1, limit)
+        self.per_object_limit = max(1, per_object_limit)
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self._pending: Dict[Any, Deque[Tuple[Job, asyncio.Future]]] = OrderedDict()
+        self._active: Dict[Any, int] = {}
+        self._dispatch_scheduled = False
+
+    @property
+    def waiting(self) -> int:
+        """Number of parts queued for a slot."""
+        return sum(len(queue) for queue in self._pending.values())
+
+    def set_limits(self, limit: int, per_object_limit: int = None):
+        """Change the budget while parts are running, extra capacity is used straight away."""
+        self.limit = max(1, limit)
+        if per_object_limit is not None:
+            self.per_object_limit = max(1, per_object_limit)
+        self._dispatch()
+
+    def submit(self, key: Any, job: Job) -> asyncio.Future:
+        """Queue a part, the returned future resolves to the job's result.
+
+        Args:
+            key: the object the part belongs to, parts are interleaved across keys
+            job: coroutine function that downloads the part
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.setdefault(key, deque()).append((job, future))
+        # start parts on the next loop iteration, so objects submitting together are interleaved
+        if not self._dispatch_scheduled:
+            self._dispatch_scheduled = True
+            loop.call_soon(self._dispatch)
+        return future
+
+    async def run(self, key: Any, jobs: List[Job]) -> List[Any]:
+        """Queue every part of an object and wait for all of them, results are in the order given."""
+        futures = [self.submit(key, job) for job in jobs]
+        try:
+            return await asyncio.gather(*futures)
+        finally:
+            # the object was cancelled, do not start the rest of its parts
+            for future in futures:
+                future.cancel()
+
+    def _next(self, respect_share: bool):
+        """Pop the next part round robin across objects, or None if nothing can start."""
+        for key in list(self._pending):
+            queue = self._pending[key]
+            while queue and queue[0][1].done():
+                queue.popleft()
+            if not queue:
+                del self._pending[key]
+                continue
+            if respect_share and self._active.get(key, 0) >= self.per_object_limit:
+                continue
+            # move the key to the back so the next slot goes to another object
+            self._pending.move_to_end(key)
+            job, future = queue.popleft()
+            if not queue:
+                del self._pending[key]
+            return key, job, future
+        return None
+
+    def _dispatch(self):
+        self._dispatch_scheduled = False
+        while self.in_flight < self.limit:
+            item = self._next(respect_share=True) or self._next(respect_share=False)
+            if item is None:
+                return
+            key, job, future = item
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+            self._active[key] = self._active.get(key, 0) + 1
+            task = asyncio.ensure_future(job())
+            task.add_done_callback(lambda task, key=key, future=future: self._finished(key, task, future))
+            future.add_done_callback(lambda future, task=task: task.cancel() if future.cancelled() else None)
+
+    def _finished(self, key: Any, task: asyncio.Task, future: asyncio.Future):
+        self.in_flight -= 1
+        self._active[key] -= 1
+        if self._active[key] == 0:
+            del self._active[key]
+        if not future.done():
+            if task.cancelled():
+                future.cancel()
+            elif task.exception() is not None:
+                future.set_exception(task.exception())
+            else:
+                future.set_result(task.result())
+        self._dispatch()
+
+
+@dataclass
+class ConcurrencyDecision(object):
+    """One evaluation of the connection budget by `AIMDController`."""
+
+    elapsed: float
+    """Seconds since the first measured part."""
+    limit: int
+    """Parts in flight allowed after this decision."""
+    throughput: float
+    """Bytes per second over the parts measured for this decision."""
+    error_rate: float
+    """Fraction of the parts measured for this decision that failed."""
+    reason: str
+    """improving, declining, steady, errors or stall."""
+
+
+class AIMDController(object):
+    """Tune a PartScheduler's budget from the throughput and errors actually observed in download_part.
+
+    After every round of parts (one part per slot) the throughput of that round is compared with the previous one:
+
+    - improving: another slot is added while the throughput grows by at least half of what one slot is worth
+    - declining: the last slot added is taken away again
+    - errors or stall: the budget is cut multiplicatively, at once; parts that had already started by then and fail
+      too, e.g. every part of an object whose signed url expired, are not counted against the smaller budget
+    """
+
+    def __init__(
+        self,
+        scheduler: PartScheduler,
+        minimum: int = 1,
+        maximum: int = DEFAULT_MAX_ADAPTIVE_DOWNLOADERS,
+        increase: int = 1,
+        decrease: float = 0.5,
+        stall_timeout: float = 60.0,
+    ):
+        """
+        Args:
+            scheduler: the scheduler whose budget is tuned, its current limit is the starting point
+            minimum: never fewer parts in flight than this
+            maximum: never more parts in flight than this
+            increase: slots added while throughput improves
+            decrease: factor applied to the budget on errors or stalls
+            stall_timeout: seconds without any part finishing before parts in flight count as stalled
+        """
+        self.scheduler = scheduler
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum)
+        self.increase = increase
+        self.decrease = decrease
+        self.stall_timeout = stall_timeout
+        self.decisions: List[ConcurrencyDecision] = []
+        self._start = None
+        self._previous_throughput = None
+        self._mean_part_seconds = None
+        self._stall_handle = None
+        self._decreased_at = None
+        self._reset_window(None)
+
+    @property
+    def limit(self) -> int:
+        return self.scheduler.limit
+
+    def _reset_window(self, now: Optional[float]):
+        self._window_start = now
+        self._bytes = 0
+        self._parts = 0
+        self._errors = 0
+
+    def record(self, nbytes: int, seconds: float, ok: bool):
+        """Measure a finished part.
+
+        Args:
+            nbytes: size of the part
+            seconds: time it took to download
+            ok: False if the part failed
+        """
+        now = time.monotonic()
+        if self._start is None:
+            self._start = now - seconds
+        if self._window_start is None:
+            self._window_start = now - seconds
+        self._mean_part_seconds = (
+            seconds if self._mean_part_seconds is None else 0.8 * self._mean_part_seconds + 0.2 * seconds
+        )
+        self._watch_for_stall()
+        if not ok and self._decreased_at is not None and now - seconds < self._decreased_at:
+            # started before the last cut and failing for the same reason, e.g. every part of an object whose signed
+            # url expired: the cut already accounts for it
+            return
+
+        self._parts += 1
+        if ok:
+            self._bytes += nbytes
+        else:
+            self._errors += 1
+
+        if not ok or self._parts >= max(self.limit, 4):
+            self._decide(now)
+
+    def _decide(self, now: float, stalled: bool = False):
+        window_start = now if self._window_start is None else self._window_start
+        seconds = max(now - window_start, 1e-6)
+        throughput = self._bytes / seconds
+        error_rate = self._errors / self._parts if self._parts else 0.0
+        limit = self.limit
+        # the gain expected from one more slot, only half of it is required to keep growing
+        step = 0.5 * self.increase / limit
+
+        if stalled:
+            reason = "stall"
+            new_limit = int(limit * self.decrease)
+        elif self._errors > 0:
+            reason = "errors"
+            new_limit = int(limit * self.decrease)
+        elif self._previous_throughput is None or throughput >= self._previous_throughput * (1 + step):
+            reason = "improving"
+            # more slots only help if parts are waiting for one
+            new_limit = limit + self.increase if self.scheduler.waiting > 0 else limit
+        elif throughput < self._previous_throughput * (1 - step):
+            reason = "declining"
+            new_limit = limit - self.increase
+        else:
+            reason = "steady"
+            new_limit = limit
+
+        new_limit = min(self.maximum, max(self.minimum, new_limit))
+        if reason in ("stall", "errors"):
+            self._decreased_at = now
+        decision = ConcurrencyDecision(
+            elapsed=0.0 if self._start is None else now - self._start,
+            limit=new_limit,
+            throughput=throughput,
+            error_rate=error_rate,
+            reason=reason,
+        )
+        self.decisions.append(decision)
+        if new_limit != limit:
+            file_logger.info(
+                f"downloaders={new_limit} ({reason}, was {limit}, {throughput / MB:.2f} MB/s, "
+                f"error rate {error_rate:.2f})"
+            )
+            self.scheduler.set_limits(new_limit)
+
+        if not stalled:
+            self._previous_throughput = throughput
+        self._reset_window(now)
+
+    def _watch_for_stall(self):
+        """(Re)arm a timer that fires if no part finishes for a while."""
+        if self._stall_handle is not None:
+            self._stall_handle.cancel()
+        timeout = max(self.stall_timeout, 4 * (self._mean_part_seconds or 0))
+        self._stall_handle = asyncio.get_running_loop().call_later(timeout, self._stalled)
+
+    def _stalled(self):
+        self._stall_handle = None
+        if self.scheduler.in_flight > 0:
+            self._decide(time.monotonic(), stalled=True)
+            self._watch_for_stall()
+
+    def close(self):
+        """Stop watching for stalls, call once no more parts will be recorded."""
+        if self._stall_handle is not None:
+            self._stall_handle.cancel()
+            self._stall_handle = None
+
+    def summary(self) -> str:
+        """One line description of the decisions taken, for comparing runs."""
+        if not self.decisions:
+            return f"downloaders={self.limit} (unchanged, fewer parts than one per slot finished)"
+        limits = [decision.limit for decision in self.decisions]
+        throughputs = [decision.throughput for decision in self.decisions]
+        return (
+            f"downloaders final={self.limit} mean={sum(limits) / len(limits):.1f} max={max(limits)} "
+            f"decisions={len(self.decisions)} mean throughput={sum(throughputs) / len(throughputs) / MB:.2f} MB/s"
+        )
+
+    def write_decisions(self, path: Path):
+        """Save every decision as a tsv file so the chosen concurrency can be compared across runs."""
+        with open(path, "w", newline="") as f:
+            writer = csv.writer(f, delimiter="\t")
+            writer.writerow([field.name for field in fields(ConcurrencyDecision)])
+            for decision in self.decisions:
+                writer.writerow(astuple(decision))
@@ -0,0 +1,65 @@
+"""Split a manifest between the tasks of an array job, e.g. Slurm `--array` or an indexed Kubernetes Job.
+
+Every task reads the whole manifest and keeps its own shard. The split only depends on the URIs and their sizes,
+never on the row order or on which task computes it, so every task agrees on it and a rerun sends each object to
+the same shard, where its parts from the previous attempt are.
+"""
+import hashlib
+import heapq
+import re
+from typing import Dict, List, Optional, Sequence, Tuple
+
+SHARD_BY = ["bytes", "hash"]
+"""How URIs are split: balanced by the sizes in the manifest where it has them, or by a hash of the URI alone."""
+
+
+def parse_shard(text: str) -> Tuple[int, int]:
+    """(index, count) from `i/N`, tasks are numbered from 0 to N - 1.
+
+    Raises:
+        ValueError: not of the form i/N with 0 <= i < N
+    """
+    match = re.fullmatch(r"\s*(\d+)\s*/\s*(\d+)\s*", text)
+    if match is None or int(match.group(2)) == 0 or int(match.group(1)) >= int(match.group(2)):
+        raise ValueError(f"'{text}' is not a shard, expected i/N with i from 0 to N - 1, e.g. 0/4")
+    return int(match.group(1)), int(match.group(2))
+
+
+def uri_hash(uri: str) -> int:
+    """A hash of the URI that is the same in every process, unlike `hash`."""
+    return int(hashlib.sha1(uri.encode()).hexdigest(), 16)
+
+
+def assign_shards(uris: Sequence[str], count: int, sizes: Optional[Dict[str, int]] = None) -> Dict[str, int]:
+    """The shard of every URI.
+
+    Without sizes a URI goes to its hash modulo the number of shards. With sizes the URIs are placed largest first
+    on the shard with the fewest bytes so far, so shards finish at about the same time; URIs without a size count
+    as the average of the known sizes. Ties are broken by hash and shard number, so the result is deterministic.
+
+    Args:
+        uris: DRS URIs, duplicates are placed once
+        count: number of shards
+        sizes: bytes of the objects known from the manifest
+    """
+    unique = set(uris)
+    known = {uri: sizes[uri] for uri in unique if sizes and sizes.get(uri) is not None}
+    if not known:
+        return {uri: uri_hash(uri) % count for uri in unique}
+
+    average = sum(known.values()) // len(known)
+    bins = [(0, shard) for shard in range(count)]
+    assignment = {}
+    for uri in sorted(unique, key=lambda uri: (-known.get(uri, average), uri_hash(uri), uri)):
+        total, shard = heapq.heappop(bins)
+        assignment[uri] = shard
+        heapq.heappush(bins, (total + known.get(uri, average), shard))
+    return assignment
+
+
+def select_shard(
+    uris: Sequence[str], index: int, count: int, sizes: Optional[Dict[str, int]] = None
+) -> List[str]:
+    """The URIs of one shard, in manifest order."""
+    assignment = assign_shards(uris, count, sizes)
+    return [uri for uri in uris if assignment[uri] == index]
@@ -0,0 +1,36 @@
+"""When a signed url stops working, read from the url itself.
+
+- GCS V4 and S3 SigV4 (e.g. Gen3 fence): X-Goog-Date / X-Amz-Date, the signing time, plus X-Goog-Expires /
+  X-Amz-Expires, its lifetime in seconds.
+- GCS V2 and S3 SigV2: Expires, the expiry in seconds since the epoch.
+"""
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+from urllib.parse import parse_qsl, urlsplit
+
+from drs_downloader.models import AccessMethod
+
+SIGNING_TIME_FORMAT = "%Y%m%dT%H%M%SZ"
+
+
+def url_expiry(url: str) -> Optional[datetime]:
+    """Expiry of a signed url in UTC, None if the url does not say."""
+    query = {key.lower(): value for key, value in parse_qsl(urlsplit(url).query)}
+    try:
+        for prefix in ["x-goog-", "x-amz-"]:
+            if f"{prefix}date" in query and f"{prefix}expires" in query:
+                signed = datetime.strptime(query[f"{prefix}date"], SIGNING_TIME_FORMAT).replace(tzinfo=timezone.utc)
+                return signed + timedelta(seconds=int(query[f"{prefix}expires"]))
+        if "expires" in query:
+            return datetime.fromtimestamp(int(query["expires"]), tz=timezone.utc)
+    except (ValueError, OverflowError):
+        pass
+    return None
+
+
+def expires_within(access_method: AccessMethod, seconds: float, now: Optional[datetime] = None) -> bool:
+    """True if the url stops working in less than `seconds`, False if its expiry is unknown."""
+    if access_method.expires is None:
+        return False
+    now = now or datetime.now(timezone.utc)
+    return access_method.expires - now < timedelta(seconds=seconds)
@@ -0,0 +1,221 @@
+"""Spread the downloads of one run across worker processes, each with its own event loop.
+
+The parent resolves the manifest, splits the objects into shards of about the same number of bytes and starts one
+process per shard; objects with the same bytes go to the same shard, so they are still downloaded only once. Workers
+send an event for every object they finish, so the parent shows a single progress bar, and send the outcome of every
+object and what deduplication and the cache saved at the end so the parent can report on the whole run.
+"""
+import heapq
+import logging
+import multiprocessing
+import queue
+import sys
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import tqdm
+
+from drs_downloader.dedup import content_key
+from drs_downloader.disk import DiskSpace
+from drs_downloader.journal import install_signal_handlers
+from drs_downloader.leases import LeaseBoard
+from drs_downloader.manager import DrsAsyncManager
+from drs_downloader.models import DrsClient, DrsObject, ObjectState
+
+logger = logging.getLogger()
+file_logger = logging.getLogger("file_logger")
+
+ClientFactory = Callable[[], DrsClient]
+
+
+def balance(items: Sequence[Tuple[int, DrsObject]], shards: int) -> List[List[Tuple[int, DrsObject]]]:
+    """Split objects into shards with about the same number of bytes, largest objects placed first.
+
+    Objects with the same content key are placed together, as one group weighing the bytes of one of them: only one
+    of them is downloaded, the others are made from its file.
+
+    Args:
+        items: (manifest index, object)
+        shards: number of shards
+
+    Returns:
+        the shards, each in manifest order
+    """
+    groups: Dict[Any, List[Tuple[int, DrsObject]]] = {}
+    for item in items:
+        key = content_key(item[1])
+        groups.setdefault(key if key is not None else ("index", item[0]), []).append(item)
+
+    bins = [(0, shard, []) for shard in range(max(1, shards))]
+    for group in sorted(groups.values(), key=lambda group: -group[0][1].size):
+        total, shard, members = heapq.heappop(bins)
+        members.extend(group)
+        heapq.heappush(bins, (total + group[0][1].size, shard, members))
+    return [sorted(members, key=lambda item: item[0]) for _, _, members in sorted(bins, key=lambda b: b[1])]
+
+
+def _run_worker(
+    worker_id: int,
+    client_factory: ClientFactory,
+    items: List[Tuple[int, DrsObject]],
+    destination_path: Path,
+    user_project: Optional[str],
+    duplicate: bool,
+    verbose: bool,
+    manager_options: Dict[str, Any],
+    disk_share: float,
+    lease_options: Optional[Dict[str, Any]],
+    events: multiprocessing.Queue,
+):
+    """Entry point of a worker process, downloads its shard on its own event loop."""
+    install_signal_handlers()
+    drs_client = client_factory()
+    drs_manager = DrsAsyncManager(
+        drs_client, show_progress=False, disk_space=DiskSpace(share=disk_share),
+        leases=LeaseBoard(**lease_options) if lease_options is not None else None, **manager_options
+    )
+    drs_objects = [drs_object for _, drs_object in items]
+
+    def _on_finished(drs_object: DrsObject):
+        events.put(("finished", worker_id, drs_object.name))
+
+    handled = drs_manager.run(
+        drs_manager.download_async(
+            drs_objects, destination_path, user_project=user_project, duplicate=duplicate, verbose=verbose,
+            on_finished=_on_finished,
+        )
+    )
+    # with leases, objects done or claimed by another instance are left out
+    handled = set(map(id, handled))
+    outcomes = [
+        (index, drs_object.state, drs_object.errors, drs_object.failures, drs_object.file_parts, drs_object.path)
+        for index, drs_object in items if id(drs_object) in handled
+    ]
+    saved = {
+        name: (counter.objects, counter.bytes)
+        for name, counter in [("deduplicator", drs_manager.deduplicator), ("cache", drs_manager.cache)]
+        if counter is not None
+    }
+    events.put(("done", worker_id, outcomes, drs_client.statistics.max_files_open, saved))
+
+
+def download_with_workers(
+    drs_manager: DrsAsyncManager,
+    client_factory: ClientFactory,
+    drs_objects: List[DrsObject],
+    destination_path: Path,
+    user_project: Optional[str],
+    duplicate: bool,
+    verbose: bool,
+    workers: int,
+    leases: Optional[LeaseBoard] = None,
+) -> List[DrsObject]:
+    """Download resolved objects with worker processes, results are merged back into drs_objects.
+
+    Workers inherit the settings of drs_manager, after `optimize_workload`. The connection budget, the bandwidth
+    cap and the free disk space are split evenly between them. What their deduplication and cache saved is added to
+    drs_manager's.
+
+    Args:
+        drs_manager: the parent's manager, its settings are passed to every worker
+        client_factory: builds a client in each worker, must be picklable e.g. functools.partial(TerraDrsClient)
+        drs_objects: resolved objects, objects with errors are not downloaded
+        workers: number of worker processes
+        leases: every worker claims objects through a board on the same work directory
+
+    Returns:
+        drs_objects, with the errors and file parts of each download; with leases only the objects this instance
+        worked on
+    """
+    items = [(index, drs_object) for index, drs_object in enumerate(drs_objects) if len(drs_object.errors) == 0]
+    shards = [shard for shard in balance(items, workers) if shard]
+    if not shards:
+        return drs_objects
+
+    manager_options = drs_manager.share_settings(len(shards))
+    lease_options = dict(work_dir=leases.work_dir, ttl=leases.ttl) if leases is not None else None
+    file_logger.info(f"Downloading {len(items)} objects with {len(shards)} worker processes")
+    if verbose:
+        logger.info(f"Downloading {len(items)} objects with {len(shards)} worker processes")
+
+    # spawn, so workers do not inherit the parent's event loop, sessions or locks
+    context = multiprocessing.get_context("spawn")
+    events = context.Queue()
+    processes = {}
+    for worker_id, shard in enumerate(shards):
+        process = context.Process(
+            target=_run_worker,
+            args=(
+                worker_id, client_factory, shard, destination_path, user_project, duplicate, verbose,
+                manager_options, 1 / len(shards), lease_options, events,
+            ),
+            daemon=True,
+        )
+        process.start()
+        processes[worker_id] = process
+
+    progress = tqdm.tqdm(
+        total=len(items), desc="TOTAL_DOWNLOAD_PROGRESS", file=sys.stdout, leave=False, disable=drs_manager.disable
+    )
+    pending = set(processes)
+    handled = set()
+    statistics = drs_manager._drs_client.statistics
+
+    def _handle(event):
+        if event[0] == "finished":
+            progress.update(1)
+            file_logger.info(str(progress))
+        elif event[0] == "done":
+            _, worker_id, outcomes, max_files_open, saved = event
+            pending.discard(worker_id)
+            for index, state, errors, failures, file_parts, path in outcomes:
+                handled.add(index)
+                drs_objects[index].state = state
+                drs_objects[index].errors = errors
+                drs_objects[index].failures = failures
+                drs_objects[index].file_parts = file_parts
+                drs_objects[index].path = path
+            statistics.max_files_open = max(statistics.max_files_open, max_files_open)
+            for name, (objects, saved_bytes) in saved.items():
+                counter = getattr(drs_manager, name)
+                counter.objects += objects
+                counter.bytes += saved_bytes
+
+    try:
+        while pending:
+            try:
+                _handle(events.get(timeout=0.5))
+                continue
+            except queue.Empty:
+                pass
+
+            dead = [worker_id for worker_id in pending if not processes[worker_id].is_alive()]
+            if not dead:
+                continue
+            # a worker may have reported just before exiting
+            while True:
+                try:
+                    _handle(events.get(timeout=0.1))
+                except queue.Empty:
+                    break
+            for worker_id in dead:
+                if worker_id in pending:
+                    # exited without reporting, e.g. killed or crashed
+                    pending.discard(worker_id)
+                    exitcode = processes[worker_id].exitcode
+                    for index, drs_object in shards[worker_id]:
+                        handled.add(index)
+                        drs_object.fail("download_part", f"Worker process exited with code {exitcode}")
+                        drs_object.state = ObjectState.FAILED
+    finally:
+        progress.close()
+        for process in processes.values():
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+
+    if leases is not None:
+        return [
+            drs_object for index, drs_object in enumerate(drs_objects) if index in handled or drs_object.errors
+        ]
+    return drs_objects
@@ -0,0 +1,415 @@
+"""Where `download_part` writes the bytes of a part.
+
+- parts: every part is its own `{name}.{start}.{end}.part` file, stitched into the destination file once all of
+  them are on disk.
+- preallocate: the whole object is allocated up front as `{name}.download` and every part is written at its
+  offset, so nothing is stitched and every byte is written once. The file is renamed to its final name once every
+  part is in.
+
+Either way the bytes received are collected in pooled buffers and written a full buffer at a time by one thread,
+see `buffers`, and the parts on disk are recorded in the object's journal, see `journal`, which is what an interrupted
+download resumes from.
+
+Stitching copies each part into the destination file in the kernel where it can, with `copy_file_range` (which
+shares the blocks instead of copying them on filesystems with reflinks, e.g. XFS or btrfs, where the offsets are
+block aligned) or else `sendfile`, and through a buffer where neither is supported.
+"""
+import asyncio
+import errno
+import os
+import shutil
+import threading
+import zlib
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+from drs_downloader.buffers import DISK_WRITER, POOL
+from drs_downloader.journal import Journal
+from drs_downloader.parts import existing_part_size, part_size_of
+
+WRITERS = ["parts", "preallocate"]
+
+# flushes the file's data, not necessarily its metadata, where the platform can
+_datasync = getattr(os, "fdatasync", os.fsync)
+
+
+class PartSink(ABC):
+    """One part being written, `path` is what `download_part` returns once the part is complete."""
+
+    path: Path
+
+    @abstractmethod
+    async def write(self, data: bytes):
+        pass
+
+    @abstractmethod
+    async def close(self):
+        """The part is complete."""
+        pass
+
+
+class PartWriter(ABC):
+    """How the parts of an object are laid out on disk, and the journal of the parts already there."""
+
+    name: str
+    in_place: bool
+    """True if parts are written into the object's file, there is nothing to stitch."""
+
+    def __init__(self):
+        self._journals: Dict[Path, Journal] = {}
+
+    @staticmethod
+    def journal_path(name: str, destination_path: Path) -> Path:
+        return destination_path / f"{name}.journal"
+
+    def _saved_journal(self, name: str, object_size: int, destination_path: Path) -> Optional[Journal]:
+        return Journal.load(self.journal_path(name, destination_path), object_size)
+
+    def journal(self, name: str, destination_path: Path) -> Optional[Journal]:
+        """The journal of an object between `prepare` and `close`, None for a part written outside a download."""
+        return self._journals.get(self.journal_path(name, destination_path))
+
+    def existing_part_size(
+        self, name: str, object_size: int, destination_path: Path, parts: Optional[List[Tuple[int, int]]] = None
+    ) -> Optional[int]:
+        """Part size of an interrupted download of the object, None if there is none.
+
+        Args:
+            parts: first and last byte of the object's `.part` files from a listing of destination_path, which is
+                listed again without it
+        """
+        journal = self._saved_journal(name, object_size, destination_path)
+        return journal.part_size if journal is not None else None
+
+    def prepare(self, name: str, object_size: int, destination_path: Path, part_size: int) -> Journal:
+        """Get ready to write the object's parts.
+
+        Returns:
+            the journal of the parts already on disk, `resumed` is False if the download starts over
+        """
+        journal = self._saved_journal(name, object_size, destination_path)
+        if journal is None or journal.part_size != part_size:
+            journal = Journal(self.journal_path(name, destination_path), object_size, part_size)
+            journal.flush()
+        self._journals[journal.path] = journal
+        return journal
+
+    @abstractmethod
+    async def open(self, name: str, start: int, size: int, destination_path: Path) -> PartSink:
+        """Open the part of the object `name` from byte `start` to byte `size`, inclusive."""
+        pass
+
+    def close(self, name: str, destination_path: Path):
+        """Stop writing the object, its journal is saved for the next attempt."""
+        journal = self._journals.pop(self.journal_path(name, destination_path), None)
+        if journal is not None:
+            journal.close()
+
+    def finish(self, name: str, destination_path: Path, filename: str) -> Path:
+        """Every part is on disk, the object's bytes are to end up in `filename`."""
+        return destination_path / filename
+
+    def done(self, name: str, destination_path: Path):
+        """The object is verified, or given up on: drop its journal."""
+        journal = self._journals.pop(self.journal_path(name, destination_path), None)
+        if journal is not None:
+            journal.remove()
+        else:
+            self.journal_path(name, destination_path).unlink(missing_ok=True)
+
+
+async def _record(journal: Optional[Journal], start: int, size: int, crc: int):
+    if journal is None:
+        return
+    journal.add_part(start, size, crc)
+    # saved now unless it was saved a moment ago, the rest is saved when the object stops or on a signal
+    await asyncio.to_thread(journal.flush, False)
+
+
+def _pwrite(fd: int, data: bytes, offset: int, lock: threading.Lock) -> int:
+    if hasattr(os, "pwrite"):
+        return os.pwrite(fd, data, offset)
+    # no positional writes on this platform, seek and write may not be interleaved
+    with lock:
+        os.lseek(fd, offset, os.SEEK_SET)
+        return os.write(fd, data)
+
+
+def _write_buffer(fd: int, buffer, length: int, offset: int, lock: threading.Lock):
+    """On the disk writer thread: write the first length bytes of a pooled buffer at offset, then return it."""
+    try:
+        with memoryview(buffer) as view:
+            written = 0
+            while written < length:
+                written += _pwrite(fd, view[written:length], offset + written, lock)
+    finally:
+        POOL.release(buffer)
+
+
+class _Buffered(PartSink):
+    """A part received into pooled buffers, each written by the disk writer thread once full, see `buffers`.
+
+    One buffer is written while the next fills, a part never holds more than two.
+    """
+
+    def __init__(self, path: Path, fd: int, offset: int, start: int, size: int, journal: Optional[Journal],
+                 lock: threading.Lock):
+        self.path = path
+        self._fd = fd
+        self._offset = offset
+        self._start = start
+        self._size = size
+        self._journal = journal
+        self._lock = lock
+        self._crc = 0
+        self._buffer = None
+        self._filled = 0
+        self._limit = 0
+        self._writing: Optional[asyncio.Future] = None
+
+    async def write(self, data: bytes):
+        self._crc = zlib.crc32(data, self._crc)
+        view = memoryview(data)
+        while view:
+            if self._buffer is None:
+                self._buffer = POOL.acquire()
+                self._filled = 0
+                # the first buffer ends on a multiple of the buffer size in the file, the writes after it are aligned
+                self._limit = POOL.buffer_size - self._offset % POOL.buffer_size
+            n = min(len(view), self._limit - self._filled)
+            self._buffer[self._filled:self._filled + n] = view[:n]
+            self._filled += n
+            view = view[n:]
+            if self._filled == self._limit:
+                await self._flush()
+
+    async def _flush(self):
+        if self._writing is not None:
+            await self._writing
+        buffer, length, offset = self._buffer, self._filled, self._offset
+        self._buffer, self._filled = None, 0
+        self._offset += length
+        self._writing = asyncio.wrap_future(
+            DISK_WRITER.submit(_write_buffer, self._fd, buffer, length, offset, self._lock)
+        )
+
+    async def _written(self):
+        """Every byte received is in the file."""
+        if self._filled:
+            await self._flush()
+        elif self._buffer is not None:
+            POOL.release(self._buffer)
+            self._buffer = None
+        if self._writing is not None:
+            await self._writing
+
+
+class _PartFile(_Buffered):
+    def __init__(self, path: Path, fd: int, journal: Optional[Journal], start: int, size: int):
+        super().__init__(path, fd, 0, start, size, journal, threading.Lock())
+        self._closed = False
+
+    async def close(self):
+        await self._written()
+        # the journal never lists bytes that could still be lost
+        await asyncio.to_thread(_datasync, self._fd)
+        self._closed = True
+        os.close(self._fd)
+        await _record(self._journal, self._start, self._size, self._crc)
+
+    def __del__(self):
+        if not self._closed:
+            # left by a failed download, closed once the writes already submitted are done
+            DISK_WRITER.submit(os.close, self._fd)
+
+
+class PartFiles(PartWriter):
+    """Every part in its own file, stitched once the object is complete."""
+
+    name = "parts"
+    in_place = False
+
+    @staticmethod
+    def part_path(name: str, start: int, size: int, destination_path: Path) -> Path:
+        return destination_path / f"{name}.{start}.{size}.part"
+
+    def existing_part_size(
+        self, name: str, object_size: int, destination_path: Path, parts: Optional[List[Tuple[int, int]]] = None
+    ) -> Optional[int]:
+        part_size = super().existing_part_size(name, object_size, destination_path)
+        if part_size is None:
+            # parts left by a version without journals are found by their names
+            if parts is not None:
+                part_size = part_size_of(parts, object_size)
+            else:
+                part_size = existing_part_size(name, destination_path, object_size)
+        return part_size
+
+    async def open(self, name: str, start: int, size: int, destination_path: Path) -> PartSink:
+        path = self.part_path(name, start, size, destination_path)
+        journal = self.journal(name, destination_path)
+        fd = await asyncio.to_thread(os.open, path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        return _PartFile(path, fd, journal, start, size)
+
+
+# the call is not available for these files or on this kernel, the next way of copying is tried
+_UNSUPPORTED = {errno.ENOSYS, errno.EXDEV, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTSUP, errno.EPERM}
+
+
+def _copy_file_range(source: int, destination: int, count: int, source_offset: int, destination_offset: int) -> int:
+    return os.copy_file_range(source, destination, count, source_offset, destination_offset)
+
+
+def _sendfile(source: int, destination: int, count: int, source_offset: int, destination_offset: int) -> int:
+    os.lseek(destination, destination_offset, os.SEEK_SET)
+    return os.sendfile(destination, source, source_offset, count)
+
+
+def _buffered(source: int, destination: int, count: int, source_offset: int, destination_offset: int) -> int:
+    os.lseek(source, source_offset, os.SEEK_SET)
+    buffer = os.read(source, min(count, 10 * 1024 * 1024))
+    os.lseek(destination, destination_offset, os.SEEK_SET)
+    return os.write(destination, buffer)
+
+
+COPIES: List[Tuple[str, Callable[[int, int, int, int, int], int]]] = [
+    (name, copy)
+    for name, copy, available in [
+        ("copy_file_range", _copy_file_range, hasattr(os, "copy_file_range")),
+        ("sendfile", _sendfile, hasattr(os, "sendfile")),
+        ("buffered", _buffered, True),
+    ]
+    if available
+]
+"""Ways of copying between files, fastest first."""
+
+
+def copy_into(source: Path, destination: int, offset: int, copies=None) -> Tuple[int, str]:
+    """Copy a whole file into the open file `destination` at `offset`.
+
+    Returns:
+        bytes copied, how they were copied
+    """
+    copies = COPIES if copies is None else copies
+    with open(source, "rb") as f:
+        count = os.fstat(f.fileno()).st_size
+        copied = 0
+        for name, copy in copies:
+            try:
+                while copied < count:
+                    n = copy(f.fileno(), destination, count - copied, copied, offset + copied)
+                    if n == 0:
+                        break
+                    copied += n
+                return copied, name
+            except OSError as e:
+                if e.errno not in _UNSUPPORTED or name == copies[-1][0]:
+                    raise
+
+
+def publish(source: Path, destination: Path) -> str:
+    """Move a complete file to its destination, a rename on the same filesystem.
+
+    Across filesystems it is copied under a temporary name and renamed, so the destination never holds half a file,
+    then the source is removed.
+
+    Returns:
+        rename or copy
+    """
+    try:
+        os.replace(source, destination)
+        return "rename"
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+    temporary = destination.with_name(f"{destination.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        # copy_file_range or sendfile where the platform has them
+        shutil.copyfile(source, temporary)
+        os.replace(temporary, destination)
+    except BaseException:
+        temporary.unlink(missing_ok=True)
+        raise
+    source.unlink()
+    return "copy"
+
+
+class _Range(_Buffered):
+    def __init__(
+        self, path: Path, fd: int, start: int, size: int, journal: Optional[Journal], lock: threading.Lock
+    ):
+        super().__init__(path, fd, start, start, size, journal, lock)
+
+    async def close(self):
+        await self._written()
+        # the journal never lists bytes that could still be lost
+        await asyncio.to_thread(_datasync, self._fd)
+        await _record(self._journal, self._start, self._size, self._crc)
+
+
+class PreallocatedFile(PartWriter):
+    """Parts written at their offset in a file allocated up front."""
+
+    name = "preallocate"
+    in_place = True
+
+    def __init__(self):
+        super().__init__()
+        self._files: Dict[Path, Tuple[int, threading.Lock]] = {}
+
+    @staticmethod
+    def download_path(name: str, destination_path: Path) -> Path:
+        return destination_path / f"{name}.download"
+
+    def _saved_journal(self, name: str, object_size: int, destination_path: Path) -> Optional[Journal]:
+        if not self.download_path(name, destination_path).exists():
+            return None
+        return super()._saved_journal(name, object_size, destination_path)
+
+    def prepare(self, name: str, object_size: int, destination_path: Path, part_size: int) -> Journal:
+        """Allocate the object's file, or reopen it after an interruption."""
+        journal = super().prepare(name, object_size, destination_path, part_size)
+        path = self.download_path(name, destination_path)
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        if os.fstat(fd).st_size != object_size:
+            os.ftruncate(fd, object_size)
+        if hasattr(os, "posix_fallocate") and object_size > 0:
+            try:
+                # reserve the blocks now, the disk cannot fill up halfway through the object
+                os.posix_fallocate(fd, 0, object_size)
+            except OSError:
+                pass
+        self._files[path] = (fd, threading.Lock())
+        return journal
+
+    async def open(self, name: str, start: int, size: int, destination_path: Path) -> PartSink:
+        path = self.download_path(name, destination_path)
+        fd, lock = self._files[path]
+        return _Range(path, fd, start, size, self.journal(name, destination_path), lock)
+
+    def close(self, name: str, destination_path: Path):
+        """Close the object's file, its journal stays until `finish`."""
+        entry = self._files.pop(self.download_path(name, destination_path), None)
+        if entry is not None:
+            # after the writes of parts that failed halfway, which may still be queued
+            DISK_WRITER.submit(os.close, entry[0])
+        super().close(name, destination_path)
+
+    def finish(self, name: str, destination_path: Path, filename: str) -> Path:
+        """Every part is in: give the file its final name."""
+        entry = self._files.pop(self.download_path(name, destination_path), None)
+        if entry is not None:
+            os.close(entry[0])
+        final = destination_path / filename
+        os.replace(self.download_path(name, destination_path), final)
+        return super().finish(name, destination_path, filename)
+
+
+def make_writer(name: str) -> PartWriter:
+    """Writer for a name given on the command line."""
+    if name == "preallocate":
+        return PreallocatedFile()
+    if name == "parts":
+        return PartFiles()
+    raise ValueError(f"Unknown writer '{name}', expected one of {WRITERS}")
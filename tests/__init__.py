@@ -1,7 +1,56 @@
+import asyncio
+import hashlib
 from pathlib import Path
+from typing import Dict, Optional
+
+from drs_downloader.models import AccessMethod, Checksum, DrsClient, DrsObject
 
 FIXTURES = "tests/fixtures"
 MANIFESTS = Path(FIXTURES)
 PARTS = Path(FIXTURES, "parts")
 INTERRUPTED_DOWNLOAD = Path(FIXTURES, "interrupted_download")
 COMPLETE_DOWNLOAD = Path(FIXTURES, "complete_download")
+
+
+class FakeDrsClient(DrsClient):
+    """Serve objects from memory with configurable latency, records the order of calls."""
+
+    def __init__(self, contents: Dict[str, bytes], latency: float = 0.0, slow: Dict[str, float] = None, **kwargs):
+        super().__init__(**kwargs)
+        self.contents = contents
+        self.latency = latency
+        self.slow = slow or {}
+        self.events = []
+
+    async def _wait(self, object_id: str):
+        await asyncio.sleep(self.slow.get(object_id, self.latency))
+
+    async def get_object(self, object_id: str, verbose: bool = False) -> DrsObject:
+        await self._wait(object_id)
+        self.events.append(("get_object", object_id))
+        data = self.contents[object_id]
+        return DrsObject(
+            self_uri=object_id,
+            id=object_id,
+            checksums=[Checksum(hashlib.md5(data).hexdigest(), "md5")],
+            size=len(data),
+            name=object_id.split("/")[-1],
+        )
+
+    async def sign_url(self, drs_object: DrsObject, user_project: str = None, verbose: bool = False) -> DrsObject:
+        await self._wait(drs_object.id)
+        self.events.append(("sign_url", drs_object.id))
+        drs_object.access_methods = [AccessMethod(access_url=f"https://example.org/{drs_object.name}", type="https")]
+        return drs_object
+
+    async def download_part(
+        self, drs_object: DrsObject, start: int, size: int, destination_path: Path, verbose: bool = False
+    ) -> Optional[Path]:
+        await self._wait(drs_object.id)
+        self.events.append(("download_part", drs_object.id))
+        data = self.contents[drs_object.id][start:size + 1]
+        await self.throttle(drs_object, len(data))
+        file = await self.open_part(drs_object, start, size, destination_path)
+        await file.write(data)
+        await file.close()
+        return file.path
@@ -0,0 +1,47 @@
+import asyncio
+import time
+
+import pytest
+
+from drs_downloader import KB, MB
+from drs_downloader.bandwidth import BandwidthLimiter, parse_rate
+
+
+def test_parse_rate():
+    assert parse_rate("1000") == 1000
+    assert parse_rate("50MB") == 50 * MB
+    assert parse_rate("512k") == 512 * KB
+    assert parse_rate("1.5GB/s") == int(1.5 * 1024 * MB)
+    with pytest.raises(ValueError):
+        parse_rate("fast")
+
+
+async def _stream(limiter, key, chunks, chunk_size=16 * KB):
+    for _ in range(chunks):
+        await limiter.acquire(key, chunk_size)
+
+
+def test_cap_is_shared_fairly_and_spare_capacity_is_used():
+    rate = 2 * MB
+
+    async def main():
+        limiter = BandwidthLimiter(rate)
+        start = time.monotonic()
+        # "short" stops early, the others take over its share
+        streams = [_stream(limiter, key, 1000) for key in ["a", "b", "c"]] + [_stream(limiter, "short", 4)]
+        tasks = [asyncio.ensure_future(stream) for stream in streams]
+        await asyncio.sleep(0.5)
+        elapsed = time.monotonic() - start
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        return limiter, elapsed
+
+    limiter, elapsed = asyncio.run(main())
+    total = sum(limiter.granted.values())
+    assert total <= rate * elapsed + limiter.burst + 16 * KB
+    assert total >= rate * elapsed * 0.8
+    assert limiter.granted["short"] == 4 * 16 * KB
+    long_streams = [limiter.granted[key] for key in ["a", "b", "c"]]
+    # the first stream may take the initial burst on its own, after that the streams take turns
+    assert max(long_streams) - min(long_streams) <= limiter.burst + 2 * limiter.quantum
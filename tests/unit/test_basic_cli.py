@@ -80,3 +80,24 @@ def test_mock_bad_id(caplog):
         assert len([msg for msg in caplog.messages if 'ERROR' in msg]) > 0, caplog.records
         # leave test manifest in place if an error
         os.unlink(tsv_file.name)
+
+
+def test_mock_streamed_shards_match_loaded_shards():
+    """A streamed task must get the same files as a loaded one, so --stream only shards by hash when asked to."""
+    tsv_file = manifest_all_ok(10)
+    downloaded = {}
+    runner = CliRunner()
+    for stream in [[], ["--stream"]]:
+        with tempfile.TemporaryDirectory() as dest:
+            arguments = ["mock", "-d", dest, "--manifest-path", tsv_file.name, "--shard", "1/3", "--shard-by", "hash"]
+            result = runner.invoke(cli, arguments + stream)
+            assert result.exit_code == 0
+            downloaded[bool(stream)] = sorted(os.listdir(dest))
+    assert downloaded[False] and downloaded[True] == downloaded[False]
+
+    with tempfile.TemporaryDirectory() as dest:
+        arguments = ["mock", "-d", dest, "--manifest-path", tsv_file.name, "--shard", "1/3", "--stream"]
+        result = runner.invoke(cli, arguments)
+        assert result.exit_code == 1
+        assert not os.listdir(dest)
+    os.unlink(tsv_file.name)
@@ -0,0 +1,51 @@
+import asyncio
+import os
+import zlib
+
+from drs_downloader import MB
+from drs_downloader.buffers import POOL, BufferPool, DiskWriter
+from drs_downloader.writers import PartFiles, PreallocatedFile
+
+
+def test_pool_reuses_released_buffers():
+    pool = BufferPool(buffer_size=4096, max_idle=1)
+    first, second = pool.acquire(), pool.acquire()
+    assert len(first) == 4096 and first is not second
+    pool.release(first)
+    pool.release(second)
+    assert pool.acquire() is first
+
+
+def test_disk_writer_runs_writes_in_order():
+    writer = DiskWriter()
+    done = []
+    futures = [writer.submit(done.append, i) for i in range(100)]
+    futures[-1].result(timeout=5)
+    assert done == list(range(100))
+
+
+async def _receive(writer, name, start, data, destination_path):
+    sink = await writer.open(name, start, start + len(data) - 1, destination_path)
+    for i in range(0, len(data), 3000):
+        await sink.write(data[i:i + 3000])
+    await sink.close()
+    return sink.path
+
+
+def test_small_chunks_are_written_in_full_buffers(tmp_path):
+    # a part starting off a buffer boundary and spanning several buffers, received in 3 KB chunks
+    start = POOL.buffer_size // 2 + 1
+    data = os.urandom(2 * MB + 12345)
+    size = start + len(data)
+
+    writer = PreallocatedFile()
+    journal = writer.prepare("in-place", size, tmp_path, size)
+    path = asyncio.run(_receive(writer, "in-place", start, data, tmp_path))
+    writer.close("in-place", tmp_path)
+    assert path.read_bytes()[start:] == data
+    assert journal.crcs[start] == zlib.crc32(data)
+
+    writer = PartFiles()
+    writer.prepare("parts", size, tmp_path, size)
+    path = asyncio.run(_receive(writer, "parts", start, data, tmp_path))
+    assert path.read_bytes() == data
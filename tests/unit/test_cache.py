@@ -0,0 +1,73 @@
+import hashlib
+import os
+from pathlib import Path
+
+from drs_downloader.cache import ContentCache
+from drs_downloader.manager import DrsAsyncManager
+from drs_downloader.models import Checksum, DrsObject, ObjectState
+from tests import FakeDrsClient
+
+
+def _object(name: str, data: bytes) -> DrsObject:
+    return DrsObject(
+        self_uri=f"drs://fake/{name}", id=f"drs://fake/{name}", size=len(data), name=name,
+        checksums=[Checksum(hashlib.md5(data).hexdigest(), "md5")],
+    )
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = ContentCache(tmp_path / "cache", max_size=250)
+    objects = []
+    for name in ["a", "b", "c"]:
+        path = tmp_path / name
+        path.write_bytes(os.urandom(100))
+        objects.append((_object(name, path.read_bytes()), path))
+    cache.add(*objects[0])
+    cache.add(*objects[1])
+    # a was used since, b is the least recently used
+    os.utime(cache.entry_path(objects[1][0]), ns=(0, 0))
+    assert cache.fetch(objects[0][0], tmp_path / "a.copy") is not None
+    cache.add(*objects[2])
+
+    assert cache.fetch(objects[1][0], tmp_path / "b.copy") is None
+    assert (tmp_path / "a.copy").read_bytes() == objects[0][1].read_bytes()
+    assert cache.entry_path(objects[2][0]).exists()
+    assert not [path for path in (tmp_path / "cache").rglob("*.tmp")]
+
+
+def test_cached_objects_are_not_signed_or_downloaded(tmp_path):
+    contents = {f"drs://fake/file-{i}.txt": os.urandom(1000) for i in range(2)}
+
+    def _download(client, destination):
+        manager = DrsAsyncManager(client, show_progress=False, cache=ContentCache(tmp_path / "cache"))
+        return manager.run(
+            manager.resolve_and_download(list(contents), destination, user_project=None, duplicate=False,
+                                         verbose=False)
+        )
+
+    (tmp_path / "first").mkdir()
+    (tmp_path / "second").mkdir()
+    _download(FakeDrsClient(contents), tmp_path / "first")
+
+    client = FakeDrsClient(contents)
+    drs_objects = _download(client, tmp_path / "second")
+    assert all(drs_object.state == ObjectState.DONE for drs_object in drs_objects)
+    assert [event for event, _ in client.events] == ["get_object", "get_object"]
+    for object_id, data in contents.items():
+        assert Path(tmp_path / "second" / object_id.split("/")[-1]).read_bytes() == data
+
+
+def test_cache_is_walked_only_when_it_outgrows_its_limit(tmp_path, monkeypatch):
+    cache = ContentCache(tmp_path / "cache", max_size=1000)
+    walks = []
+    entries = cache._entries
+    monkeypatch.setattr(cache, "_entries", lambda: walks.append(1) or entries())
+    for i in range(12):
+        path = tmp_path / f"{i}"
+        path.write_bytes(os.urandom(100))
+        cache.add(_object(f"{i}", path.read_bytes()), path)
+
+    # once when the first entry is added, once when the eleventh goes past the limit
+    assert len(walks) == 2
+    # evicted down to 900 bytes, the twelfth entry fits without a walk
+    assert sum(1 for path in (tmp_path / "cache").rglob("*") if path.is_file() and path.name != ".lock") == 10
@@ -0,0 +1,87 @@
+import hashlib
+import os
+from pathlib import Path
+
+from drs_downloader.catalog import Catalog
+from drs_downloader.manager import DrsAsyncManager
+from drs_downloader.models import Checksum, DrsObject, ObjectState
+from tests import FakeDrsClient
+
+
+def _object(path: Path) -> DrsObject:
+    data = path.read_bytes()
+    return DrsObject(
+        self_uri=f"drs://fake/{path.name}", id=path.name, checksums=[Checksum(hashlib.md5(data).hexdigest(), "md5")],
+        size=len(data), name=path.name,
+    )
+
+
+def test_changed_files_are_forgotten(tmp_path):
+    catalog = Catalog(tmp_path / "catalog.sqlite")
+    path = tmp_path / "a.txt"
+    path.write_bytes(b"x" * 100)
+    catalog.record(_object(path), path)
+
+    assert catalog.completed("drs://fake/a.txt", tmp_path).path == str(path.resolve())
+    assert catalog.completed("drs://fake/a.txt", tmp_path / "elsewhere") is None
+
+    # same bytes, but not the file that was cataloged
+    os.utime(path, ns=(0, 0))
+    assert catalog.completed("drs://fake/a.txt", tmp_path) is None
+    assert catalog.get("drs://fake/a.txt") is None
+
+
+def test_revalidate_hashes_the_file(tmp_path):
+    path = tmp_path / "a.txt"
+    path.write_bytes(b"x" * 100)
+    Catalog(tmp_path / "catalog.sqlite").record(_object(path), path)
+    os.utime(path, ns=(0, 0))
+
+    catalog = Catalog(tmp_path / "catalog.sqlite", revalidate=True)
+    assert catalog.completed("drs://fake/a.txt", tmp_path) is not None
+    assert Catalog(tmp_path / "catalog.sqlite").completed("drs://fake/a.txt", tmp_path) is not None
+
+    path.write_bytes(b"y" * 100)
+    assert catalog.completed("drs://fake/a.txt", tmp_path) is None
+
+
+def test_rerun_skips_cataloged_objects_without_resolving_them(tmp_path):
+    contents = {f"drs://fake/file-{i}.txt": os.urandom(1000) for i in range(3)}
+    destination = tmp_path / "out"
+    destination.mkdir()
+
+    def _download(client):
+        manager = DrsAsyncManager(client, show_progress=False, catalog=Catalog(tmp_path / "catalog.sqlite"))
+        return manager.run(
+            manager.resolve_and_download(list(contents), destination, user_project=None, duplicate=False,
+                                         verbose=False)
+        )
+
+    assert all(drs_object.state == ObjectState.DONE for drs_object in _download(FakeDrsClient(contents)))
+    (destination / "file-1.txt").unlink()
+
+    client = FakeDrsClient(contents)
+    drs_objects = _download(client)
+    assert [drs_object.state for drs_object in drs_objects] == [
+        ObjectState.SKIPPED, ObjectState.DONE, ObjectState.SKIPPED
+    ]
+    assert client.events.count(("get_object", "drs://fake/file-1.txt")) == 1
+    assert [event for event, _ in client.events].count("get_object") == 1
+    assert (destination / "file-1.txt").read_bytes() == contents["drs://fake/file-1.txt"]
+
+
+def test_files_skipped_on_name_and_size_are_not_cataloged(tmp_path):
+    contents = {"drs://fake/file-0.txt": os.urandom(1000)}
+    destination = tmp_path / "out"
+    destination.mkdir()
+    # the right name and size, never hashed
+    (destination / "file-0.txt").write_bytes(bytes(1000))
+
+    catalog = Catalog(tmp_path / "catalog.sqlite")
+    manager = DrsAsyncManager(FakeDrsClient(contents), show_progress=False, catalog=catalog)
+    drs_objects = manager.run(
+        manager.resolve_and_download(list(contents), destination, user_project=None, duplicate=False, verbose=False)
+    )
+
+    assert drs_objects[0].state == ObjectState.SKIPPED
+    assert catalog.get("drs://fake/file-0.txt") is None
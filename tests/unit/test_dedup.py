@@ -0,0 +1,102 @@
+import errno
+import os
+import shutil
+from pathlib import Path
+
+from drs_downloader.dedup import place
+from drs_downloader.manager import DrsAsyncManager
+from drs_downloader.models import ObjectState
+from tests import FakeDrsClient
+
+SHARED = os.urandom(3000)
+CONTENTS = {
+    "drs://one/a.crai": SHARED,
+    "drs://two/b.crai": SHARED,
+    "drs://fake/unique.crai": os.urandom(3000),
+    "drs://three/c.crai": SHARED,
+}
+
+
+def test_place_falls_back_to_a_copy(tmp_path):
+    source = tmp_path / "a"
+    source.write_bytes(b"x" * 100)
+
+    def _cross_device(source, destination):
+        raise OSError(errno.EXDEV, "Invalid cross-device link")
+
+    method = place(source, tmp_path / "b", links=[("hardlink", _cross_device), ("copy", shutil.copyfile)])
+    assert method == "copy"
+    assert sorted(os.listdir(tmp_path)) == ["a", "b"]
+
+
+def _download(client, tmp_path, **kwargs):
+    manager = DrsAsyncManager(client, show_progress=False, max_object_retries=0, **kwargs)
+    drs_objects = manager.run(
+        manager.resolve_and_download(list(CONTENTS), Path(tmp_path), user_project=None, duplicate=False,
+                                     verbose=False)
+    )
+    return manager, drs_objects
+
+
+def test_same_bytes_are_downloaded_once(tmp_path):
+    client = FakeDrsClient(CONTENTS)
+    manager, drs_objects = _download(client, tmp_path)
+
+    assert all(drs_object.state == ObjectState.DONE for drs_object in drs_objects)
+    assert {object_id for event, object_id in client.events if event == "download_part"} == {
+        "drs://one/a.crai", "drs://fake/unique.crai"
+    }
+    assert manager.deduplicator.objects == 2 and manager.deduplicator.bytes == 6000
+    for object_id, data in CONTENTS.items():
+        assert (tmp_path / object_id.split("/")[-1]).read_bytes() == data
+
+
+def test_next_object_downloads_when_the_first_fails(tmp_path):
+    class FailingClient(FakeDrsClient):
+        async def download_part(self, drs_object, start, size, destination_path, verbose=False):
+            if drs_object.id == "drs://one/a.crai":
+                raise ConnectionError("connection reset")
+            return await super().download_part(drs_object, start, size, destination_path, verbose)
+
+    client = FailingClient(CONTENTS)
+    manager, drs_objects = _download(client, tmp_path)
+
+    assert [drs_object.state for drs_object in drs_objects] == [ObjectState.FAILED] + [ObjectState.DONE] * 3
+    assert manager.deduplicator.objects == 1
+    assert (tmp_path / "c.crai").read_bytes() == SHARED
+
+
+def test_files_share_an_inode_only_with_hardlinks(tmp_path):
+    (tmp_path / "default").mkdir()
+    (tmp_path / "hardlinks").mkdir()
+    _download(FakeDrsClient(CONTENTS), tmp_path / "default")
+    inodes = {os.stat(tmp_path / "default" / name).st_ino for name in ["a.crai", "b.crai", "c.crai"]}
+    assert len(inodes) == 3
+
+    _download(FakeDrsClient(CONTENTS), tmp_path / "hardlinks", hardlinks=True)
+    inodes = {os.stat(tmp_path / "hardlinks" / name).st_ino for name in ["a.crai", "b.crai", "c.crai"]}
+    assert len(inodes) == 1
+
+
+def test_streaming_remembers_a_bounded_number_of_files(tmp_path):
+    # pairs of objects with the same bytes, next to each other in the manifest
+    blobs = [os.urandom(100) for _ in range(100)]
+    contents = {f"drs://fake/file-{i}.txt": blobs[i // 2] for i in range(200)}
+    manager = DrsAsyncManager(
+        FakeDrsClient(contents), show_progress=False, max_simultaneous_object_retrievers=4,
+        max_simultaneous_object_signers=4, max_simultaneous_downloaders=4, adaptive_concurrency=False,
+        reorder_window=4,
+    )
+    manager.deduplicator.max_sources = 8
+    remembered = []
+
+    failures = manager.run(
+        manager.resolve_and_download(
+            iter(contents), Path(tmp_path), user_project=None, duplicate=False, verbose=False,
+            on_finished=lambda _: remembered.append(len(manager.deduplicator._downloaded)), keep_results=False,
+        )
+    )
+
+    assert failures == [] and len(os.listdir(tmp_path)) == len(contents)
+    assert manager.deduplicator.objects == 100
+    assert max(remembered) <= 8 and not manager.deduplicator._downloading
@@ -0,0 +1,96 @@
+import os
+from pathlib import Path
+
+from drs_downloader import MB
+from drs_downloader.destination import COMPLETE, MISSING, RESUMABLE, DestinationIndex
+from drs_downloader.manager import DrsAsyncManager
+from drs_downloader.models import DrsObject, ObjectState
+from tests import FakeDrsClient
+
+
+def _object(name: str, size: int) -> DrsObject:
+    return DrsObject(self_uri=f"drs://fake/{name}", id=f"drs://fake/{name}", checksums=[], size=size, name=name)
+
+
+def test_index_tells_complete_from_resumable(tmp_path):
+    (tmp_path / "a.txt").write_bytes(b"x" * 10)
+    (tmp_path / "b.txt").write_bytes(b"x" * 4)
+    (tmp_path / "c.txt").mkdir()
+    index = DestinationIndex.scan(tmp_path)
+
+    assert index.status(_object("a.txt", 10)) == COMPLETE
+    assert index.status(_object("b.txt", 10)) == RESUMABLE and index.is_resumable("drs://fake/b.txt")
+    assert index.status(_object("c.txt", 10)) == MISSING
+    assert DestinationIndex.scan(tmp_path / "missing").status(_object("a.txt", 10)) == MISSING
+
+    index.add(_object("b.txt", 10))
+    assert index.status(_object("b.txt", 10)) == COMPLETE
+
+
+def test_only_missing_and_wrong_sized_files_are_downloaded(tmp_path):
+    contents = {f"drs://fake/file-{i}.txt": os.urandom(100) for i in range(3)}
+    (tmp_path / "file-0.txt").write_bytes(contents["drs://fake/file-0.txt"])
+    (tmp_path / "file-1.txt").write_bytes(b"truncated")
+
+    client = FakeDrsClient(contents)
+    manager = DrsAsyncManager(client, show_progress=False)
+    drs_objects = manager.run(
+        manager.resolve_and_download(list(contents), Path(tmp_path), user_project=None, duplicate=False,
+                                     verbose=False)
+    )
+
+    states = [drs_object.state for drs_object in drs_objects]
+    assert states == [ObjectState.SKIPPED, ObjectState.DONE, ObjectState.DONE]
+    assert sorted(os.listdir(tmp_path)) == ["file-0.txt", "file-1.txt", "file-2.txt"]
+    assert (tmp_path / "file-1.txt").read_bytes() == contents["drs://fake/file-1.txt"]
+
+
+def test_parts_left_without_a_journal_come_from_the_one_listing(tmp_path, monkeypatch):
+    contents = {f"drs://fake/file-{i}.txt": os.urandom(3 * MB) for i in range(3)}
+    # the first part of 1 MB, left by a version without journals
+    (tmp_path / f"file-0.txt.0.{MB}.part").write_bytes(contents["drs://fake/file-0.txt"][:MB + 1])
+    index = DestinationIndex.scan(tmp_path)
+    assert index.parts("file-0.txt") == [(0, MB)] and index.parts("file-1.txt") == []
+
+    listed = []
+    scandir = os.scandir
+    monkeypatch.setattr(os, "scandir", lambda path: listed.append(Path(path)) or scandir(path))
+    client = FakeDrsClient(contents)
+    manager = DrsAsyncManager(client, show_progress=False)
+    drs_objects = manager.run(
+        manager.resolve_and_download(list(contents), Path(tmp_path), user_project=None, duplicate=False,
+                                     verbose=False)
+    )
+
+    assert all(drs_object.state == ObjectState.DONE for drs_object in drs_objects)
+    assert (tmp_path / "file-0.txt").read_bytes() == contents["drs://fake/file-0.txt"]
+    assert listed == [tmp_path]
+
+
+def test_streaming_lets_go_of_each_object_in_the_index(tmp_path):
+    contents = {f"drs://fake/file-{i}.txt": os.urandom(100) for i in range(200)}
+    for object_id, data in list(contents.items())[::2]:
+        (tmp_path / object_id.split("/")[-1]).write_bytes(data)
+    client = FakeDrsClient(contents)
+    manager = DrsAsyncManager(
+        client, show_progress=False, max_simultaneous_object_retrievers=4, max_simultaneous_object_signers=4,
+        max_simultaneous_downloaders=4, adaptive_concurrency=False, reorder_window=4,
+    )
+    decisions = []
+
+    def _on_finished(drs_object):
+        index = manager.destination_index
+        decisions.append(len(index._complete) + len(index._resumable))
+
+    failures = manager.run(
+        manager.resolve_and_download(
+            iter(contents), Path(tmp_path), user_project=None, duplicate=False, verbose=False,
+            on_finished=_on_finished, keep_results=False,
+        )
+    )
+
+    assert failures == [] and len(os.listdir(tmp_path)) == len(contents)
+    # only the objects in flight are known to the index, and nothing of the listing is left at the end
+    assert max(decisions) < 20
+    index = manager.destination_index
+    assert not index._sizes and not index._complete and not index._resumable
@@ -0,0 +1,59 @@
+import asyncio
+import os
+import tempfile
+from pathlib import Path
+
+import pytest
+
+from drs_downloader.disk import DiskSpace, NotEnoughDiskSpace
+from drs_downloader.manager import DrsAsyncManager
+from tests import FakeDrsClient
+
+
+def test_objects_wait_for_space(tmp_path):
+    disk_space = DiskSpace(headroom=0, free_space=lambda path: 3000, poll_interval=0.01)
+    order = []
+
+    async def download(key):
+        async with disk_space.reserve(key, [(tmp_path, 1000), (tmp_path, 1000)]):
+            order.append(f"start {key}")
+            await asyncio.sleep(0.02)
+            order.append(f"end {key}")
+
+    async def main():
+        await asyncio.gather(download("a"), download("b"))
+
+    asyncio.run(main())
+    assert order == ["start a", "end a", "start b", "end b"]
+
+
+def test_object_that_can_never_fit(tmp_path):
+    disk_space = DiskSpace(headroom=0, free_space=lambda path: 1000)
+
+    async def main():
+        async with disk_space.reserve("big", [(tmp_path, 2000)]):
+            pass
+
+    with pytest.raises(NotEnoughDiskSpace):
+        asyncio.run(main())
+
+
+def test_manager_admits_objects_that_fit():
+    contents = {f"drs://fake/file-{i}.txt": os.urandom(1000) for i in range(3)}
+    contents["drs://fake/huge.txt"] = os.urandom(5000)
+    client = FakeDrsClient(contents, latency=0.01)
+    # each 1000 byte object needs 2000 bytes at its peak, so one at a time
+    disk_space = DiskSpace(headroom=0, free_space=lambda path: 2500, poll_interval=0.01)
+    manager = DrsAsyncManager(client, show_progress=False, disk_space=disk_space)
+
+    with tempfile.TemporaryDirectory() as dest:
+        drs_objects = manager.run(
+            manager.resolve_and_download(list(contents), Path(dest), user_project=None, duplicate=False,
+                                         verbose=False)
+        )
+
+    errors = {drs_object.id: drs_object.errors for drs_object in drs_objects}
+    assert "Not enough disk space" in errors.pop("drs://fake/huge.txt")[0]
+    assert all(len(error) == 0 for error in errors.values())
+    downloads = [object_id for event, object_id in client.events if event == "download_part"]
+    assert sorted(downloads) == sorted(errors)
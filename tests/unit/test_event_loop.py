@@ -0,0 +1,46 @@
+import asyncio
+
+import pytest
+
+from drs_downloader import event_loop
+
+
+def test_run_uses_one_loop():
+    """Every await in the job should see the same loop."""
+    loops = []
+
+    async def job():
+        for _ in range(3):
+            await asyncio.sleep(0)
+            loops.append(asyncio.get_running_loop())
+        return "done"
+
+    assert event_loop.run(job(), "asyncio") == "done"
+    assert len(set(map(id, loops))) == 1
+    assert loops[0].is_closed()
+
+
+def test_run_cancels_leftover_tasks():
+    cancelled = []
+
+    async def forever():
+        try:
+            await asyncio.sleep(3600)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+
+    async def job():
+        asyncio.create_task(forever())
+        await asyncio.sleep(0)
+
+    event_loop.run(job(), "asyncio")
+    assert cancelled == [True]
+
+
+def test_resolve_loop_name():
+    expected = "uvloop" if event_loop.uvloop_available() else "asyncio"
+    assert event_loop.resolve_loop_name("auto") == expected
+    assert event_loop.resolve_loop_name("asyncio") == "asyncio"
+    with pytest.raises(ValueError):
+        event_loop.resolve_loop_name("not-a-loop")
@@ -0,0 +1,76 @@
+import asyncio
+import hashlib
+import os
+from pathlib import Path
+
+from drs_downloader.hashing import HashFrontier
+from drs_downloader.writers import PartSink
+
+DATA = os.urandom(10000)
+PARTS = [(0, 2500), (2501, 5001), (5002, 7502), (7503, 10000)]
+
+
+class _Sink(PartSink):
+    def __init__(self, path: Path):
+        self.path = path
+        self._file = open(path, "wb")
+
+    async def write(self, data: bytes):
+        self._file.write(data)
+
+    async def close(self):
+        self._file.close()
+
+
+async def _write_part(frontier, tmp_path, start, size, chunk=1000):
+    sink = frontier.track(start, _Sink(tmp_path / f"{start}.part"))
+    data = DATA[start:size + 1]
+    for i in range(0, len(data), chunk):
+        await sink.write(data[i:i + chunk])
+        await asyncio.sleep(0)
+    await sink.close()
+    return sink.path
+
+
+def _run(frontier, tmp_path, order):
+    async def main():
+        paths = await asyncio.gather(*[_write_part(frontier, tmp_path, *PARTS[index]) for index in order])
+        return await frontier.finish(sorted(paths, key=lambda path: int(path.name.split(".")[0])))
+
+    return asyncio.run(main())
+
+
+def test_parts_out_of_order_are_hashed_from_memory(tmp_path):
+    frontier = HashFrontier(hashlib.md5(), PARTS, len(DATA), in_place=False)
+
+    async def main():
+        paths = [await _write_part(frontier, tmp_path, *PARTS[index]) for index in [2, 1, 3]]
+        # nothing can be hashed before the first part, after it the others follow without touching the disk
+        assert frontier._index == 0
+        for path in paths:
+            path.unlink()
+        first = await _write_part(frontier, tmp_path, *PARTS[0])
+        assert frontier._index == len(PARTS)
+        return await frontier.finish([first] + paths)
+
+    assert asyncio.run(main()).hexdigest() == hashlib.md5(DATA).hexdigest()
+
+
+def test_parts_beyond_the_buffer_are_read_back(tmp_path):
+    frontier = HashFrontier(hashlib.md5(), PARTS, len(DATA), in_place=False, max_buffered=1500)
+    checksum = _run(frontier, tmp_path, [3, 2, 1, 0])
+    assert checksum.hexdigest() == hashlib.md5(DATA).hexdigest()
+    assert frontier._buffered == 0
+
+
+def test_part_written_again_falls_back_to_the_files(tmp_path):
+    frontier = HashFrontier(hashlib.md5(), PARTS, len(DATA), in_place=False)
+
+    async def main():
+        # the connection dropped halfway through the first part, it is written again from the start
+        sink = frontier.track(0, _Sink(tmp_path / "0.part"))
+        await sink.write(DATA[:1000])
+        paths = [await _write_part(frontier, tmp_path, start, size) for start, size in PARTS]
+        return await frontier.finish(paths)
+
+    assert asyncio.run(main()).hexdigest() == hashlib.md5(DATA).hexdigest()
@@ -0,0 +1,200 @@
+import os
+import signal
+import subprocess
+import sys
+import zlib
+from pathlib import Path
+
+from drs_downloader import MB
+from drs_downloader.journal import Journal, RangeSet
+from drs_downloader.manager import DrsAsyncManager
+from drs_downloader.models import ObjectState
+from tests import FakeDrsClient
+
+
+def test_range_set_merges_touching_ranges():
+    ranges = RangeSet()
+    ranges.add(2002, 3000)
+    ranges.add(0, 1000)
+    assert str(ranges) == "0-1000,2002-3000"
+    assert not ranges.covers(0, 2001)
+    ranges.add(1001, 2001)
+    assert str(ranges) == "0-3000"
+    assert ranges.covers(1001, 2001) and ranges.total() == 3001
+    assert str(RangeSet.parse("5-9,0-4,20-30")) == "0-9,20-30"
+
+
+def test_journal_is_replaced_whole(tmp_path):
+    path = tmp_path / "a.cram.journal"
+    journal = Journal(path, 3000, 1000)
+    journal.add_part(1001, 2001)
+    journal.flush()
+    journal.add_part(2002, 3000)
+    journal.close()
+
+    loaded = Journal.load(path, 3000)
+    assert loaded.resumed and loaded.part_size == 1000
+    assert loaded.has_part(2002, 3000) and not loaded.has_part(0, 1000)
+    assert os.listdir(tmp_path) == ["a.cram.journal"]
+    assert Journal.load(path, 4000) is None
+    path.write_text('{"format": 1, "size": 30')
+    assert Journal.load(path, 3000) is None
+
+
+def test_journal_is_saved_on_sigterm(tmp_path):
+    path = tmp_path / "a.cram.journal"
+    script = f"""
+import os, signal
+from drs_downloader.journal import Journal, install_signal_handlers
+install_signal_handlers()
+journal = Journal({str(path)!r}, 3000, 1000, flush_interval=3600)
+journal.flush()
+journal.add_part(0, 1000)
+journal.flush(force=False)
+os.kill(os.getpid(), signal.SIGTERM)
+"""
+    result = subprocess.run([sys.executable, "-c", script], env=dict(os.environ, PYTHONPATH=os.getcwd()))
+
+    assert result.returncode == -signal.SIGTERM
+    assert Journal.load(path, 3000).has_part(0, 1000)
+
+
+def test_journal_keeps_part_crcs(tmp_path):
+    path = tmp_path / "a.cram"
+    path.write_bytes(b"x" * 3001)
+    journal = Journal(tmp_path / "a.cram.journal", 3001, 1000)
+    journal.add_part(0, 1000, zlib.crc32(b"x" * 1001))
+    journal.add_part(1001, 2001)
+    journal.close()
+
+    loaded = Journal.load(tmp_path / "a.cram.journal", 3001)
+    assert loaded.verify_part(0, 1000, path, 0) is True
+    assert loaded.verify_part(1001, 2001, path, 1001) is None
+    path.write_bytes(b"y" + b"x" * 3000)
+    assert loaded.verify_part(0, 1000, path, 0) is False
+
+
+# 5 MB in parts of 2 MB
+CONTENTS = {"drs://fake/file-0.txt": os.urandom(5 * MB)}
+PARTS = [(0, 2 * MB), (2 * MB + 1, 4 * MB + 1), (4 * MB + 2, 5 * MB)]
+
+
+class FailingClient(FakeDrsClient):
+    """The last part fails."""
+
+    async def download_part(self, drs_object, start, size, destination_path, verbose=False):
+        if start > 4 * MB:
+            raise ConnectionError("connection reset")
+        return await super().download_part(drs_object, start, size, destination_path, verbose)
+
+
+def _download(client, tmp_path):
+    manager = DrsAsyncManager(client, show_progress=False, max_object_retries=0)
+    return manager.run(
+        manager.resolve_and_download(list(CONTENTS), Path(tmp_path), user_project=None, duplicate=False,
+                                     verbose=False)
+    )
+
+
+def _downloaded_parts(client):
+    return [event for event, _ in client.events].count("download_part")
+
+
+def test_parts_are_resumed_from_the_journal(tmp_path):
+    assert _download(FailingClient(CONTENTS), tmp_path)[0].state == ObjectState.FAILED
+    assert Journal.load(tmp_path / "file-0.txt.journal", 5 * MB).ranges.total() == 4 * MB + 2
+
+    client = FakeDrsClient(CONTENTS)
+    assert _download(client, tmp_path)[0].state == ObjectState.DONE
+    assert _downloaded_parts(client) == 1
+    assert os.listdir(tmp_path) == ["file-0.txt"]
+    assert (tmp_path / "file-0.txt").read_bytes() == CONTENTS["drs://fake/file-0.txt"]
+
+
+def test_damaged_part_is_downloaded_again_on_resume(tmp_path):
+    _download(FailingClient(CONTENTS), tmp_path)
+    with open(tmp_path / "file-0.txt.0.2097152.part", "r+b") as f:
+        f.write(b"\0" * 10)
+
+    client = FakeDrsClient(CONTENTS)
+    assert _download(client, tmp_path)[0].state == ObjectState.DONE
+    assert _downloaded_parts(client) == 2
+    assert (tmp_path / "file-0.txt").read_bytes() == CONTENTS["drs://fake/file-0.txt"]
+
+
+def test_object_failing_its_checksum_is_repaired(tmp_path):
+    # a part left by a version without journals has the right size but not the right bytes
+    data = CONTENTS["drs://fake/file-0.txt"]
+    start, end = PARTS[1]
+    damaged = bytearray(data[start:end + 1])
+    damaged[100] ^= 0xFF
+    (tmp_path / f"file-0.txt.{start}.{end}.part").write_bytes(damaged)
+
+    client = FakeDrsClient(CONTENTS)
+    drs_object = _download(client, tmp_path)[0]
+    assert drs_object.state == ObjectState.DONE, drs_object.errors
+    # the two missing parts, then the one that was never hashed
+    assert _downloaded_parts(client) == 3
+    assert os.listdir(tmp_path) == ["file-0.txt"]
+    assert (tmp_path / "file-0.txt").read_bytes() == data
+
+
+class CorruptingClient(FakeDrsClient):
+    """The middle part arrives with a byte flipped."""
+
+    async def download_part(self, drs_object, start, size, destination_path, verbose=False):
+        if start != PARTS[1][0]:
+            return await super().download_part(drs_object, start, size, destination_path, verbose)
+        data = bytearray(self.contents[drs_object.id][start:size + 1])
+        data[100] ^= 0xFF
+        file = await self.open_part(drs_object, start, size, destination_path)
+        await file.write(bytes(data))
+        await file.close()
+        return file.path
+
+
+def _repair(client, tmp_path):
+    manager = DrsAsyncManager(client, show_progress=False, max_object_retries=0, repair=True)
+    return manager.run(
+        manager.resolve_and_download(list(CONTENTS), Path(tmp_path), user_project=None, duplicate=False,
+                                     verbose=False)
+    )
+
+
+def test_file_failing_its_checksum_is_repaired_on_a_later_run(tmp_path):
+    data = CONTENTS["drs://fake/file-0.txt"]
+    assert _download(CorruptingClient(CONTENTS), tmp_path)[0].state == ObjectState.FAILED
+    # the journal stays with the file for a repair
+    assert sorted(os.listdir(tmp_path)) == ["file-0.txt", "file-0.txt.journal"]
+    # of the right size, a plain rerun takes it as it is
+    assert _download(FakeDrsClient(CONTENTS), tmp_path)[0].state == ObjectState.SKIPPED
+
+    client = FakeDrsClient(CONTENTS)
+    assert _repair(client, tmp_path)[0].state == ObjectState.DONE
+    # every part matched the CRC-32 of the bytes as they arrived, so every part is downloaded again
+    assert _downloaded_parts(client) == 3
+    assert os.listdir(tmp_path) == ["file-0.txt"]
+    assert (tmp_path / "file-0.txt").read_bytes() == data
+
+    # intact, it is only hashed
+    client = FakeDrsClient(CONTENTS)
+    assert _repair(client, tmp_path)[0].state == ObjectState.SKIPPED
+    assert _downloaded_parts(client) == 0
+
+
+def test_repair_downloads_only_the_parts_not_matching_the_journal(tmp_path):
+    data = CONTENTS["drs://fake/file-0.txt"]
+    assert _download(FakeDrsClient(CONTENTS), tmp_path)[0].state == ObjectState.DONE
+    journal = Journal(tmp_path / "file-0.txt.journal", len(data), 2 * MB)
+    for start, end in PARTS:
+        journal.add_part(start, end, zlib.crc32(data[start:end + 1]))
+    journal.close()
+    with open(tmp_path / "file-0.txt", "r+b") as f:
+        f.seek(3 * MB)
+        f.write(b"\0" * 10)
+
+    client = FakeDrsClient(CONTENTS)
+    assert _repair(client, tmp_path)[0].state == ObjectState.DONE
+    assert _downloaded_parts(client) == 1
+    assert os.listdir(tmp_path) == ["file-0.txt"]
+    assert (tmp_path / "file-0.txt").read_bytes() == data
@@ -0,0 +1,143 @@
+import asyncio
+import os
+import time
+from pathlib import Path
+
+from drs_downloader.leases import LeaseBoard
+from drs_downloader.manager import DrsAsyncManager
+from tests import FakeDrsClient
+
+
+class RenamingDrsClient(FakeDrsClient):
+    """Objects whose id is not the URI they were resolved from."""
+
+    async def get_object(self, object_id: str, verbose: bool = False):
+        drs_object = await super().get_object(object_id, verbose)
+        drs_object.id = f"dg.{drs_object.name}"
+        self.contents[drs_object.id] = self.contents[object_id]
+        return drs_object
+
+
+def test_only_one_instance_holds_a_lease(tmp_path):
+    a = LeaseBoard(tmp_path, ttl=60, owner="a")
+    b = LeaseBoard(tmp_path, ttl=60, owner="b")
+
+    assert a.try_claim("drs://fake/1")
+    assert not b.try_claim("drs://fake/1")
+    a.release("drs://fake/1", done=False)
+    assert b.try_claim("drs://fake/1")
+
+
+def test_abandoned_lease_is_taken_over(tmp_path):
+    a = LeaseBoard(tmp_path, ttl=60, owner="a")
+    b = LeaseBoard(tmp_path, ttl=60, owner="b")
+    assert a.try_claim("drs://fake/1")
+
+    # no heartbeat for longer than the ttl
+    old = time.time() - 120
+    os.utime(a.held["drs://fake/1"], (old, old))
+    assert b.try_claim("drs://fake/1")
+
+    # a notices on its next heartbeat and lets go without removing b's lease
+    a.beat()
+    assert "drs://fake/1" not in a.held
+    a.release("drs://fake/1", done=False)
+    assert (tmp_path / f"{LeaseBoard.key('drs://fake/1')}.lease").read_text() == "b"
+
+
+def test_lease_taken_over_by_another_instance_meanwhile_is_given_back(tmp_path, monkeypatch):
+    a = LeaseBoard(tmp_path, ttl=60, owner="a")
+    b = LeaseBoard(tmp_path, ttl=60, owner="b")
+    c = LeaseBoard(tmp_path, ttl=60, owner="c")
+    assert a.try_claim("drs://fake/1")
+    old = time.time() - 120
+    os.utime(a.held["drs://fake/1"], (old, old))
+
+    stat = Path.stat
+
+    def c_meanwhile(path, *args, **kwargs):
+        # b has seen the stale lease, c takes it over before b goes on
+        result = stat(path, *args, **kwargs)
+        monkeypatch.setattr(Path, "stat", stat)
+        assert c.try_claim("drs://fake/1")
+        return result
+
+    monkeypatch.setattr(Path, "stat", c_meanwhile)
+    assert not b.try_claim("drs://fake/1")
+
+    c.beat()
+    assert "drs://fake/1" in c.held
+    assert (tmp_path / f"{LeaseBoard.key('drs://fake/1')}.lease").read_text() == "c"
+    assert list(tmp_path.glob("*.stale")) == []
+
+
+def test_done_objects_are_not_claimed_again(tmp_path):
+    a = LeaseBoard(tmp_path, ttl=60, owner="a")
+    b = LeaseBoard(tmp_path, ttl=60, owner="b")
+    assert a.try_claim("drs://fake/1")
+    a.release("drs://fake/1", done=True)
+
+    assert b.is_done("drs://fake/1")
+    assert not b.try_claim("drs://fake/1")
+
+
+def test_heartbeat_renews_leases(tmp_path):
+    a = LeaseBoard(tmp_path, ttl=60, owner="a")
+    assert a.try_claim("drs://fake/1")
+    path = a.held["drs://fake/1"]
+    old = time.time() - 30
+    os.utime(path, (old, old))
+
+    a.beat()
+    assert time.time() - path.stat().st_mtime < 5
+
+
+def test_instances_share_a_manifest(tmp_path):
+    contents = {f"drs://fake/file-{i}.txt": os.urandom(1000) for i in range(10)}
+    destination = tmp_path / "dest"
+    destination.mkdir()
+    clients = [FakeDrsClient(contents, latency=0.01) for _ in range(2)]
+    managers = [
+        DrsAsyncManager(client, show_progress=False, leases=LeaseBoard(tmp_path / "work", heartbeat=0.05, owner=str(i)))
+        for i, client in enumerate(clients)
+    ]
+
+    async def main():
+        return await asyncio.gather(
+            *[
+                manager.resolve_and_download(list(contents), Path(destination), user_project=None, duplicate=False,
+                                             verbose=False)
+                for manager in managers
+            ]
+        )
+
+    results = asyncio.run(main())
+
+    downloaded = [drs_object.id for drs_objects in results for drs_object in drs_objects]
+    assert sorted(downloaded) == sorted(contents)
+    assert sorted(os.listdir(destination)) == sorted(object_id.split("/")[-1] for object_id in contents)
+    assert all(managers[0].leases.is_done(object_id) for object_id in contents)
+    assert not list((tmp_path / "work").glob("*.lease"))
+
+
+def test_object_whose_holder_dies_mid_run_is_taken_over(tmp_path):
+    contents = {f"drs://fake/file-{i}.txt": os.urandom(1000) for i in range(4)}
+    destination = tmp_path / "dest"
+    destination.mkdir()
+    # another instance claimed one object, then died without a heartbeat
+    LeaseBoard(tmp_path / "work", ttl=0.5, owner="dead").try_claim("drs://fake/file-2.txt")
+    manager = DrsAsyncManager(
+        RenamingDrsClient(dict(contents)), show_progress=False,
+        leases=LeaseBoard(tmp_path / "work", ttl=0.5, heartbeat=0.05, owner="alive"),
+    )
+
+    drs_objects = manager.run(
+        manager.resolve_and_download(list(contents), destination, user_project=None, duplicate=False, verbose=False)
+    )
+
+    assert sorted(drs_object.self_uri for drs_object in drs_objects) == sorted(contents)
+    assert all(len(drs_object.errors) == 0 for drs_object in drs_objects)
+    assert sorted(os.listdir(destination)) == sorted(object_id.split("/")[-1] for object_id in contents)
+    # claimed and released on the URI in the manifest, whatever the object's id
+    assert all(manager.leases.is_done(object_id) for object_id in contents)
+    assert not list((tmp_path / "work").glob("*.lease"))
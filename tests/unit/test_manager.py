@@ -0,0 +1,164 @@
+import os
+import tempfile
+from pathlib import Path
+
+from drs_downloader.manager import DrsAsyncManager
+from drs_downloader.models import ObjectState
+from tests import FakeDrsClient
+
+
+def _contents(count: int, size: int = 1000):
+    return {f"drs://fake/file-{i}.txt": os.urandom(size) for i in range(count)}
+
+
+def test_first_download_starts_before_resolution_finishes():
+    contents = _contents(20)
+    slow_id = "drs://fake/file-19.txt"
+    client = FakeDrsClient(contents, latency=0.01, slow={slow_id: 0.5})
+    manager = DrsAsyncManager(client, show_progress=False, max_simultaneous_object_retrievers=5)
+
+    with tempfile.TemporaryDirectory() as dest:
+        drs_objects = manager.run(
+            manager.resolve_and_download(
+                list(contents), Path(dest), user_project=None, duplicate=False, verbose=False
+            )
+        )
+
+        assert [drs_object.id for drs_object in drs_objects] == list(contents)
+        assert all(len(drs_object.errors) == 0 for drs_object in drs_objects)
+        for drs_object in drs_objects:
+            with open(Path(dest, drs_object.name), "rb") as f:
+                assert f.read() == contents[drs_object.id]
+
+    # the slow object resolves last, the others have not waited for it
+    names = [event for event, _ in client.events]
+    downloads_before_slow_resolve = names[: client.events.index(("get_object", slow_id))].count("download_part")
+    assert downloads_before_slow_resolve == len(contents) - 1
+
+
+def test_failed_object_keeps_identity():
+    contents = _contents(3)
+
+    class FailingClient(FakeDrsClient):
+        async def sign_url(self, drs_object, user_project=None, verbose=False):
+            if drs_object.id.endswith("file-1.txt"):
+                raise ValueError("boom")
+            return await super().sign_url(drs_object, user_project, verbose)
+
+    manager = DrsAsyncManager(FailingClient(contents), show_progress=False)
+    with tempfile.TemporaryDirectory() as dest:
+        drs_objects = manager.run(
+            manager.resolve_and_download(list(contents), Path(dest), user_project=None, duplicate=False, verbose=False)
+        )
+
+    failed = [drs_object for drs_object in drs_objects if drs_object.errors]
+    assert [drs_object.id for drs_object in failed] == ["drs://fake/file-1.txt"]
+    assert "boom" in failed[0].errors[0]
+
+
+def test_streaming_keeps_only_failures():
+    contents = _contents(200, size=100)
+    client = FakeDrsClient(contents)
+    manager = DrsAsyncManager(
+        client, show_progress=False, max_simultaneous_object_retrievers=4, max_simultaneous_object_signers=4,
+        max_simultaneous_downloaders=4, adaptive_concurrency=False, reorder_window=4,
+    )
+    read = []
+    finished = []
+    ahead = []
+
+    def _manifest():
+        for object_id in list(contents) + ["drs://fake/missing.txt"]:
+            read.append(object_id)
+            ahead.append(len(read) - len(finished))
+            yield object_id
+
+    with tempfile.TemporaryDirectory() as dest:
+        failures = manager.run(
+            manager.resolve_and_download(
+                _manifest(), Path(dest), user_project=None, duplicate=False, verbose=False,
+                on_finished=finished.append, keep_results=False,
+            )
+        )
+        assert len(os.listdir(dest)) == len(contents)
+
+    assert [drs_object.id for drs_object in failures] == ["drs://fake/missing.txt"]
+    assert len(finished) == len(contents) + 1
+    # the manifest is read as objects finish, not all at once
+    assert max(ahead) < 50
+    assert all(drs_object.file_parts == [] and drs_object.access_methods == [] for drs_object in finished)
+
+
+class ExpiringPartClient(FakeDrsClient):
+    """Parts of some objects fail as if their signed url had expired, `expirations` times per object."""
+
+    def __init__(self, contents, expiring, expirations=1, **kwargs):
+        super().__init__(contents, **kwargs)
+        self.expirations = {object_id: expirations for object_id in expiring}
+
+    async def download_part(self, drs_object, start, size, destination_path, verbose=False):
+        if start > 0 and self.expirations.get(drs_object.id, 0) > 0:
+            self.expirations[drs_object.id] -= 1
+            drs_object.fail("download_part", "The provided token has expired", recoverable=True)
+            return None
+        return await super().download_part(drs_object, start, size, destination_path, verbose)
+
+
+def _download(manager, contents):
+    with tempfile.TemporaryDirectory() as dest:
+        return manager.run(
+            manager.resolve_and_download(list(contents), Path(dest), user_project=None, duplicate=False,
+                                         verbose=False)
+        )
+
+
+def test_only_the_failed_object_is_signed_again():
+    contents = _contents(5, size=4 * 1024 * 1024)
+    expiring = "drs://fake/file-2.txt"
+    client = ExpiringPartClient(contents, [expiring])
+    manager = DrsAsyncManager(client, show_progress=False)
+
+    drs_objects = _download(manager, contents)
+
+    assert all(drs_object.state == ObjectState.DONE for drs_object in drs_objects)
+    signed = [object_id for event, object_id in client.events if event == "sign_url"]
+    assert signed.count(expiring) == 2
+    assert all(signed.count(object_id) == 1 for object_id in contents if object_id != expiring)
+    # the parts that made it the first time are kept, the object is not downloaded again from scratch
+    parts = [object_id for event, object_id in client.events if event == "download_part"]
+    assert parts.count(expiring) < 2 * parts.count("drs://fake/file-0.txt")
+
+
+def test_recoverable_failures_are_retried_a_bounded_number_of_times():
+    contents = _contents(2, size=4 * 1024 * 1024)
+    expiring = "drs://fake/file-1.txt"
+    client = ExpiringPartClient(contents, [expiring], expirations=100)
+    manager = DrsAsyncManager(client, show_progress=False, max_object_retries=2)
+
+    drs_objects = _download(manager, contents)
+
+    failed = drs_objects[1]
+    assert failed.id == expiring
+    assert failed.state == ObjectState.FAILED
+    assert failed.recoverable and failed.failures[0].stage == "download_part"
+    assert drs_objects[0].state == ObjectState.DONE
+    signed = [object_id for event, object_id in client.events if event == "sign_url"]
+    assert signed.count(expiring) == 3
+
+
+def test_budget_reached_by_the_controller_survives_on_resolved(tmp_path):
+    contents = _contents(5)
+    manager = DrsAsyncManager(FakeDrsClient(contents), show_progress=False, max_simultaneous_downloaders=30)
+    limits = []
+
+    def _on_resolved(drs_objects):
+        # as if parts finishing so far had tuned the budget up
+        manager._part_scheduler.set_limits(57)
+        manager.optimize_workload(False, drs_objects)
+        limits.append((manager._part_scheduler.limit, manager._part_scheduler.per_object_limit))
+
+    manager.run(
+        manager.resolve_and_download(list(contents), tmp_path, user_project=None, duplicate=False, verbose=False,
+                                     on_resolved=_on_resolved)
+    )
+    assert limits == [(57, 2)]
@@ -0,0 +1,72 @@
+import asyncio
+import os
+import tempfile
+from pathlib import Path
+
+from drs_downloader import ordering
+from drs_downloader.manager import DrsAsyncManager
+from drs_downloader.models import DrsObject
+from tests import FakeDrsClient
+
+
+def _objects(sizes):
+    return [DrsObject(id=f"drs://fake/{i}", self_uri=f"drs://fake/{i}", checksums=[], size=size, name=str(i))
+            for i, size in enumerate(sizes)]
+
+
+def test_predicted_makespan_favours_largest_first_for_a_large_tail():
+    drs_objects = _objects([1, 1, 1, 1, 8])
+    assert ordering.predict_makespan(ordering.ordered_sizes(ordering.ManifestOrder(), drs_objects), 2, 1) == 10
+    assert ordering.predict_makespan(ordering.ordered_sizes(ordering.LargestFirst(), drs_objects), 2, 1) == 8
+
+    policy, predictions = ordering.choose_policy(drs_objects, lanes=2, lane_throughput=1)
+    assert policy.name == "lpt"
+    assert set(predictions) == {"lpt", "spt", "manifest"}
+
+    # same sizes, the order makes no difference to the end of the run
+    policy, _ = ordering.choose_policy(_objects([5] * 10), lanes=2, lane_throughput=1)
+    assert policy.name == "spt"
+
+
+def test_ordered_queue_reorders_waiting_objects():
+    done = object()
+
+    async def main():
+        queue = ordering.OrderedQueue(ordering.make_policy("manifest"))
+        for item in enumerate(_objects([3, 1, 2])):
+            await queue.put(item)
+        await queue.put(done)
+        # the objects an order is predicted for, without the marker
+        assert sorted(drs_object.size for drs_object in queue.waiting()) == [1, 2, 3]
+        queue.reorder(ordering.make_policy("spt"))
+        return [await queue.get() for _ in range(4)]
+
+    items = asyncio.run(main())
+    assert [drs_object.size for _, drs_object in items[:3]] == [1, 2, 3]
+    assert items[3] is done
+
+
+def test_priority_order():
+    drs_objects = _objects([1, 1, 1])
+    policy = ordering.make_policy("priority", {"drs://fake/2": 1, "drs://fake/0": 2})
+    ranked = sorted(enumerate(drs_objects), key=lambda item: policy.key(*item))
+    assert [drs_object.id for _, drs_object in ranked] == ["drs://fake/2", "drs://fake/0", "drs://fake/1"]
+
+
+def test_manager_signs_in_policy_order():
+    sizes = [10, 3000, 200, 40000, 5]
+    contents = {f"drs://fake/file-{i}.txt": os.urandom(size) for i, size in enumerate(sizes)}
+    client = FakeDrsClient(contents)
+    manager = DrsAsyncManager(client, show_progress=False, max_simultaneous_object_signers=1, order="lpt")
+
+    async def main(dest):
+        drs_objects = await manager.get_objects_async(list(contents), verbose=False)
+        return await manager.download_async(drs_objects, Path(dest), user_project=None, duplicate=False,
+                                            verbose=False)
+
+    with tempfile.TemporaryDirectory() as dest:
+        drs_objects = manager.run(main(dest))
+
+    assert all(len(drs_object.errors) == 0 for drs_object in drs_objects)
+    signed = [object_id for event, object_id in client.events if event == "sign_url"]
+    assert signed == sorted(contents, key=lambda object_id: -len(contents[object_id]))
@@ -0,0 +1,34 @@
+from drs_downloader import GB, MB
+from drs_downloader.parts import PartSizer, existing_part_size
+
+
+def test_part_size_bounds():
+    sizer = PartSizer()
+    # small objects keep 1 MB parts
+    assert sizer.part_size(1267330, default=128 * MB) == MB
+    assert sizer.part_size(512, default=128 * MB) == 512
+    # medium objects still get several parts
+    assert sizer.part_size(100 * MB, default=128 * MB) == 25 * MB
+    # very large objects are held to the maximum part count
+    assert sizer.part_size(1000 * GB, default=128 * MB) == 1024 * MB
+
+
+def test_part_size_follows_throughput():
+    sizer = PartSizer(target_part_seconds=10)
+    assert sizer.part_size(40 * GB, default=128 * MB) == 128 * MB
+    sizer.record(40 * MB, 2.0)
+    assert sizer.part_size(40 * GB, default=128 * MB) == 200 * MB
+    # slow connections never split a large object into more than max_parts parts
+    slow = PartSizer()
+    slow.record(MB, 10.0)
+    assert slow.part_size(40 * GB, default=128 * MB) == 41 * MB
+
+
+def test_existing_part_size(tmp_path):
+    assert existing_part_size("a.cram", tmp_path, 3000) is None
+    # the last part says nothing about the part size
+    (tmp_path / "a.cram.2002.3000.part").touch()
+    assert existing_part_size("a.cram", tmp_path, 3000) is None
+    (tmp_path / "a.cram.1001.2001.part").touch()
+    (tmp_path / "b.cram.0.10.part").touch()
+    assert existing_part_size("a.cram", tmp_path, 3000) == 1000
@@ -0,0 +1,133 @@
+import asyncio
+
+from drs_downloader import MB
+from drs_downloader.scheduler import AIMDController, PartScheduler
+
+
+def _job(scheduler, started, key, delay=0.01):
+    async def job():
+        started.append((key, scheduler.in_flight))
+        await asyncio.sleep(delay)
+        return key
+
+    return job
+
+
+def test_budget_is_shared_across_objects():
+    """The number of parts in flight never exceeds the budget, whatever the number of objects."""
+
+    async def main():
+        scheduler = PartScheduler(limit=4, per_object_limit=2)
+        started = []
+        results = await asyncio.gather(
+            *[scheduler.run(f"object-{i}", [_job(scheduler, started, f"object-{i}") for _ in range(5)])
+              for i in range(6)]
+        )
+        return scheduler, started, results
+
+    scheduler, started, results = asyncio.run(main())
+    assert scheduler.peak_in_flight == 4
+    assert all(in_flight <= 4 for _, in_flight in started)
+    assert results == [[f"object-{i}"] * 5 for i in range(6)]
+    # parts from different objects are interleaved rather than one object at a time
+    assert len({key for key, _ in started[:4]}) > 1
+
+
+def test_single_object_uses_whole_budget():
+    async def main():
+        scheduler = PartScheduler(limit=8, per_object_limit=2)
+        started = []
+        await scheduler.run("only", [_job(scheduler, started, "only") for _ in range(16)])
+        return scheduler
+
+    assert asyncio.run(main()).peak_in_flight == 8
+
+
+def test_set_limits_takes_effect_immediately():
+    async def main():
+        scheduler = PartScheduler(limit=1, per_object_limit=1)
+        started = []
+        run = asyncio.ensure_future(scheduler.run("a", [_job(scheduler, started, "a", 0.05) for _ in range(6)]))
+        await asyncio.sleep(0.01)
+        assert scheduler.in_flight == 1
+        scheduler.set_limits(3)
+        assert scheduler.in_flight == 3
+        await run
+        return scheduler
+
+    assert asyncio.run(main()).peak_in_flight == 3
+
+
+def _blocked_scheduler(limit):
+    """A scheduler with every slot taken and parts waiting for one."""
+    scheduler = PartScheduler(limit=limit, per_object_limit=limit)
+    release = asyncio.Event()
+
+    async def job():
+        await release.wait()
+
+    for _ in range(limit + 10):
+        scheduler.submit("a", job)
+    return scheduler, release
+
+
+def test_aimd_grows_while_throughput_improves(monkeypatch):
+    clock = [0.0]
+    monkeypatch.setattr("drs_downloader.scheduler.time.monotonic", lambda: clock[0])
+
+    async def main():
+        scheduler, release = _blocked_scheduler(limit=4)
+        await asyncio.sleep(0)
+        controller = AIMDController(scheduler)
+        # a round is one part per slot, each round takes one second
+        for throughput in [4 * MB, 8 * MB, 8 * MB]:
+            parts = controller.limit
+            for _ in range(parts):
+                clock[0] += 1 / parts
+                controller.record(throughput // parts, 1 / parts, ok=True)
+        controller.close()
+        release.set()
+        return controller
+
+    controller = asyncio.run(main())
+    assert [decision.reason for decision in controller.decisions] == ["improving", "improving", "steady"]
+    assert [decision.limit for decision in controller.decisions] == [5, 6, 6]
+
+
+def test_aimd_backs_off_on_errors_and_stalls():
+    async def main():
+        scheduler, release = _blocked_scheduler(limit=8)
+        await asyncio.sleep(0)
+        controller = AIMDController(scheduler, stall_timeout=0.05)
+        controller.record(MB, 0.01, ok=False)
+        assert scheduler.limit == 4
+        # nothing finishes while parts are in flight
+        await asyncio.sleep(0.08)
+        controller.close()
+        release.set()
+        return controller
+
+    controller = asyncio.run(main())
+    assert [decision.reason for decision in controller.decisions] == ["errors", "stall"]
+    assert controller.limit == 2
+
+
+def test_aimd_halves_once_when_parts_fail_together():
+    async def main():
+        scheduler, release = _blocked_scheduler(limit=30)
+        await asyncio.sleep(0)
+        controller = AIMDController(scheduler)
+        # every part of an object whose signed url expired, all started before the first failure
+        for _ in range(20):
+            controller.record(MB, 1.0, ok=False)
+        assert scheduler.limit == 15
+        # a part started after the cut that fails cuts again
+        await asyncio.sleep(0.01)
+        controller.record(MB, 0.001, ok=False)
+        controller.close()
+        release.set()
+        return controller
+
+    controller = asyncio.run(main())
+    assert [decision.reason for decision in controller.decisions] == ["errors", "errors"]
+    assert controller.limit == 7
@@ -0,0 +1,62 @@
+import random
+from pathlib import Path
+
+import pytest
+
+from drs_downloader.cli import _extract_priorities, _extract_sizes, _extract_tsv_info
+from drs_downloader.shards import assign_shards, parse_shard, select_shard
+
+
+def test_parse_shard():
+    assert parse_shard("0/4") == (0, 4)
+    assert parse_shard(" 3 / 4 ") == (3, 4)
+    for text in ["4/4", "1/0", "-1/4", "1", "a/b"]:
+        with pytest.raises(ValueError):
+            parse_shard(text)
+
+
+def test_shards_cover_the_manifest_once():
+    uris = [f"drs://fake/{i}" for i in range(100)]
+    shards = [select_shard(uris, index, 3) for index in range(3)]
+    assert sorted(uri for shard in shards for uri in shard) == sorted(uris)
+    assert all(len(shard) > 20 for shard in shards)
+
+
+def test_shards_do_not_depend_on_row_order():
+    sizes = {f"drs://fake/{i}": random.randint(1, 10 ** 9) for i in range(50)}
+    uris = list(sizes)
+    shuffled = random.sample(uris, len(uris))
+    assert assign_shards(uris, 4, sizes) == assign_shards(shuffled, 4, sizes)
+    assert assign_shards(uris, 4) == assign_shards(shuffled, 4)
+
+
+def test_shards_are_balanced_by_bytes():
+    # one large object and many small ones, by count the large one would land with a quarter of the small ones
+    sizes = {"drs://fake/large": 3000}
+    sizes.update({f"drs://fake/small-{i}": 100 for i in range(90)})
+    uris = list(sizes)
+    totals = [sum(sizes[uri] for uri in select_shard(uris, index, 4, sizes)) for index in range(4)]
+    assert max(totals) - min(totals) <= 100
+    assert select_shard(uris, 0, 4, sizes) == ["drs://fake/large"]
+
+
+def test_sizes_from_the_manifest():
+    manifest = Path("tests/fixtures/manifests/terra-data.tsv")
+    uris = _extract_tsv_info(manifest, "pfb:ga4gh_drs_uri")
+    sizes = _extract_sizes(manifest, "pfb:ga4gh_drs_uri")
+    assert set(sizes) == set(uris)
+    assert all(size > 0 for size in sizes.values())
+
+
+def test_sizes_and_priorities_come_from_their_own_columns(tmp_path):
+    manifest = tmp_path / "manifest.tsv"
+    manifest.write_text(
+        "name\tfile_size_unit\tdrs_uri\tfile_size\tpriority\n"
+        "drs://fake/a\tbytes\tdrs://fake/b\t100\t2\n"
+        "c\tbytes\tdrs://fake/c\t\t1\n"
+        "d\tbytes\tdrs://fake/d\t7\t\n"
+    )
+
+    assert _extract_sizes(manifest, "drs_uri") == {"drs://fake/b": 100, "drs://fake/d": 7}
+    assert _extract_sizes(manifest, "drs_uri", "priority") == {"drs://fake/b": 2, "drs://fake/c": 1}
+    assert _extract_priorities(manifest, "drs_uri", "priority") == {"drs://fake/b": 2.0, "drs://fake/c": 1.0}
@@ -0,0 +1,76 @@
+import os
+import tempfile
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+from drs_downloader import MB
+from drs_downloader.manager import DrsAsyncManager
+from drs_downloader.models import AccessMethod
+from drs_downloader.signed_urls import expires_within, url_expiry
+from tests import FakeDrsClient
+
+
+def test_expiry_from_signed_urls():
+    gcs = (
+        "https://storage.googleapis.com/bucket/file.cram?X-Goog-Algorithm=GOOG4-RSA-SHA256"
+        "&X-Goog-Credential=pet-1234%2F20230101%2Fauto%2Fstorage%2Fgoog4_request"
+        "&X-Goog-Date=20230101T120000Z&X-Goog-Expires=3600&X-Goog-SignedHeaders=host&X-Goog-Signature=abc"
+    )
+    assert url_expiry(gcs) == datetime(2023, 1, 1, 13, 0, tzinfo=timezone.utc)
+
+    s3 = "https://bucket.s3.amazonaws.com/file?x-amz-date=20230101T120000Z&x-amz-expires=900&x-amz-signature=abc"
+    assert url_expiry(s3) == datetime(2023, 1, 1, 12, 15, tzinfo=timezone.utc)
+
+    v2 = "https://storage.googleapis.com/bucket/file?GoogleAccessId=a&Expires=1672578000&Signature=abc"
+    assert url_expiry(v2) == datetime(2023, 1, 1, 13, 0, tzinfo=timezone.utc)
+
+    assert url_expiry("https://example.org/file") is None
+    assert url_expiry("https://example.org/file?X-Goog-Date=garbage&X-Goog-Expires=3600") is None
+
+
+def test_expires_within():
+    now = datetime(2023, 1, 1, 12, 0, tzinfo=timezone.utc)
+    access_method = AccessMethod(access_url="", type="gs", expires=now + timedelta(seconds=200))
+    assert expires_within(access_method, 300, now=now)
+    assert not expires_within(access_method, 100, now=now)
+    assert not expires_within(AccessMethod(access_url="", type="gs"), 300, now=now)
+
+
+class ExpiringDrsClient(FakeDrsClient):
+    """Signed urls only work for `ttl` seconds."""
+
+    def __init__(self, contents, ttl: float, **kwargs):
+        super().__init__(contents, **kwargs)
+        self.ttl = ttl
+        self.signatures = 0
+
+    async def sign_url(self, drs_object, user_project=None, verbose=False):
+        await super().sign_url(drs_object, user_project, verbose)
+        self.signatures += 1
+        expires = datetime.now(timezone.utc) + timedelta(seconds=self.ttl)
+        drs_object.access_methods = [AccessMethod(access_url=f"https://example.org/{self.signatures}",
+                                                  type="https", expires=expires)]
+        return drs_object
+
+    async def download_part(self, drs_object, start, size, destination_path, verbose=False):
+        if drs_object.access_methods[0].expires < datetime.now(timezone.utc):
+            raise Exception("The provided token has expired")
+        return await super().download_part(drs_object, start, size, destination_path, verbose)
+
+
+def test_objects_are_signed_again_before_the_url_expires():
+    contents = {"drs://fake/large.bin": os.urandom(8 * MB)}
+    client = ExpiringDrsClient(contents, ttl=0.5, latency=0.1)
+    # one part at a time, 4 parts take longer than a url lasts
+    manager = DrsAsyncManager(
+        client, show_progress=False, max_simultaneous_downloaders=1, adaptive_concurrency=False, resign_margin=0.3
+    )
+
+    with tempfile.TemporaryDirectory() as dest:
+        drs_objects = manager.run(
+            manager.resolve_and_download(list(contents), Path(dest), user_project=None, duplicate=False,
+                                         verbose=False)
+        )
+
+    assert drs_objects[0].errors == []
+    assert client.signatures > 1
@@ -0,0 +1,64 @@
+import functools
+import os
+import tempfile
+from pathlib import Path
+
+from drs_downloader.manager import DrsAsyncManager
+from drs_downloader.models import DrsObject
+from drs_downloader.workers import balance, download_with_workers
+from tests import FakeDrsClient
+
+
+def test_balance_by_bytes():
+    sizes = [100, 10, 60, 50, 30, 20]
+    items = [(i, DrsObject(id=str(i), self_uri=str(i), checksums=[], size=size, name=str(i)))
+             for i, size in enumerate(sizes)]
+    shards = balance(items, 2)
+    assert sorted(index for shard in shards for index, _ in shard) == list(range(len(sizes)))
+    assert [sum(drs_object.size for _, drs_object in shard) for shard in shards] == [140, 130]
+    # each shard keeps manifest order
+    assert all([index for index, _ in shard] == sorted(index for index, _ in shard) for shard in shards)
+
+
+def test_download_with_workers():
+    contents = {f"drs://fake/file-{i}.txt": os.urandom(2000 + i) for i in range(6)}
+    client_factory = functools.partial(FakeDrsClient, contents)
+    manager = DrsAsyncManager(client_factory(), show_progress=False)
+
+    with tempfile.TemporaryDirectory() as dest:
+        drs_objects = manager.get_objects(list(contents), verbose=False)
+        drs_objects = download_with_workers(
+            manager, client_factory, drs_objects, Path(dest), user_project=None, duplicate=False, verbose=False,
+            workers=2,
+        )
+        assert [drs_object.id for drs_object in drs_objects] == list(contents)
+        assert all(len(drs_object.errors) == 0 for drs_object in drs_objects)
+        for drs_object in drs_objects:
+            with open(Path(dest, drs_object.name), "rb") as f:
+                assert f.read() == contents[drs_object.id]
+
+
+def test_same_bytes_stay_in_one_worker_and_savings_are_reported(tmp_path):
+    shared, other = os.urandom(3000), os.urandom(2500)
+    contents = {
+        "drs://one/a.crai": shared, "drs://two/a.crai": shared, "drs://three/a.crai": shared,
+        "drs://one/b.crai": other, "drs://two/b.crai": other, "drs://fake/c.crai": os.urandom(1000),
+    }
+    client_factory = functools.partial(FakeDrsClient, contents)
+    manager = DrsAsyncManager(client_factory(), show_progress=False)
+    drs_objects = manager.get_objects(list(contents), verbose=False)
+
+    shards = balance(list(enumerate(drs_objects)), 3)
+    assert sorted(sorted(drs_object.id for _, drs_object in shard) for shard in shards) == [
+        ["drs://fake/c.crai"], ["drs://one/a.crai", "drs://three/a.crai", "drs://two/a.crai"],
+        ["drs://one/b.crai", "drs://two/b.crai"],
+    ]
+
+    for drs_object in drs_objects:
+        drs_object.name = drs_object.id.split("/")[2] + "-" + drs_object.name
+    drs_objects = download_with_workers(
+        manager, client_factory, drs_objects, tmp_path, user_project=None, duplicate=False, verbose=False, workers=3,
+    )
+    assert all(len(drs_object.errors) == 0 for drs_object in drs_objects)
+    assert [drs_object.path for drs_object in drs_objects] == [tmp_path / drs_object.name for drs_object in drs_objects]
+    assert manager.deduplicator.objects == 3 and manager.deduplicator.bytes == 2 * 3000 + 2500
@@ -0,0 +1,112 @@
+import errno
+import os
+from pathlib import Path
+
+from drs_downloader import MB
+from drs_downloader.journal import Journal, RangeSet
+from drs_downloader.manager import DrsAsyncManager
+from drs_downloader.models import ObjectState
+from drs_downloader.writers import COPIES, PreallocatedFile, copy_into
+from tests import FakeDrsClient
+
+
+def _download(client, destination):
+    manager = DrsAsyncManager(client, show_progress=False, writer="preallocate", max_object_retries=0)
+    return manager.run(
+        manager.resolve_and_download(list(client.contents), Path(destination), user_project=None, duplicate=False,
+                                     verbose=False)
+    )
+
+
+def test_parts_are_written_in_place(tmp_path):
+    contents = {f"drs://fake/file-{i}.txt": os.urandom(1000) for i in range(3)}
+
+    drs_objects = _download(FakeDrsClient(contents), tmp_path)
+
+    assert all(drs_object.state == ObjectState.DONE for drs_object in drs_objects)
+    assert sorted(os.listdir(tmp_path)) == sorted(object_id.split("/")[-1] for object_id in contents)
+    for object_id, data in contents.items():
+        assert (tmp_path / object_id.split("/")[-1]).read_bytes() == data
+
+
+def test_interrupted_download_resumes_from_the_journal(tmp_path):
+    # 5 MB in parts of 2 MB
+    contents = {"drs://fake/file-0.txt": os.urandom(5 * MB)}
+
+    class FailingClient(FakeDrsClient):
+        async def download_part(self, drs_object, start, size, destination_path, verbose=False):
+            if start > 4 * MB:
+                raise ConnectionError("connection reset")
+            return await super().download_part(drs_object, start, size, destination_path, verbose)
+
+    drs_objects = _download(FailingClient(contents), tmp_path)
+    assert drs_objects[0].state == ObjectState.FAILED
+    assert PreallocatedFile.download_path("file-0.txt", tmp_path).exists()
+
+    client = FakeDrsClient(contents)
+    drs_objects = _download(client, tmp_path)
+
+    assert drs_objects[0].state == ObjectState.DONE
+    assert (tmp_path / "file-0.txt").read_bytes() == contents["drs://fake/file-0.txt"]
+    assert os.listdir(tmp_path) == ["file-0.txt"]
+    # the first two parts were already in the file
+    assert [event for event, _ in client.events].count("download_part") == 1
+
+
+def test_journal_of_another_layout_is_started_over(tmp_path):
+    writer = PreallocatedFile()
+    PreallocatedFile.download_path("file-0.txt", tmp_path).write_bytes(bytes(5000))
+    Journal(writer.journal_path("file-0.txt", tmp_path), 5000, 1024, RangeSet([(0, 1024)])).flush()
+
+    assert writer.existing_part_size("file-0.txt", 5000, tmp_path) == 1024
+    assert writer.prepare("file-0.txt", 5000, tmp_path, 1024).has_part(0, 1024)
+    writer.close("file-0.txt", tmp_path)
+    # a journal of another object size, or with another part size, is started over
+    assert writer.existing_part_size("file-0.txt", 6000, tmp_path) is None
+    assert not writer.prepare("file-0.txt", 5000, tmp_path, 2048).has_part(0, 1024)
+    writer.close("file-0.txt", tmp_path)
+
+
+def test_stitching_falls_back_when_the_kernel_cannot_copy(tmp_path):
+    def unsupported(*args):
+        raise OSError(errno.ENOSYS, "Function not implemented")
+
+    part = tmp_path / "file.0.100.part"
+    part.write_bytes(os.urandom(3 * MB))
+    for copies in [COPIES, [("unsupported", unsupported)] + COPIES[-1:]]:
+        destination = tmp_path / "file"
+        destination.write_bytes(b"x" * 10)
+        with open(destination, "r+b") as f:
+            copied, method = copy_into(part, f.fileno(), 10, copies=copies)
+        assert copied == 3 * MB
+        assert method == (COPIES[0][0] if copies is COPIES else "buffered")
+        assert destination.read_bytes() == b"x" * 10 + part.read_bytes()
+
+
+def test_staged_download_resumes_and_moves_the_verified_file(tmp_path):
+    contents = {"drs://fake/file-0.txt": os.urandom(5 * MB)}
+    staging, destination = tmp_path / "staging", tmp_path / "destination"
+    staging.mkdir()
+    destination.mkdir()
+
+    class FailingClient(FakeDrsClient):
+        async def download_part(self, drs_object, start, size, destination_path, verbose=False):
+            if start > 4 * MB:
+                raise ConnectionError("connection reset")
+            return await super().download_part(drs_object, start, size, destination_path, verbose)
+
+    def _staged_download(client):
+        manager = DrsAsyncManager(client, show_progress=False, max_object_retries=0, staging_path=staging)
+        return manager.run(
+            manager.resolve_and_download(list(contents), destination, user_project=None, duplicate=False,
+                                         verbose=False)
+        )
+
+    assert _staged_download(FailingClient(contents))[0].state == ObjectState.FAILED
+    assert os.listdir(destination) == [] and "file-0.txt.journal" in os.listdir(staging)
+
+    client = FakeDrsClient(contents)
+    assert _staged_download(client)[0].state == ObjectState.DONE
+    assert [event for event, _ in client.events].count("download_part") == 1
+    assert os.listdir(staging) == []
+    assert (destination / "file-0.txt").read_bytes() == contents["drs://fake/file-0.txt"]